@@ -18,14 +18,115 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 ##
 
-from .attachment import Attachment                                 # noqa: F401
-from .command_line_options import CommandLineOptions               # noqa: F401
-from .connection import Connection                                 # noqa: F401
+import importlib
+from typing import TYPE_CHECKING, Any
+
 from .constants import APP_VERSION as __version__                  # noqa: F401
-from .encryption import ENCRYPTION_PROTOCOLS                       # noqa: F401
-from .header import Header                                         # noqa: F401
-from .message import Message                                       # noqa: F401
-from .profile_message import ProfileMessage                        # noqa: F401
-from .profile_smtp import ProfileSmtp                              # noqa: F401
-from .recipient import Recipient                                   # noqa: F401
-from .yaml_profile import YamlProfile                              # noqa: F401
+
+# Public objects with the module defining them, each module is imported only
+# when one of its objects is used for the first time
+_EXPORTS = {
+    'AsyncConnection': 'async_connection',
+    'Attachment': 'attachment',
+    'AttachmentCache': 'attachment_cache',
+    'CommandLineOptions': 'command_line_options',
+    'Connection': 'connection',
+    'ConnectionPool': 'connection_pool',
+    'ConnectionSettings': 'process_sender',
+    'ENCRYPTION_PROTOCOLS': 'encryption',
+    'FileAttachment': 'file_attachment',
+    'FrozenMessage': 'message',
+    'Header': 'header',
+    'MailMerge': 'mail_merge',
+    'MergeTemplate': 'mail_merge',
+    'Message': 'message',
+    'MessageBatch': 'message_batch',
+    'Metrics': 'metrics',
+    'MetricsServer': 'metrics',
+    'Outbox': 'outbox',
+    'OutboxWorker': 'outbox',
+    'ProcessSender': 'process_sender',
+    'ProfileMessage': 'profile_message',
+    'ProfileRegistry': 'profile_registry',
+    'ProfileRouter': 'profile_router',
+    'ProfileSmtp': 'profile_smtp',
+    'RateLimitExceeded': 'rate_limiter',
+    'RateLimiter': 'rate_limiter',
+    'RawMessage': 'message',
+    'Recipient': 'recipient',
+    'RecipientList': 'recipient_list',
+    'RecipientParser': 'recipient_parser',
+    'RetryPolicy': 'retry',
+    'RetrySender': 'retry',
+    'Router': 'router',
+    'SendResult': 'send_result',
+    'SendStatus': 'process_sender',
+    'SharedRateLimiter': 'rate_limiter',
+    'SharedTokenBucket': 'rate_limiter',
+    'SubmissionClient': 'submission',
+    'SubmissionServer': 'submission',
+    'TokenBucket': 'rate_limiter',
+    'YamlProfile': 'yaml_profile',
+}
+
+__all__ = ['__version__', *_EXPORTS]
+
+if TYPE_CHECKING:
+    # Static analysis tools don't execute __getattr__
+    from .async_connection import AsyncConnection                  # noqa: F401
+    from .attachment import Attachment                             # noqa: F401
+    from .attachment_cache import AttachmentCache                  # noqa: F401
+    from .command_line_options import CommandLineOptions           # noqa: F401
+    from .connection import Connection                             # noqa: F401
+    from .connection_pool import ConnectionPool                    # noqa: F401
+    from .encryption import ENCRYPTION_PROTOCOLS                   # noqa: F401
+    from .file_attachment import FileAttachment                    # noqa: F401
+    from .header import Header                                     # noqa: F401
+    from .mail_merge import MailMerge, MergeTemplate               # noqa: F401
+    from .message import FrozenMessage, Message, RawMessage        # noqa: F401
+    from .message_batch import MessageBatch                        # noqa: F401
+    from .metrics import Metrics, MetricsServer                    # noqa: F401
+    from .outbox import Outbox, OutboxWorker                       # noqa: F401
+    from .process_sender import (ConnectionSettings,               # noqa: F401
+                                 ProcessSender,
+                                 SendStatus)
+    from .profile_message import ProfileMessage                    # noqa: F401
+    from .profile_registry import ProfileRegistry                  # noqa: F401
+    from .profile_router import ProfileRouter                      # noqa: F401
+    from .profile_smtp import ProfileSmtp                          # noqa: F401
+    from .rate_limiter import (RateLimitExceeded,                  # noqa: F401
+                               RateLimiter,
+                               SharedRateLimiter,
+                               SharedTokenBucket,
+                               TokenBucket)
+    from .recipient import Recipient                               # noqa: F401
+    from .recipient_list import RecipientList                      # noqa: F401
+    from .recipient_parser import RecipientParser                  # noqa: F401
+    from .retry import RetryPolicy, RetrySender                    # noqa: F401
+    from .router import Router                                     # noqa: F401
+    from .send_result import SendResult                            # noqa: F401
+    from .submission import (SubmissionClient,                     # noqa: F401
+                             SubmissionServer)
+    from .yaml_profile import YamlProfile                          # noqa: F401
+
+
+def __getattr__(name: str) -> Any:
+    """
+    Import a public object from its module on first use
+
+    :param name: object name
+    :return: object from its module
+    """
+    try:
+        module = _EXPORTS[name]
+    except KeyError:
+        raise AttributeError(f'module {__name__!r} has no '
+                             f'attribute {name!r}') from None
+    value = getattr(importlib.import_module(f'.{module}', __name__), name)
+    # Save the object to skip __getattr__ the next times
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted({*globals(), *_EXPORTS})
@@ -0,0 +1,423 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import asyncio
+import base64
+import contextlib
+import email.generator
+import io
+import smtplib
+import ssl
+import time
+from typing import Iterable, Optional, Union
+
+from .attachment_cache import AttachmentCache
+from .connection import Connection
+from .encryption import get_ssl_context
+from .message import FrozenMessage, Message
+from .metrics import Metrics, TimedChunks
+from .rate_limiter import RateLimitExceeded, RateLimiter
+from .send_result import SendResult
+from .smtp_data import quote_data, quote_envelope
+
+
+class AsyncConnection(object):
+    def __init__(self,
+                 server: str,
+                 port: int = 25,
+                 username: str = None,
+                 password: str = None):
+        self.server = server
+        self.port = port
+        self.username = username
+        self.password = password
+        self.context = None
+        self.attachment_cache = None
+        self.rate_limiter = None
+        self.metrics = None
+        self.extensions = {}
+        self.timeout = None
+        self._reader = None
+        self._writer = None
+        # Created while connecting, to bind it to the running event loop
+        self._lock = None
+        self._use_ssl = False
+        self._use_tls = False
+
+    def set_encryption(self,
+                       encryption: Optional[str],
+                       ciphers: Optional[str] = '') -> None:
+        """
+        Set the encryption protocol and ciphers
+
+        :param encryption: encryption method from ENCRYPTION_PROTOCOLS
+        :param ciphers: encryption ciphers for the selected protocol
+        """
+        self._use_ssl = encryption.startswith('SSL') if encryption else False
+        self._use_tls = encryption.startswith('TLS') if encryption else False
+        self.context = get_ssl_context(encryption=encryption,
+                                       ciphers=ciphers)
+
+    def set_attachment_cache(self,
+                             attachment_cache: Optional[AttachmentCache]
+                             ) -> None:
+        """
+        Set the cache used to get the encoded attachments
+
+        :param attachment_cache: AttachmentCache object or None to disable it
+        """
+        self.attachment_cache = attachment_cache
+
+    def set_rate_limiter(self,
+                         rate_limiter: Optional[RateLimiter]) -> None:
+        """
+        Set the limiter used to pace the messages sent
+
+        :param rate_limiter: RateLimiter object or None to disable it
+        """
+        self.rate_limiter = rate_limiter
+
+    def set_metrics(self,
+                    metrics: Optional[Metrics]) -> None:
+        """
+        Set the object recording the timings and the counters
+
+        :param metrics: Metrics object or None to disable it
+        """
+        self.metrics = metrics
+
+    def _measure(self,
+                 phase: str) -> contextlib.AbstractContextManager:
+        """
+        Get a context manager recording the time spent in a phase
+
+        :param phase: phase name from Metrics.PHASES
+        :return: context manager
+        """
+        return (self.metrics.measure(phase=phase)
+                if self.metrics
+                else contextlib.nullcontext())
+
+    async def _read_reply(self) -> tuple[int, bytes]:
+        """
+        Read a (multiline) reply from the server
+
+        :return: tuple with the reply code and the reply text
+        """
+        lines = []
+        while True:
+            try:
+                line = await asyncio.wait_for(self._reader.readline(),
+                                              timeout=self.timeout)
+            except asyncio.TimeoutError:
+                raise smtplib.SMTPServerDisconnected('Connection timed out')
+            if not line:
+                raise smtplib.SMTPServerDisconnected('Connection unexpectedly '
+                                                     'closed')
+            lines.append(line[4:].rstrip(b'\r\n'))
+            try:
+                code = int(line[:3])
+            except ValueError:
+                raise smtplib.SMTPResponseException(-1, line)
+            if line[3:4] != b'-':
+                return code, b'\n'.join(lines)
+
+    async def _command(self,
+                       command: str) -> tuple[int, bytes]:
+        """
+        Send a command to the server and read its reply
+
+        A command containing line breaks raises ValueError, like smtplib,
+        as it would inject other commands in the session.
+
+        :param command: command line to send without the line terminator
+        :return: tuple with the reply code and the reply text
+        """
+        if '\r' in command or '\n' in command:
+            raise ValueError(f'Invalid command {command!r}, line breaks '
+                             'are not allowed')
+        self._writer.write(command.encode('utf-8') + b'\r\n')
+        await self._writer.drain()
+        return await self._read_reply()
+
+    async def _ehlo(self) -> None:
+        """
+        Send the EHLO command and collect the server extensions
+        """
+        code, reply = await self._command('EHLO localhost')
+        if code != 250:
+            raise smtplib.SMTPHeloError(code, reply)
+        self.extensions = {}
+        for line in reply.decode('ascii', 'replace').split('\n')[1:]:
+            name, _, params = line.partition(' ')
+            self.extensions[name.lower()] = params
+
+    async def _starttls(self) -> None:
+        """
+        Upgrade the plain text connection to TLS
+        """
+        code, reply = await self._command('STARTTLS')
+        if code != 220:
+            raise smtplib.SMTPResponseException(code, reply)
+        if hasattr(self._writer, 'start_tls'):
+            await self._writer.start_tls(self.context,
+                                         server_hostname=self.server)
+        else:
+            # Python < 3.11 doesn't offer StreamWriter.start_tls
+            loop = asyncio.get_running_loop()
+            transport = self._writer.transport
+            transport = await loop.start_tls(transport,
+                                             transport.get_protocol(),
+                                             self.context,
+                                             server_hostname=self.server)
+            self._writer._transport = transport
+        await self._ehlo()
+
+    async def _login(self) -> None:
+        """
+        Authenticate with user and password using PLAIN or LOGIN methods
+        """
+        methods = self.extensions.get('auth', '').upper().split()
+        if 'PLAIN' in methods:
+            token = base64.b64encode(
+                f'\0{self.username}\0{self.password}'.encode('utf-8'))
+            code, reply = await self._command(f'AUTH PLAIN {token.decode()}')
+        elif 'LOGIN' in methods:
+            code, reply = await self._command('AUTH LOGIN')
+            for value in (self.username, self.password):
+                if code != 334:
+                    break
+                code, reply = await self._command(
+                    base64.b64encode(value.encode('utf-8')).decode())
+        else:
+            raise smtplib.SMTPNotSupportedError('No suitable authentication '
+                                                'method found')
+        if code not in (235, 503):
+            raise smtplib.SMTPAuthenticationError(code, reply)
+
+    async def connect(self,
+                      timeout: int = 30) -> None:
+        """
+        Connect to the SMTP server
+
+        :param timeout: timeout in seconds before aborting the connection
+        """
+        self.timeout = timeout
+        self._lock = asyncio.Lock()
+        try:
+            with self._measure('connect'):
+                self._reader, self._writer = await asyncio.wait_for(
+                    asyncio.open_connection(
+                        host=self.server,
+                        port=self.port,
+                        ssl=self.context if self._use_ssl else None,
+                        server_hostname=(self.server if self._use_ssl
+                                         else None)),
+                    timeout=timeout)
+                code, reply = await self._read_reply()
+                if code != 220:
+                    raise smtplib.SMTPConnectError(code, reply)
+                await self._ehlo()
+            if self._use_tls:
+                # Use TLS
+                with self._measure('tls'):
+                    await self._starttls()
+            if self.username:
+                # Authenticate with user and password
+                with self._measure('auth'):
+                    await self._login()
+        except (smtplib.SMTPException, OSError) as error:
+            if self.metrics:
+                self.metrics.increment(name='connections',
+                                       status='failed')
+                self.metrics.record_error(error=error)
+            raise
+        if self.metrics:
+            self.metrics.increment(name='connections',
+                                   status='connected')
+
+    async def disconnect(self) -> None:
+        """
+        Disconnect from the SMTP server
+        """
+        async with self._lock:
+            try:
+                await self._command('QUIT')
+            finally:
+                self._writer.close()
+                try:
+                    await self._writer.wait_closed()
+                except (ssl.SSLError, OSError):
+                    pass
+
+    async def noop(self) -> None:
+        """
+        Command to not execute anything, only used to keep alive the connection
+        """
+        async with self._lock:
+            await self._command('NOOP')
+
+    async def send(self,
+                   message: Union[Message, FrozenMessage]
+                   ) -> dict[str, tuple[int, bytes]]:
+        """
+        Send message to the server
+
+        Concurrent calls on the same connection are executed one at a time.
+        When the server supports the PIPELINING extension the envelope
+        commands are sent in a single write.
+
+        :param message: Message or FrozenMessage object to send
+        :return: dictionary with the refused recipients, like smtplib
+        """
+        sender = message._get_envelope_sender()
+        recipients = message._get_envelope_recipients()
+        # Refuse the addresses with line breaks before sending any command
+        quote_envelope(sender=sender,
+                       recipients=recipients)
+        if Connection._is_international(sender=sender,
+                                        recipients=recipients):
+            # Internationalized addresses require the SMTPUTF8 extension,
+            # like smtplib does for the Connection objects
+            if 'smtputf8' not in self.extensions:
+                raise smtplib.SMTPNotSupportedError(
+                    'One or more source or delivery addresses require '
+                    'internationalized email support, but the server does '
+                    'not advertise the required SMTPUTF8 capability')
+            options = ' BODY=8BITMIME SMTPUTF8'
+            data = self._get_international_data(message=message)
+        else:
+            options = ''
+            data = message._iter_data(attachment_cache=self.attachment_cache)
+        if self.rate_limiter:
+            # Wait without blocking the other tasks
+            delay = self.rate_limiter.reserve(
+                max_delay=self.rate_limiter.max_delay)
+            if delay is None:
+                raise RateLimitExceeded('Rate limit exceeded')
+            await asyncio.sleep(delay)
+        if not self.metrics:
+            async with self._lock:
+                return await self._transaction(sender=sender,
+                                               recipients=recipients,
+                                               data=data,
+                                               options=options)
+        result = SendResult(message=message)
+        try:
+            async with self._lock:
+                result.refused = await self._transaction(
+                    sender=sender,
+                    recipients=recipients,
+                    data=TimedChunks(data),
+                    options=options)
+        except smtplib.SMTPRecipientsRefused as error:
+            result.refused = error.recipients
+            result.error = error
+            raise
+        except (smtplib.SMTPException, OSError) as error:
+            result.error = error
+            raise
+        else:
+            result.accepted = [recipient for recipient in recipients
+                               if recipient not in result.refused]
+        finally:
+            self.metrics.record_result(result=result)
+        return result.refused
+
+    @staticmethod
+    def _get_international_data(message: Union[Message, FrozenMessage]
+                                ) -> tuple[bytes]:
+        """
+        Get the message content with the UTF-8 headers allowed by SMTPUTF8
+
+        :param message: Message or FrozenMessage object to send
+        :return: message content as a single chunk, quoted for the DATA
+                 command and including the end of data marker
+        """
+        email_message = message._to_email_message(include_bcc=False)
+        with io.BytesIO() as buffer:
+            generator = email.generator.BytesGenerator(
+                buffer,
+                policy=email_message.policy.clone(utf8=True))
+            generator.flatten(email_message, linesep='\r\n')
+            return (quote_data(buffer.getvalue()), )
+
+    async def _transaction(self,
+                           sender: str,
+                           recipients: list[str],
+                           data: Iterable[bytes],
+                           options: str = ''
+                           ) -> dict[str, tuple[int, bytes]]:
+        """
+        Execute a mail transaction
+
+        :param sender: envelope sender address
+        :param recipients: envelope recipients addresses
+        :param data: message content chunks, already quoted for the DATA
+                     command and including the end of data marker
+        :param options: MAIL command parameters, starting with a space
+        :return: dictionary with the refused recipients, like smtplib
+        """
+        envelope_start = time.perf_counter()
+        quoted_sender, quoted_recipients = quote_envelope(
+            sender=sender,
+            recipients=recipients)
+        commands = [f'MAIL FROM:{quoted_sender}{options}',
+                    *(f'RCPT TO:{recipient}'
+                      for recipient in quoted_recipients)]
+        if 'pipelining' in self.extensions:
+            envelope = ''.join(f'{command}\r\n' for command in commands)
+            self._writer.write(envelope.encode('utf-8'))
+            await self._writer.drain()
+            replies = [await self._read_reply() for _ in commands]
+        else:
+            replies = []
+            for command in commands:
+                replies.append(await self._command(command))
+                if replies[0][0] != 250:
+                    break
+        code, reply = replies[0]
+        if code != 250:
+            await self._command('RSET')
+            raise smtplib.SMTPSenderRefused(code, reply, sender)
+        refused = {recipient: reply
+                   for recipient, reply in zip(recipients, replies[1:])
+                   if reply[0] not in (250, 251)}
+        if len(refused) == len(recipients):
+            await self._command('RSET')
+            raise smtplib.SMTPRecipientsRefused(refused)
+        code, reply = await self._command('DATA')
+        if code != 354:
+            await self._command('RSET')
+            raise smtplib.SMTPDataError(code, reply)
+        data_start = time.perf_counter()
+        for chunk in data:
+            self._writer.write(chunk)
+            await self._writer.drain()
+        code, reply = await self._read_reply()
+        if self.metrics:
+            self.metrics.observe(phase='envelope',
+                                 seconds=data_start - envelope_start)
+            self.metrics.observe_chunks(
+                chunks=data,
+                elapsed=time.perf_counter() - data_start)
+        if code != 250:
+            raise smtplib.SMTPDataError(code, reply)
+        return refused
@@ -18,8 +18,10 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 ##
 
+import base64
 import dataclasses
 import pathlib
+from typing import Iterator
 
 
 @dataclasses.dataclass
@@ -28,6 +30,10 @@ class Attachment(object):
     content: bytes
     content_type: str = None
 
+    # Bytes to encode for each chunk, multiple of 57 bytes to get full
+    # base64 lines of 76 characters
+    CHUNK_SIZE = 57 * 4096
+
     @staticmethod
     def load_filename(filename: str,
                       content_type: str = 'application/octet-stream'
@@ -44,3 +50,31 @@ class Attachment(object):
         return Attachment(filename=pathlib.Path(filename).name,
                           content=content,
                           content_type=content_type)
+
+    @staticmethod
+    def encode_chunk(chunk: bytes) -> bytes:
+        """
+        Encode a content chunk in base64, with lines terminated by CRLF
+
+        :param chunk: content chunk to encode
+        :return: base64 encoded chunk
+        """
+        return base64.encodebytes(chunk).replace(b'\n', b'\r\n')
+
+    def iter_content(self) -> Iterator[bytes]:
+        """
+        Get the content in chunks of CHUNK_SIZE bytes
+
+        :return: iterator of content chunks
+        """
+        content = memoryview(self.content)
+        for offset in range(0, len(content), self.CHUNK_SIZE):
+            yield content[offset:offset + self.CHUNK_SIZE]
+
+    def iter_encoded(self) -> Iterator[bytes]:
+        """
+        Encode the content in base64 chunks, with lines terminated by CRLF
+
+        :return: iterator of base64 encoded chunks
+        """
+        return map(self.encode_chunk, self.iter_content())
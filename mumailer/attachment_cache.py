@@ -0,0 +1,232 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import hashlib
+import os
+import pathlib
+import tempfile
+from typing import Iterator, Optional, Union
+
+try:
+    import fcntl
+except ImportError:
+    # File locking is not available on Windows
+    fcntl = None
+
+from .attachment import Attachment
+from .file_attachment import FileAttachment
+
+
+class AttachmentCache(object):
+    """
+    On-disk cache of base64 encoded attachments, shared between processes
+
+    The encoded contents are stored by content hash and content type, the
+    least recently used entries are removed when the cache size exceeds
+    `max_size` bytes.
+    For FileAttachment objects the content hash is looked up from the file
+    path, size and modification time, so a cache hit doesn't even read the
+    original file.
+    """
+    # Bytes to read from the cached files for each chunk
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self,
+                 directory: str,
+                 max_size: int = 256 << 20):
+        self.directory = pathlib.Path(directory)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data_path = self.directory / 'data'
+        self._index_path = self.directory / 'index'
+        self._data_path.mkdir(parents=True, exist_ok=True)
+        self._index_path.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def _get_file_key(attachment: FileAttachment) -> str:
+        """
+        Get the index key for a file from its path, size and modification time
+
+        :param attachment: FileAttachment object
+        :return: index key
+        """
+        path = os.path.realpath(attachment.path)
+        stat = os.stat(path)
+        return hashlib.sha256(
+            f'{path}\0{stat.st_dev}\0{stat.st_ino}\0{stat.st_size}\0'
+            f'{stat.st_mtime_ns}'.encode('utf-8')).hexdigest()
+
+    def _get_digest(self,
+                    attachment: Union[Attachment, FileAttachment]
+                    ) -> Optional[str]:
+        """
+        Get the content hash for an attachment without reading the files
+
+        :param attachment: Attachment or FileAttachment object
+        :return: content hash or None if the file was not indexed yet
+        """
+        if isinstance(attachment, FileAttachment):
+            try:
+                return (self._index_path /
+                        self._get_file_key(attachment)).read_text()
+            except FileNotFoundError:
+                return None
+        return hashlib.sha256(attachment.content).hexdigest()
+
+    def _get_entry_path(self,
+                        digest: str,
+                        content_type: Optional[str]) -> pathlib.Path:
+        """
+        Get the path for a cache entry
+
+        :param digest: content hash
+        :param content_type: attachment content type
+        :return: path for the encoded content
+        """
+        type_digest = hashlib.sha256(
+            str(content_type).encode('utf-8')).hexdigest()[:16]
+        return self._data_path / digest[:2] / f'{digest}-{type_digest}'
+
+    @staticmethod
+    def _write_file(path: pathlib.Path,
+                    data: bytes) -> None:
+        """
+        Write a file atomically, using a temporary file renamed at the end
+
+        :param path: destination path
+        :param data: data to write
+        """
+        handle, temporary = tempfile.mkstemp(dir=path.parent,
+                                             prefix='.tmp-')
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                file.write(data)
+            os.replace(temporary, path)
+        finally:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+
+    def iter_encoded(self,
+                     attachment: Union[Attachment, FileAttachment]
+                     ) -> Iterator[bytes]:
+        """
+        Get the base64 encoded content for an attachment from the cache,
+        encoding and storing it if it's not cached yet
+
+        :param attachment: Attachment or FileAttachment object
+        :return: iterator of base64 encoded chunks
+        """
+        if digest := self._get_digest(attachment):
+            path = self._get_entry_path(digest=digest,
+                                        content_type=attachment.content_type)
+            try:
+                file = open(path, 'rb')
+            except FileNotFoundError:
+                pass
+            else:
+                self.hits += 1
+                with file:
+                    # Update the modification time for the LRU eviction
+                    os.utime(file.fileno())
+                    while chunk := file.read(self.CHUNK_SIZE):
+                        yield chunk
+                return
+        self.misses += 1
+        yield from self._store(attachment)
+        self.evict()
+
+    def _store(self,
+               attachment: Union[Attachment, FileAttachment]
+               ) -> Iterator[bytes]:
+        """
+        Encode the attachment content while storing it in the cache
+
+        The content is written to a temporary file, renamed to its final
+        path only after the whole content was encoded, so other processes
+        never read partial entries.
+
+        :param attachment: Attachment or FileAttachment object
+        :return: iterator of base64 encoded chunks
+        """
+        hasher = hashlib.sha256()
+        # The file key must be computed before reading the file
+        file_key = (self._get_file_key(attachment)
+                    if isinstance(attachment, FileAttachment)
+                    else None)
+        handle, temporary = tempfile.mkstemp(dir=self._data_path,
+                                             prefix='.tmp-')
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                for chunk in attachment.iter_content():
+                    hasher.update(chunk)
+                    chunk = Attachment.encode_chunk(chunk)
+                    file.write(chunk)
+                    yield chunk
+            path = self._get_entry_path(digest=hasher.hexdigest(),
+                                        content_type=attachment.content_type)
+            path.parent.mkdir(exist_ok=True)
+            os.replace(temporary, path)
+        finally:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+        if file_key:
+            self._write_file(path=self._index_path / file_key,
+                             data=hasher.hexdigest().encode('ascii'))
+
+    def get_size(self) -> int:
+        """
+        Get the total size of the cached entries
+
+        :return: size in bytes
+        """
+        return sum(path.stat().st_size
+                   for path in self._data_path.glob('*/*'))
+
+    def evict(self) -> None:
+        """
+        Remove the least recently used entries until the cache size is
+        within `max_size` bytes
+
+        The eviction is executed by a single process at a time.
+        """
+        with open(self.directory / '.lock', 'wb') as lock:
+            if fcntl:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Another process is already evicting entries
+                    return
+            entries = []
+            for path in self._data_path.glob('*/*'):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, path))
+            size = sum(entry[1] for entry in entries)
+            for _, entry_size, path in sorted(entries):
+                if size <= self.max_size:
+                    break
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                size -= entry_size
@@ -0,0 +1,144 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import argparse
+import asyncio
+import concurrent.futures
+import time
+
+from mumailer import AsyncConnection, Connection, Message, Recipient
+from mumailer.benchmarks.smtp_sink import SmtpSink
+
+
+def build_message(index: int) -> Message:
+    """
+    Build a small message for the benchmarks
+
+    :param index: message number used in the subject
+    :return: Message object
+    """
+    return Message(sender=Recipient('Sender', 'sender@example.com'),
+                   to=[Recipient('Recipient', 'recipient@example.com')],
+                   subject=f'Benchmark message {index}',
+                   body='Hello world!\n' * 20)
+
+
+def benchmark_blocking(sink: SmtpSink,
+                       messages: int,
+                       connections: int) -> float:
+    """
+    Send messages using blocking Connection objects, one per thread
+
+    :param sink: SmtpSink object to send messages to
+    :param messages: number of messages to send
+    :param connections: number of connections (and threads) to use
+    :return: elapsed time in seconds
+    """
+    def worker(count: int) -> None:
+        connection = Connection(server=sink.host,
+                                port=sink.port)
+        connection.connect()
+        for index in range(count):
+            connection.send(build_message(index))
+        connection.disconnect()
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(connections) as executor:
+        for future in [executor.submit(worker, count)
+                       for count in split(messages, connections)]:
+            future.result()
+    return time.perf_counter() - started
+
+
+def benchmark_async(sink: SmtpSink,
+                    messages: int,
+                    connections: int) -> float:
+    """
+    Send messages using AsyncConnection objects in a single thread
+
+    :param sink: SmtpSink object to send messages to
+    :param messages: number of messages to send
+    :param connections: number of concurrent connections to use
+    :return: elapsed time in seconds
+    """
+    async def worker(count: int) -> None:
+        connection = AsyncConnection(server=sink.host,
+                                     port=sink.port)
+        await connection.connect()
+        for index in range(count):
+            await connection.send(build_message(index))
+        await connection.disconnect()
+
+    async def run() -> None:
+        await asyncio.gather(*(worker(count)
+                               for count in split(messages, connections)))
+
+    started = time.perf_counter()
+    asyncio.run(run())
+    return time.perf_counter() - started
+
+
+def split(messages: int, connections: int) -> list[int]:
+    """
+    Split the messages count between the connections
+
+    :param messages: number of messages to send
+    :param connections: number of connections
+    :return: list with the number of messages for each connection
+    """
+    return [messages // connections + (1 if index < messages % connections
+                                       else 0)
+            for index in range(connections)]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare Connection and AsyncConnection throughput')
+    parser.add_argument('--messages',
+                        type=int,
+                        default=2000,
+                        help='number of messages to send')
+    parser.add_argument('--connections',
+                        type=int,
+                        nargs=argparse.ONE_OR_MORE,
+                        default=[1, 10, 100],
+                        help='number of concurrent connections')
+    parser.add_argument('--latency',
+                        type=float,
+                        default=0.001,
+                        help='simulated server reply latency in seconds')
+    options = parser.parse_args()
+    with SmtpSink(latency=options.latency) as sink:
+        for connections in options.connections:
+            for name, function in (('Connection', benchmark_blocking),
+                                   ('AsyncConnection', benchmark_async)):
+                sink.reset()
+                elapsed = function(sink=sink,
+                                   messages=options.messages,
+                                   connections=connections)
+                assert sink.messages == options.messages
+                print(f'{name:16} connections={connections:<4} '
+                      f'messages={options.messages} '
+                      f'elapsed={elapsed:.3f}s '
+                      f'rate={options.messages / elapsed:.1f} msg/s')
+
+
+if __name__ == '__main__':
+    main()
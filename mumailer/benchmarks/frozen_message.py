@@ -0,0 +1,75 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import argparse
+import os
+import time
+
+from mumailer import Attachment, Message, Recipient
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare the serialization cost for Message and '
+                    'FrozenMessage objects')
+    parser.add_argument('--sends',
+                        type=int,
+                        default=20,
+                        help='number of messages to serialize')
+    parser.add_argument('--attachments',
+                        type=int,
+                        default=2,
+                        help='number of attachments')
+    parser.add_argument('--size',
+                        type=int,
+                        default=5,
+                        help='size of each attachment in MB')
+    options = parser.parse_args()
+    message = Message(sender=Recipient('Sender', 'sender@example.com'),
+                      subject='Benchmark message',
+                      body='Hello world!\n' * 20,
+                      attachments=[
+                          Attachment(filename=f'attachment{index}.bin',
+                                     content=os.urandom(options.size << 20),
+                                     content_type='application/octet-stream')
+                          for index in range(options.attachments)])
+    started = time.process_time()
+    for index in range(options.sends):
+        message.to = [Recipient(None, f'recipient{index}@example.com')]
+        message._to_bytes()
+    elapsed_message = (time.process_time() - started) / options.sends
+    started = time.process_time()
+    frozen = message.freeze()
+    elapsed_freeze = time.process_time() - started
+    started = time.process_time()
+    for index in range(options.sends):
+        frozen.replace(to=[Recipient(None, f'recipient{index}@example.com')]
+                       )._to_bytes()
+    elapsed_frozen = (time.process_time() - started) / options.sends
+    print(f'attachments={options.attachments}x{options.size}MB '
+          f'sends={options.sends}')
+    print(f'Message       {elapsed_message * 1000:10.3f} ms CPU per send')
+    print(f'FrozenMessage {elapsed_frozen * 1000:10.3f} ms CPU per send '
+          f'(freeze {elapsed_freeze * 1000:.3f} ms once)')
+    print(f'speedup       {elapsed_message / elapsed_frozen:10.1f}x')
+
+
+if __name__ == '__main__':
+    main()
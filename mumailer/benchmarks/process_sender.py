@@ -0,0 +1,97 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import argparse
+import os
+import time
+
+from mumailer import Attachment, Message, Recipient
+from mumailer.benchmarks.smtp_sink import SmtpSinkProcess
+from mumailer.process_sender import ConnectionSettings, ProcessSender
+
+
+def build_messages(count: int,
+                   domains: int,
+                   attachment: Attachment):
+    """
+    Generate the messages for the benchmarks
+
+    :param count: number of messages to generate
+    :param domains: number of recipient domains
+    :param attachment: Attachment object to add to each message
+    :return: iterator of Message objects
+    """
+    for index in range(count):
+        yield Message(sender=Recipient('Sender', 'sender@example.com'),
+                      to=[Recipient('Recipient',
+                                    f'user{index}@domain{index % domains}.com'
+                                    )],
+                      subject=f'Benchmark message {index}',
+                      body='Hello world!\n' * 20,
+                      attachments=[attachment])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure the ProcessSender throughput for different '
+                    'numbers of processes')
+    parser.add_argument('--messages',
+                        type=int,
+                        default=2000,
+                        help='number of messages to send')
+    parser.add_argument('--processes',
+                        type=int,
+                        nargs=argparse.ONE_OR_MORE,
+                        default=[1, 2, 4],
+                        help='number of processes')
+    parser.add_argument('--domains',
+                        type=int,
+                        default=64,
+                        help='number of recipient domains')
+    parser.add_argument('--attachment-size',
+                        type=int,
+                        default=64,
+                        help='attachment size in KB')
+    options = parser.parse_args()
+    attachment = Attachment(filename='attachment.bin',
+                            content=os.urandom(options.attachment_size << 10),
+                            content_type='application/octet-stream')
+    print(f'cpus={os.cpu_count()}')
+    for processes in options.processes:
+        with SmtpSinkProcess() as sink:
+            sender = ProcessSender(
+                settings=ConnectionSettings(server=sink.host,
+                                            port=sink.port),
+                processes=processes)
+            started = time.perf_counter()
+            statuses = list(sender.send(build_messages(
+                count=options.messages,
+                domains=options.domains,
+                attachment=attachment)))
+            elapsed = time.perf_counter() - started
+        failed = sum(not status.success for status in statuses)
+        print(f'processes={processes:<3} messages={len(statuses)} '
+              f'failed={failed} received={sink.messages} '
+              f'elapsed={elapsed:.3f}s '
+              f'rate={len(statuses) / elapsed:.1f} msg/s')
+
+
+if __name__ == '__main__':
+    main()
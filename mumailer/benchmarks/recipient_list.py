@@ -0,0 +1,141 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import argparse
+import gc
+import pickle
+import time
+import tracemalloc
+from typing import Callable, Iterator, Union
+
+from mumailer import Message, Recipient, RecipientList
+
+
+def generate(count: int,
+             domains: int,
+             named: float) -> Iterator[Recipient]:
+    """
+    Generate the recipients, creating new strings for each one
+
+    :param count: number of recipients
+    :param domains: number of distinct domains
+    :param named: fraction of recipients with a name
+    :return: iterator of Recipient objects
+    """
+    every = round(1 / named) if named else 0
+    for index in range(count):
+        yield Recipient(name=(f'User {index}'
+                              if every and index % every == 0
+                              else None),
+                        address=f'user{index}@mail{index % domains}.'
+                                f'example.com')
+
+
+def build_list(recipients: Iterator[Recipient]) -> list[Recipient]:
+    return list(recipients)
+
+
+def build_recipient_list(recipients: Iterator[Recipient]) -> RecipientList:
+    return RecipientList(recipients)
+
+
+def measure(build: Callable[[Iterator[Recipient]],
+                            Union[list[Recipient], RecipientList]],
+            options: argparse.Namespace) -> dict[str, float]:
+    """
+    Measure the memory and the time to build and use the recipients
+
+    :param build: function to build the container from the recipients
+    :param options: command-line options
+    :return: dictionary with the measured values
+    """
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    recipients = build(generate(count=options.recipients,
+                                domains=options.domains,
+                                named=options.named))
+    built_time = time.perf_counter() - started
+    memory, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    message = Message(sender=Recipient('Sender', 'sender@example.com'),
+                      subject='Campaign',
+                      body='Hello world!',
+                      bcc=recipients)
+    started = time.perf_counter()
+    envelope = message._get_envelope_recipients()
+    envelope_time = time.perf_counter() - started
+    del envelope
+    started = time.perf_counter()
+    for _ in recipients:
+        pass
+    iteration_time = time.perf_counter() - started
+    started = time.perf_counter()
+    pickled = len(pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL))
+    pickle_time = time.perf_counter() - started
+    return {'memory': memory,
+            'peak': peak,
+            'build': built_time,
+            'envelope': envelope_time,
+            'iteration': iteration_time,
+            'pickled': pickled,
+            'pickle': pickle_time}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare the memory used by list[Recipient] and '
+                    'RecipientList')
+    parser.add_argument('--recipients',
+                        type=int,
+                        default=1000000,
+                        help='number of recipients')
+    parser.add_argument('--domains',
+                        type=int,
+                        default=1000,
+                        help='number of distinct domains')
+    parser.add_argument('--named',
+                        type=float,
+                        default=0.1,
+                        help='fraction of recipients with a name')
+    options = parser.parse_args()
+    print(f'recipients={options.recipients} domains={options.domains} '
+          f'named={options.named}')
+    results = {}
+    for name, build in (('list[Recipient]', build_list),
+                        ('RecipientList', build_recipient_list)):
+        results[name] = result = measure(build=build,
+                                         options=options)
+        print(f'{name:16} '
+              f'memory={result["memory"] / 1048576:8.1f} MB '
+              f'peak={result["peak"] / 1048576:8.1f} MB '
+              f'({result["memory"] / options.recipients:5.1f} B each) '
+              f'build={result["build"]:6.2f} s '
+              f'envelope={result["envelope"]:5.2f} s '
+              f'iteration={result["iteration"]:5.2f} s '
+              f'pickled={result["pickled"] / 1048576:6.1f} MB '
+              f'in {result["pickle"]:5.2f} s')
+    ratio = (results['list[Recipient]']['memory'] /
+             results['RecipientList']['memory'])
+    print(f'memory ratio {ratio:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
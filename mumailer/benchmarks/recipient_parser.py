@@ -0,0 +1,139 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import argparse
+import random
+import time
+from typing import Callable
+
+from mumailer import Recipient, RecipientParser
+
+
+def generate(count: int,
+             domains: int,
+             named: float,
+             uppercase: float,
+             duplicates: float) -> list[str]:
+    """
+    Generate a list of recipients strings
+
+    :param count: number of recipients
+    :param domains: number of distinct domains
+    :param named: fraction of recipients with a display name
+    :param uppercase: fraction of recipients with an uppercase domain
+    :param duplicates: fraction of recipients repeating a previous one
+    :return: list of recipients strings
+    """
+    randomizer = random.Random(0)
+    items = []
+    for index in range(count):
+        if items and randomizer.random() < duplicates:
+            items.append(randomizer.choice(items))
+            continue
+        domain = f'mail{index % domains}.example.com'
+        if randomizer.random() < uppercase:
+            domain = domain.upper()
+        address = f'user{index}@{domain}'
+        if randomizer.random() < named:
+            address = f'"User {index}" <{address}>'
+        items.append(address)
+    return items
+
+
+def measure(function: Callable[[list[str]], list[Recipient]],
+            items: list[str]) -> tuple[float, int]:
+    """
+    Measure the CPU time to parse the recipients
+
+    :param function: function to parse the recipients
+    :param items: recipients strings
+    :return: tuple with the CPU seconds and the number of recipients
+    """
+    started = time.process_time()
+    recipients = function(items)
+    return time.process_time() - started, len(recipients)
+
+
+def parse_as_list(items: list[str]) -> list[Recipient]:
+    return Recipient.parse_as_list(items)
+
+
+def parse_and_deduplicate(items: list[str]) -> list[Recipient]:
+    # Validation and deduplication using Recipient.parse
+    recipients = {}
+    for recipient in map(Recipient.parse, items):
+        if '@' in recipient.address:
+            recipients.setdefault(recipient.address.lower(), recipient)
+    return list(recipients.values())
+
+
+def parse_bulk(items: list[str]) -> list[Recipient]:
+    return RecipientParser().parse(items=items)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare the recipients parsing using Recipient.parse '
+                    'and RecipientParser')
+    parser.add_argument('--recipients',
+                        type=int,
+                        default=1000000,
+                        help='number of recipients to parse')
+    parser.add_argument('--domains',
+                        type=int,
+                        default=1000,
+                        help='number of distinct domains')
+    parser.add_argument('--named',
+                        type=float,
+                        default=0.2,
+                        help='fraction of recipients with a display name')
+    parser.add_argument('--uppercase',
+                        type=float,
+                        default=0.0,
+                        help='fraction of recipients with an uppercase '
+                             'domain')
+    parser.add_argument('--duplicates',
+                        type=float,
+                        default=0.05,
+                        help='fraction of duplicated recipients')
+    options = parser.parse_args()
+    items = generate(count=options.recipients,
+                     domains=options.domains,
+                     named=options.named,
+                     uppercase=options.uppercase,
+                     duplicates=options.duplicates)
+    print(f'recipients={options.recipients} domains={options.domains} '
+          f'named={options.named} uppercase={options.uppercase} '
+          f'duplicates={options.duplicates}')
+    baseline = None
+    for name, function in (('Recipient.parse_as_list', parse_as_list),
+                           ('Recipient.parse + dedup', parse_and_deduplicate),
+                           ('RecipientParser.parse', parse_bulk)):
+        elapsed, count = measure(function=function,
+                                 items=items)
+        baseline = baseline or elapsed
+        print(f'{name:24} {elapsed:8.3f} s CPU '
+              f'{elapsed * 1e9 / len(items):8.0f} ns each '
+              f'{count:9} recipients '
+              f'{baseline / elapsed:6.2f}x')
+
+
+if __name__ == '__main__':
+    main()
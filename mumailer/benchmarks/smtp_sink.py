@@ -0,0 +1,367 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import asyncio
+import multiprocessing
+import multiprocessing.connection
+import ssl
+import threading
+from typing import Optional
+
+
+class SmtpSinkProtocol(asyncio.Protocol):
+    """
+    SMTP server protocol accepting and discarding every message
+    """
+    def __init__(self, sink: 'SmtpSink'):
+        self.sink = sink
+        self.transport = None
+        self.buffer = bytearray()
+        self.replies = []
+        self.in_data = False
+        self.data_size = 0
+        self.recipients = 0
+        self.auth_steps = 0
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self.transport = transport
+        self.reply('220 localhost MuMailer sink ready')
+        self.flush()
+
+    def data_received(self, data: bytes) -> None:
+        self.buffer += data
+        while self.buffer:
+            if self.in_data:
+                if not self.receive_data():
+                    break
+            else:
+                index = self.buffer.find(b'\r\n')
+                if index < 0:
+                    break
+                line = bytes(self.buffer[:index]).decode('utf-8', 'replace')
+                del self.buffer[:index + 2]
+                if self.process_command(line):
+                    # The transport will be upgraded to TLS
+                    break
+        self.flush()
+
+    def reply(self, line: str) -> None:
+        """
+        Queue a reply line to send after processing the received data
+
+        :param line: reply line without the line terminator
+        """
+        self.replies.append(line.encode('utf-8') + b'\r\n')
+
+    def flush(self, callback=None) -> None:
+        """
+        Send the queued reply lines to the client after the configured
+        latency
+
+        :param callback: function to call after sending the replies
+        """
+        if self.replies or callback:
+            data = b''.join(self.replies)
+            self.replies.clear()
+            if self.sink.latency:
+                asyncio.get_running_loop().call_later(
+                    self.sink.latency, self.write, data, callback)
+            else:
+                self.write(data, callback)
+
+    def write(self, data: bytes, callback=None) -> None:
+        """
+        Write data to the transport and call the callback
+
+        :param data: bytes to write
+        :param callback: function to call after writing the data
+        """
+        if not self.transport.is_closing():
+            self.transport.write(data)
+            if callback:
+                callback()
+
+    def receive_data(self) -> bool:
+        """
+        Consume the message content from the buffer
+
+        :return: True if the end of data marker was found
+        """
+        index = self.buffer.find(b'\r\n.\r\n')
+        if index < 0:
+            # Keep only the bytes which could be part of the end marker
+            if len(self.buffer) > 4:
+                self.data_size += len(self.buffer) - 4
+                del self.buffer[:-4]
+            return False
+        self.data_size += index
+        del self.buffer[:index + 5]
+        self.in_data = False
+        self.sink.messages += 1
+        self.sink.recipients += self.recipients
+        self.sink.bytes += self.data_size
+        self.recipients = 0
+        self.reply('250 2.0.0 Message accepted')
+        return True
+
+    def process_command(self, line: str) -> bool:
+        """
+        Process a single command line
+
+        :param line: command line received without the line terminator
+        :return: True if the transport is being upgraded to TLS
+        """
+        if self.auth_steps:
+            self.auth_steps -= 1
+            self.reply('334 UGFzc3dvcmQ6' if self.auth_steps else
+                       '235 2.7.0 Authentication successful')
+            return False
+        command = line[:4].upper()
+        if command == 'EHLO':
+            extensions = ['PIPELINING', '8BITMIME', 'SMTPUTF8',
+                          'AUTH PLAIN LOGIN']
+            if self.sink.starttls_context and not self.is_tls():
+                extensions.append('STARTTLS')
+            if self.sink.max_recipients and self.sink.advertise_limits:
+                extensions.append(f'LIMITS RCPTMAX={self.sink.max_recipients}')
+            self.reply('250-localhost')
+            for extension in extensions[:-1]:
+                self.reply(f'250-{extension}')
+            self.reply(f'250 {extensions[-1]}')
+        elif command == 'HELO':
+            self.reply('250 localhost')
+        elif command == 'AUTH':
+            arguments = line.split()
+            if arguments[1].upper() == 'LOGIN':
+                self.auth_steps = 2
+                self.reply('334 VXNlcm5hbWU6')
+            elif len(arguments) == 2:
+                self.auth_steps = 1
+                self.reply('334 ')
+            else:
+                self.reply('235 2.7.0 Authentication successful')
+        elif command == 'MAIL':
+            self.recipients = 0
+            self.reply('250 2.1.0 Ok')
+        elif command == 'RCPT':
+            address = line[9:].strip(' <>')
+            if (self.sink.max_recipients and
+                    self.recipients >= self.sink.max_recipients):
+                self.reply('452 4.5.3 Too many recipients')
+            elif address.startswith('refuse'):
+                self.reply('550 5.1.1 Recipient refused')
+            elif (address.startswith('defer') and
+                    address not in self.sink.deferred):
+                self.sink.deferred.add(address)
+                self.reply('451 4.7.1 Recipient deferred, try again later')
+            else:
+                self.recipients += 1
+                self.reply('250 2.1.5 Ok')
+        elif command == 'DATA':
+            if self.recipients:
+                self.in_data = True
+                # The first line could be the end of data marker
+                self.buffer[0:0] = b'\r\n'
+                self.data_size = -2
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+            else:
+                self.reply('554 5.5.1 No valid recipients')
+        elif command == 'RSET':
+            self.recipients = 0
+            self.reply('250 2.0.0 Ok')
+        elif command == 'NOOP':
+            self.reply('250 2.0.0 Ok')
+        elif command == 'QUIT':
+            self.reply('221 2.0.0 Bye')
+            self.flush(callback=self.transport.close)
+        elif command == 'STAR' and self.sink.starttls_context:
+            self.reply('220 2.0.0 Ready to start TLS')
+            self.flush(callback=self.start_tls)
+            return True
+        else:
+            self.reply('502 5.5.2 Command not implemented')
+        return False
+
+    def is_tls(self) -> bool:
+        """
+        Check if the connection is encrypted
+
+        :return: True if the connection is using TLS
+        """
+        return self.transport.get_extra_info('sslcontext') is not None
+
+    def start_tls(self) -> None:
+        """
+        Upgrade the connection to TLS after the STARTTLS command
+        """
+        async def upgrade():
+            loop = asyncio.get_running_loop()
+            self.transport = await loop.start_tls(
+                self.transport, self, self.sink.starttls_context,
+                server_side=True)
+        asyncio.ensure_future(upgrade())
+
+
+class SmtpSink(object):
+    """
+    Local SMTP server running in a background thread, used for benchmarks
+
+    Every message is accepted and discarded, only counters are kept.
+    Recipients starting with "refuse" are refused, recipients starting with
+    "defer" are temporarily refused the first time only.
+    With max_recipients set, the recipients exceeding the limit in a
+    transaction are refused with the 452 reply, the limit is advertised
+    using the LIMITS extension unless advertise_limits is False.
+    """
+    def __init__(self,
+                 host: str = '127.0.0.1',
+                 port: int = 0,
+                 ssl_context: Optional[ssl.SSLContext] = None,
+                 starttls_context: Optional[ssl.SSLContext] = None,
+                 latency: float = 0.0,
+                 max_recipients: Optional[int] = None,
+                 advertise_limits: bool = True):
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        self.starttls_context = starttls_context
+        self.latency = latency
+        self.max_recipients = max_recipients
+        self.advertise_limits = advertise_limits
+        self.messages = 0
+        self.recipients = 0
+        self.bytes = 0
+        self.deferred = set()
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    def __enter__(self) -> 'SmtpSink':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        """
+        Start the server in a background thread
+        """
+        started = threading.Event()
+        self._loop = asyncio.new_event_loop()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._server = self._loop.run_until_complete(
+                self._loop.create_server(lambda: SmtpSinkProtocol(self),
+                                         host=self.host,
+                                         port=self.port,
+                                         ssl=self.ssl_context,
+                                         backlog=1024))
+            self.port = self._server.sockets[0].getsockname()[1]
+            started.set()
+            self._loop.run_forever()
+            self._server.close()
+            self._loop.run_until_complete(self._server.wait_closed())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run,
+                                        daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def stop(self) -> None:
+        """
+        Stop the server and wait for the background thread
+        """
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def reset(self) -> None:
+        """
+        Reset the counters and the deferred recipients
+        """
+        self.messages = 0
+        self.recipients = 0
+        self.bytes = 0
+        self.deferred.clear()
+
+
+class SmtpSinkProcess(object):
+    """
+    Local SMTP server running in a separate process, used for benchmarks
+    where the server must not compete for the same interpreter
+    """
+    def __init__(self,
+                 host: str = '127.0.0.1',
+                 latency: float = 0.0):
+        self.host = host
+        self.port = None
+        self.latency = latency
+        self.messages = 0
+        self.recipients = 0
+        self.bytes = 0
+        self._pipe = None
+        self._process = None
+
+    def __enter__(self) -> 'SmtpSinkProcess':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+    @staticmethod
+    def _run(host: str,
+             latency: float,
+             pipe: multiprocessing.connection.Connection) -> None:
+        """
+        Run the server until a message is received from the pipe
+
+        :param host: address to listen to
+        :param latency: simulated reply latency in seconds
+        :param pipe: pipe to communicate with the parent process
+        """
+        with SmtpSink(host=host,
+                      latency=latency) as sink:
+            pipe.send(sink.port)
+            pipe.recv()
+            pipe.send((sink.messages, sink.recipients, sink.bytes))
+
+    def start(self) -> None:
+        """
+        Start the server process
+        """
+        self._pipe, child_pipe = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=self._run,
+                                                args=(self.host,
+                                                      self.latency,
+                                                      child_pipe),
+                                                daemon=True)
+        self._process.start()
+        self.port = self._pipe.recv()
+
+    def stop(self) -> None:
+        """
+        Stop the server process and get its counters
+        """
+        self._pipe.send(None)
+        self.messages, self.recipients, self.bytes = self._pipe.recv()
+        self._process.join()
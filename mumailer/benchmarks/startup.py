@@ -0,0 +1,133 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+# Module imported by each target and the modules it must not load
+TARGETS = {
+    'package': ('mumailer',
+                ('argparse', 'asyncio', 'email', 'smtplib', 'sqlite3',
+                 'ssl', 'yaml')),
+    'cli': ('mumailer.samples.main',
+            ('asyncio', 'concurrent.futures', 'http.server',
+             'multiprocessing', 'sqlite3', 'yaml')),
+}
+
+
+def measure(module: str) -> tuple[float, float]:
+    """
+    Import a module in a new interpreter measuring its import time
+
+    :param module: module name to import
+    :return: tuple with the cumulative import time reported by
+             `-X importtime` and the interpreter wall time, in milliseconds
+    """
+    started = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime',
+                              '-c', f'import {module}'],
+                             check=True,
+                             capture_output=True,
+                             text=True)
+    elapsed = time.perf_counter() - started
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1]) / 1000, elapsed * 1000
+    raise ValueError(f'Import time not found for {module}')
+
+
+def get_loaded(module: str,
+               forbidden: tuple[str, ...]) -> list[str]:
+    """
+    Get the forbidden modules loaded by importing a module
+
+    :param module: module name to import
+    :param forbidden: modules names which must not be loaded
+    :return: list of the loaded forbidden modules
+    """
+    code = (f'import sys, {module}; '
+            f'print(",".join(name for name in {forbidden!r} '
+            f'if name in sys.modules))')
+    process = subprocess.run([sys.executable, '-c', code],
+                             check=True,
+                             capture_output=True,
+                             text=True)
+    return [name for name in process.stdout.strip().split(',') if name]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure the import time for the package and the '
+                    'command-line interface, failing on regressions')
+    parser.add_argument('--runs',
+                        type=int,
+                        default=10,
+                        help='number of interpreters to start for each '
+                             'target')
+    parser.add_argument('--max-package-ms',
+                        type=float,
+                        help='maximum import time for the package')
+    parser.add_argument('--max-cli-ms',
+                        type=float,
+                        help='maximum import time for the command-line '
+                             'interface')
+    parser.add_argument('--json',
+                        action='store_true',
+                        help='print the results as JSON')
+    options = parser.parse_args()
+    results = {}
+    failures = []
+    for target, (module, forbidden) in TARGETS.items():
+        # The first run also compiles the bytecode
+        measure(module)
+        imports, walls = zip(*(measure(module)
+                               for _ in range(options.runs)))
+        loaded = get_loaded(module=module,
+                            forbidden=forbidden)
+        results[target] = {'module': module,
+                           'import_median_ms': statistics.median(imports),
+                           'wall_median_ms': statistics.median(walls),
+                           'forbidden_loaded': loaded}
+        limit = getattr(options, f'max_{target}_ms')
+        if limit and results[target]['import_median_ms'] > limit:
+            failures.append(f'{module} import time is greater than '
+                            f'{limit}ms')
+        if loaded:
+            failures.append(f'{module} loads {", ".join(loaded)}')
+    if options.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for target, result in results.items():
+            print(f'{target:8} {result["module"]:22} '
+                  f'import={result["import_median_ms"]:.1f}ms '
+                  f'wall={result["wall_median_ms"]:.1f}ms')
+    for failure in failures:
+        print(f'Regression: {failure}', file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
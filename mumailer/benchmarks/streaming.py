@@ -0,0 +1,102 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import argparse
+import os
+import time
+import tracemalloc
+
+from mumailer import Attachment, Connection, Message, Recipient
+from mumailer.benchmarks.smtp_sink import SmtpSink
+
+
+def measure(connection: Connection,
+            message: Message,
+            streaming: bool) -> tuple[float, float, int]:
+    """
+    Send a message measuring the time to the first content byte, the total
+    time and the peak memory allocated
+
+    :param connection: connected Connection object
+    :param message: Message object to send
+    :param streaming: use the streaming send path instead of the smtplib
+                      send_message method
+    :return: tuple with time to first byte, total time and peak memory
+    """
+    smtp = connection.connection
+    send = smtp.send
+    state = {'data': False, 'first_byte': None}
+
+    def send_wrapper(data):
+        if state['data'] and state['first_byte'] is None:
+            state['first_byte'] = time.perf_counter()
+        if isinstance(data, str) and data.lower() == 'data\r\n':
+            state['data'] = True
+        send(data)
+
+    smtp.send = send_wrapper
+    tracemalloc.start()
+    started = time.perf_counter()
+    if streaming:
+        connection.send(message)
+    else:
+        smtp.send_message(msg=message._to_email_message())
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del smtp.send
+    return state['first_byte'] - started, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare the memory usage and the time to first byte '
+                    'for the streaming send path')
+    parser.add_argument('--size',
+                        type=int,
+                        default=50,
+                        help='attachment size in MB')
+    options = parser.parse_args()
+    message = Message(sender=Recipient('Sender', 'sender@example.com'),
+                      to=[Recipient('Recipient', 'recipient@example.com')],
+                      subject='Benchmark message',
+                      body='Hello world!\n' * 20,
+                      attachments=[Attachment(
+                          filename='attachment.bin',
+                          content=os.urandom(options.size << 20),
+                          content_type='application/octet-stream')])
+    with SmtpSink() as sink:
+        connection = Connection(server=sink.host,
+                                port=sink.port)
+        connection.connect()
+        for name, streaming in (('send_message', False),
+                                ('streaming', True)):
+            first_byte, elapsed, peak = measure(connection=connection,
+                                                message=message,
+                                                streaming=streaming)
+            print(f'{name:12} attachment={options.size}MB '
+                  f'first_byte={first_byte * 1000:.1f}ms '
+                  f'total={elapsed * 1000:.1f}ms '
+                  f'peak_memory={peak / (1 << 20):.1f}MB')
+        connection.disconnect()
+
+
+if __name__ == '__main__':
+    main()
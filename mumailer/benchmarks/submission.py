@@ -0,0 +1,212 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import argparse
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from mumailer import Connection, Message, Recipient, SubmissionClient
+from mumailer.benchmarks.smtp_sink import SmtpSinkProcess
+
+
+def build_message(index: int) -> Message:
+    """
+    Build a message for the benchmarks
+
+    :param index: message number
+    :return: Message object
+    """
+    return Message(sender=Recipient('Sender', 'sender@example.com'),
+                   to=[Recipient('Recipient', f'user{index}@example.com')],
+                   subject=f'Benchmark message {index}',
+                   body='Hello world!\n' * 20)
+
+
+def report(name: str,
+           latencies: list[float]) -> None:
+    """
+    Print the latency statistics
+
+    :param name: measure name
+    :param latencies: latency for each message, in seconds
+    """
+    latencies = sorted(latencies)
+    print(f'{name:<16} messages={len(latencies):<6} '
+          f'mean={statistics.mean(latencies) * 1000:8.3f} ms '
+          f'p50={latencies[len(latencies) // 2] * 1000:8.3f} ms '
+          f'p99={latencies[int(len(latencies) * 0.99)] * 1000:8.3f} ms')
+
+
+def start_server(path: str,
+                 host: str,
+                 port: int,
+                 connections: int) -> subprocess.Popen:
+    """
+    Start the submission server and wait for its socket
+
+    :param path: server socket path
+    :param host: SMTP server address
+    :param port: SMTP server port
+    :param connections: number of server connections
+    :return: Popen object for the server process
+    """
+    server = subprocess.Popen([sys.executable, '-m',
+                               'mumailer.samples.main', 'serve',
+                               '--socket', path,
+                               '--server', host,
+                               '--port', str(port),
+                               '--connections', str(connections)],
+                              stdout=subprocess.DEVNULL)
+    while not os.path.exists(path):
+        if server.poll() is not None:
+            sys.exit('The submission server failed to start')
+        time.sleep(0.01)
+    return server
+
+
+def measure_process(host: str,
+                    port: int,
+                    count: int) -> list[float]:
+    """
+    Measure a new mumailer process for each message
+
+    :param host: SMTP server address
+    :param port: SMTP server port
+    :param count: number of messages to send
+    :return: latency for each message
+    """
+    latencies = []
+    for index in range(count):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-m', 'mumailer.samples.main',
+                        '--server', host,
+                        '--port', str(port),
+                        '--sender', 'sender@example.com',
+                        '--to', f'user{index}@example.com',
+                        '--subject', f'Benchmark message {index}',
+                        '--body', 'Hello world!'],
+                       check=True)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def measure_connection(host: str,
+                       port: int,
+                       count: int) -> list[float]:
+    """
+    Measure a new Connection object for each message
+
+    :param host: SMTP server address
+    :param port: SMTP server port
+    :param count: number of messages to send
+    :return: latency for each message
+    """
+    latencies = []
+    for index in range(count):
+        message = build_message(index)
+        started = time.perf_counter()
+        connection = Connection(server=host,
+                                port=port)
+        connection.connect()
+        connection.send(message)
+        connection.disconnect()
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def measure_submit(path: str,
+                   count: int,
+                   wait: bool) -> list[float]:
+    """
+    Measure the submission of each message to the server
+
+    :param path: server socket path
+    :param count: number of messages to submit
+    :param wait: wait until each message has been sent
+    :return: latency for each message
+    """
+    latencies = []
+    with SubmissionClient(path=path) as client:
+        for index in range(count):
+            message = build_message(index)
+            started = time.perf_counter()
+            client.submit(message=message,
+                          wait=wait)
+            latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare the time to submit a message to the '
+                    'submission server and to send it directly')
+    parser.add_argument('--messages',
+                        type=int,
+                        default=2000,
+                        help='number of messages to submit')
+    parser.add_argument('--processes',
+                        type=int,
+                        default=10,
+                        help='number of messages to send using a new process '
+                             'for each one')
+    parser.add_argument('--connections',
+                        type=int,
+                        default=1,
+                        help='number of server connections')
+    options = parser.parse_args()
+    with SmtpSinkProcess() as sink:
+        with tempfile.TemporaryDirectory() as directory:
+            path = str(pathlib.Path(directory) / 'mumailer.sock')
+            server = start_server(path=path,
+                                  host=sink.host,
+                                  port=sink.port,
+                                  connections=options.connections)
+            try:
+                if options.processes:
+                    report(name='process',
+                           latencies=measure_process(host=sink.host,
+                                                     port=sink.port,
+                                                     count=options.processes))
+                report(name='connection',
+                       latencies=measure_connection(host=sink.host,
+                                                    port=sink.port,
+                                                    count=options.messages))
+                report(name='submit wait',
+                       latencies=measure_submit(path=path,
+                                                count=options.messages,
+                                                wait=True))
+                report(name='submit',
+                       latencies=measure_submit(path=path,
+                                                count=options.messages,
+                                                wait=False))
+            finally:
+                # The queued messages are sent before exiting
+                server.terminate()
+                server.wait()
+    print(f'received={sink.messages}')
+
+
+if __name__ == '__main__':
+    main()
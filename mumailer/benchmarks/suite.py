@@ -0,0 +1,317 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import argparse
+import gc
+import itertools
+import json
+import os.path
+import platform
+import random
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Optional
+
+from mumailer import Attachment, Connection, Message, Recipient, __version__
+from mumailer.benchmarks.smtp_sink import SmtpSink
+
+# Fields identifying each case in the results
+CASE_KEYS = ('body_size', 'attachments', 'recipients', 'encryption')
+
+
+def build_message(body_size: int,
+                  attachments: int,
+                  attachment_size: int,
+                  recipients: int,
+                  seed: int) -> Message:
+    """
+    Build a message with random but reproducible content
+
+    :param body_size: body size in KB
+    :param attachments: number of attachments
+    :param attachment_size: size of each attachment in KB
+    :param recipients: number of recipients
+    :param seed: random seed for the attachments content
+    :return: Message object
+    """
+    generator = random.Random(seed)
+    line = 'The quick brown fox jumps over the lazy dog.\n'
+    body = (line * ((body_size << 10) // len(line) + 1))[:body_size << 10]
+    return Message(
+        sender=Recipient('Sender', 'sender@example.com'),
+        to=[Recipient(f'Recipient {index}', f'recipient{index}@example.com')
+            for index in range(recipients)],
+        subject='Benchmark message',
+        body=body,
+        attachments=[Attachment(filename=f'attachment{index}.bin',
+                                content=generator.randbytes(
+                                    attachment_size << 10),
+                                content_type='application/octet-stream')
+                     for index in range(attachments)])
+
+
+def create_certificate(directory: str) -> Optional[tuple[str, str]]:
+    """
+    Create a self-signed certificate using the openssl command
+
+    :param directory: directory for the certificate and key files
+    :return: tuple with certificate and key files or None if the openssl
+             command is not available
+    """
+    certificate = os.path.join(directory, 'certificate.pem')
+    key = os.path.join(directory, 'key.pem')
+    try:
+        subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048',
+                        '-nodes', '-days', '1', '-subj', '/CN=localhost',
+                        '-keyout', key, '-out', certificate],
+                       check=True,
+                       capture_output=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return certificate, key
+
+
+def measure_build(message: Message,
+                  iterations: int) -> dict[str, Any]:
+    """
+    Measure the time to build the MIME message
+
+    :param message: Message object to build
+    :param iterations: number of times to build the message
+    :return: dictionary with the results
+    """
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        message._to_email_message()
+        timings.append(time.perf_counter() - started)
+    return {'build_mean_ms': statistics.mean(timings) * 1000,
+            'build_median_ms': statistics.median(timings) * 1000}
+
+
+def measure_send(sink: SmtpSink,
+                 message: Message,
+                 iterations: int) -> dict[str, Any]:
+    """
+    Measure the send throughput and the peak memory for a single message
+
+    :param sink: SmtpSink object to send messages to
+    :param message: Message object to send
+    :param iterations: number of messages to send
+    :return: dictionary with the results
+    """
+    connection = Connection(server=sink.host,
+                            port=sink.port)
+    connection.connect()
+    sink.reset()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        connection.send(message)
+    elapsed = time.perf_counter() - started
+    message_size = sink.bytes // iterations
+    tracemalloc.start()
+    connection.send(message)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    connection.disconnect()
+    return {'message_size': message_size,
+            'send_messages_per_second': iterations / elapsed,
+            'send_mb_per_second': sink.bytes / elapsed / (1 << 20),
+            'peak_memory_bytes': peak}
+
+
+def measure_connect(sink: SmtpSink,
+                    encryption: Optional[str],
+                    iterations: int) -> dict[str, Any]:
+    """
+    Measure the time to connect to the server, including the TLS handshake
+
+    :param sink: SmtpSink object to connect to
+    :param encryption: encryption method from ENCRYPTION_PROTOCOLS
+    :param iterations: number of connections to establish
+    :return: dictionary with the results
+    """
+    timings = []
+    resumed = 0
+    for _ in range(iterations):
+        connection = Connection(server=sink.host,
+                                port=sink.port)
+        connection.set_encryption(encryption=encryption)
+        if connection.context:
+            # The certificate is self-signed
+            connection.context.check_hostname = False
+            connection.context.verify_mode = ssl.CERT_NONE
+        started = time.perf_counter()
+        connection.connect()
+        timings.append(time.perf_counter() - started)
+        resumed += bool(connection.session_reused)
+        connection.disconnect()
+    return {'encryption': encryption,
+            'connect_mean_ms': statistics.mean(timings) * 1000,
+            'connect_median_ms': statistics.median(timings) * 1000,
+            'sessions_resumed': resumed}
+
+
+def run(options: argparse.Namespace) -> dict[str, Any]:
+    """
+    Run the benchmarks for every case of the matrix
+
+    :param options: command-line options
+    :return: dictionary with the parameters and the results
+    """
+    results = {'mumailer': __version__,
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+               'parameters': vars(options),
+               'messages': [],
+               'connections': []}
+    gc.collect()
+    with SmtpSink() as sink:
+        for body_size, attachments, recipients in itertools.product(
+                options.body_sizes, options.attachments, options.recipients):
+            message = build_message(body_size=body_size,
+                                    attachments=attachments,
+                                    attachment_size=options.attachment_size,
+                                    recipients=recipients,
+                                    seed=options.seed)
+            case = {'body_size': body_size,
+                    'attachments': attachments,
+                    'recipients': recipients}
+            case.update(measure_build(message=message,
+                                      iterations=options.iterations))
+            case.update(measure_send(sink=sink,
+                                     message=message,
+                                     iterations=options.iterations))
+            results['messages'].append(case)
+            print(case, file=sys.stderr)
+        results['connections'].append(measure_connect(
+            sink=sink,
+            encryption=None,
+            iterations=options.connections))
+    with tempfile.TemporaryDirectory() as directory:
+        if files := create_certificate(directory=directory):
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(*files)
+            for encryption, arguments in (
+                    ('SSLv23', {'ssl_context': context}),
+                    ('TLS', {'starttls_context': context})):
+                with SmtpSink(**arguments) as sink:
+                    results['connections'].append(measure_connect(
+                        sink=sink,
+                        encryption=encryption,
+                        iterations=options.connections))
+        else:
+            print('The openssl command is not available, the TLS benchmarks '
+                  'are skipped', file=sys.stderr)
+    for case in results['connections']:
+        print(case, file=sys.stderr)
+    return results
+
+
+def compare(results: dict[str, Any],
+            baseline: dict[str, Any]) -> None:
+    """
+    Print the relative change of each result from a previous run
+
+    :param results: results from the current run
+    :param baseline: results from a previous run
+    """
+    for section in ('messages', 'connections'):
+        previous = {tuple(case.get(key) for key in CASE_KEYS): case
+                    for case in baseline.get(section, [])}
+        for case in results[section]:
+            key = tuple(case.get(key) for key in CASE_KEYS)
+            if (old := previous.get(key)) is None:
+                continue
+            changes = ' '.join(
+                f'{name}={(value - old[name]) / old[name] * 100:+.1f}%'
+                for name, value in case.items()
+                if name not in CASE_KEYS and old.get(name))
+            print(section,
+                  {name: value for name, value in zip(CASE_KEYS, key)
+                   if value is not None},
+                  changes)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run the benchmarks for a matrix of messages and save '
+                    'the results as JSON')
+    parser.add_argument('--body-sizes',
+                        type=int,
+                        nargs='+',
+                        default=[1, 100],
+                        help='body sizes in KB')
+    parser.add_argument('--attachments',
+                        type=int,
+                        nargs='+',
+                        default=[0, 1, 4],
+                        help='number of attachments')
+    parser.add_argument('--attachment-size',
+                        type=int,
+                        default=256,
+                        help='size of each attachment in KB')
+    parser.add_argument('--recipients',
+                        type=int,
+                        nargs='+',
+                        default=[1, 10, 100],
+                        help='number of recipients')
+    parser.add_argument('--iterations',
+                        type=int,
+                        default=20,
+                        help='messages to build and send for each case')
+    parser.add_argument('--connections',
+                        type=int,
+                        default=20,
+                        help='connections to establish for each encryption')
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0,
+                        help='random seed for the attachments content')
+    parser.add_argument('--output',
+                        type=str,
+                        help='JSON file to save the results (default to '
+                             'standard output)')
+    parser.add_argument('--compare',
+                        type=str,
+                        help='JSON file with the results of a previous run '
+                             'to compare with')
+    options = parser.parse_args()
+    results = run(options=options)
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    if options.compare:
+        with open(options.compare, 'r') as file:
+            compare(results=results,
+                    baseline=json.load(file))
+
+
+if __name__ == '__main__':
+    main()
@@ -25,7 +25,7 @@ from typing import Optional
 from .constants import APP_NAME, APP_VERSION, APP_DESCRIPTION
 from .encryption import ENCRYPTION_PROTOCOLS
 from .header import Header
-from .recipient import Recipient
+from .recipient_parser import RecipientParser
 
 
 class CommandLineOptions(object):
@@ -40,16 +40,17 @@ class CommandLineOptions(object):
                                  action='version',
                                  version=f'{APP_NAME} v{APP_VERSION}')
 
-    def _recipient_type(self, option: str) -> Recipient:
+    def _recipient_type(self, option: str) -> str:
         """
         Validate recipient type option
 
-        :param option: recipient string in the form "Name address" or "address"
+        :param option: recipient string in the form "Name address",
+                       "Name <address>" or "address"
         :return: recipient string if the option is valid or raise
                  ArgumentTypeError
         """
-        recipient = Recipient.parse(option)
-        if '@' not in recipient.address:
+        _, address = RecipientParser.split(option)
+        if not RecipientParser.is_valid(address):
             raise argparse.ArgumentTypeError(f'Invalid recipient {option}')
         return option
 
@@ -84,6 +85,17 @@ class CommandLineOptions(object):
                            required=False,
                            type=str,
                            help='profile file with SMTP settings')
+        group.add_argument('--profile-registry',
+                           required=False,
+                           type=str,
+                           help='profile file or directory with many named '
+                                'profiles, the profile-smtp and '
+                                'profile-message options are used as names')
+        group.add_argument('--profile-router',
+                           required=False,
+                           type=str,
+                           help='profile file with the SMTP profiles to use '
+                                'for each recipient domain')
         group.add_argument('--server',
                            required=False,
                            type=str,
@@ -147,6 +159,24 @@ class CommandLineOptions(object):
                            default=[],
                            nargs=argparse.ZERO_OR_MORE,
                            help='Message recipient name and address for BCC')
+        group.add_argument('--to-file',
+                           required=False,
+                           type=str,
+                           help='Get the message recipients from the '
+                                'specified file, one for each line, or '
+                                'from stdin using -')
+        group.add_argument('--cc-file',
+                           required=False,
+                           type=str,
+                           help='Get the message recipients for CC from the '
+                                'specified file, one for each line, or '
+                                'from stdin using -')
+        group.add_argument('--bcc-file',
+                           required=False,
+                           type=str,
+                           help='Get the message recipients for BCC from the '
+                                'specified file, one for each line, or '
+                                'from stdin using -')
 
     def add_message_arguments(self) -> None:
         """
@@ -193,6 +223,102 @@ class CommandLineOptions(object):
                            nargs=argparse.ZERO_OR_MORE,
                            help='Additional header for the message')
 
+    def add_outbox_arguments(self) -> None:
+        """
+        Add outbox command-line options
+        """
+        group = self.add_group('outbox')
+        group.add_argument('--outbox',
+                           required=False,
+                           type=str,
+                           help='add the message to the outbox file '
+                                'instead of sending it')
+
+    def add_batch_arguments(self) -> None:
+        """
+        Add batch command-line options
+        """
+        group = self.add_group('batch')
+        group.add_argument('--batch',
+                           required=False,
+                           type=str,
+                           help='send a message for each line of the JSON '
+                                'Lines file, or from stdin using -, with the '
+                                'other options as defaults')
+        group.add_argument('--connections',
+                           required=False,
+                           type=int,
+                           help='number of SMTP connections to use for the '
+                                'batch (default 1)')
+        group.add_argument('--batch-size',
+                           required=False,
+                           type=int,
+                           help='number of messages to send for each '
+                                'connection use (default 100)')
+
+    def add_serve_arguments(self) -> None:
+        """
+        Add submission server command-line options
+        """
+        group = self.add_group('serve')
+        group.add_argument('--socket',
+                           required=True,
+                           type=str,
+                           help='Unix domain socket path to accept the '
+                                'messages')
+        group.add_argument('--connections',
+                           required=False,
+                           type=int,
+                           default=1,
+                           help='number of SMTP connections to keep open')
+        group.add_argument('--batch-size',
+                           required=False,
+                           type=int,
+                           default=100,
+                           help='maximum number of messages to send for '
+                                'each batch')
+
+    def add_queue_arguments(self) -> None:
+        """
+        Add outbox queue command-line options
+        """
+        group = self.add_group('queue')
+        group.add_argument('action',
+                           type=str,
+                           choices=('run', 'stats', 'recover', 'purge'),
+                           help='action to execute on the outbox')
+        group.add_argument('--outbox',
+                           required=True,
+                           type=str,
+                           help='outbox file with the queued messages')
+        group.add_argument('--workers',
+                           required=False,
+                           type=int,
+                           default=1,
+                           help='number of sending threads')
+        group.add_argument('--connections',
+                           required=False,
+                           type=int,
+                           default=1,
+                           help='number of SMTP connections to keep open')
+        group.add_argument('--batch-size',
+                           required=False,
+                           type=int,
+                           default=100,
+                           help='number of messages to send for each batch')
+        group.add_argument('--max-attempts',
+                           required=False,
+                           type=int,
+                           default=10,
+                           help='attempts before a message is marked as '
+                                'failed')
+        group.add_argument('--until-empty',
+                           required=False,
+                           action='store_true',
+                           default=False,
+                           help='stop when no more messages are ready to be '
+                                'sent')
+
     def parse_options(self) -> argparse.Namespace:
         """
         Parse command-line options
@@ -205,25 +331,76 @@ class CommandLineOptions(object):
             self.parser.print_help()
             self.parser.exit(1)
         # Check if profile-smtp or server/port arguments options are set
-        if not self.options.profile_smtp and not all([self.options.server,
-                                                      self.options.port]):
-            raise argparse.ArgumentTypeError('Missing profile-smtp or '
+        # (not needed when the message is added to the outbox or when the
+        # recipients are routed)
+        if (not getattr(self.options, 'outbox', None) and
+                not self.options.profile_router and
+                not self.options.profile_smtp and
+                not all([self.options.server, self.options.port])):
+            raise argparse.ArgumentTypeError('Missing profile-smtp, '
+                                             'profile-router or '
                                              'server+port options')
         # Check if profile-message or sender argument option is set
-        if not self.options.profile_message and not self.options.sender:
+        # (the batch messages can set their own sender)
+        batch = getattr(self.options, 'batch', None)
+        if (not self.options.profile_message and
+                not self.options.sender and
+                not batch):
             raise argparse.ArgumentTypeError('Missing profile-message or '
                                              'sender option')
+        # Check if the batch is sent directly
+        if batch and (getattr(self.options, 'outbox', None) or
+                      self.options.profile_router):
+            raise argparse.ArgumentTypeError('The batch option cannot be '
+                                             'used with outbox or '
+                                             'profile-router options')
+        if batch and batch != '-' and not pathlib.Path(batch).is_file():
+            raise argparse.ArgumentTypeError('The batch specified does not '
+                                             'exist')
+        if batch:
+            # Apply the defaults only for the batch, to keep the options
+            # empty when no option was set
+            if self.options.connections is None:
+                self.options.connections = 1
+            if self.options.batch_size is None:
+                self.options.batch_size = 100
+        # Check if the profile-registry file or directory exists
+        if (self.options.profile_registry and
+                not pathlib.Path(self.options.profile_registry).exists()):
+            raise argparse.ArgumentTypeError('The profile-registry specified '
+                                             'does not exist')
         # Check if the profile-smtp file exists
         if (self.options.profile_smtp and
+                not self.options.profile_registry and
                 not pathlib.Path(self.options.profile_smtp).is_file()):
             raise argparse.ArgumentTypeError('The profile-smtp specified '
                                              'does not exist')
+        # Check if the profile-router file exists
+        if (self.options.profile_router and
+                not pathlib.Path(self.options.profile_router).is_file()):
+            raise argparse.ArgumentTypeError('The profile-router specified '
+                                             'does not exist')
         # Check if the profile-message file exists
         if (self.options.profile_message and
+                not self.options.profile_registry and
                 not pathlib.Path(self.options.profile_message).is_file()):
             raise argparse.ArgumentTypeError('The profile-message specified '
                                              'does not exist')
 
+        # Check if the recipients files exist
+        for option in ('to_file', 'cc_file', 'bcc_file'):
+            filename = getattr(self.options, option)
+            if (filename and filename != '-' and
+                    not pathlib.Path(filename).is_file()):
+                raise argparse.ArgumentTypeError(
+                    f'The {option.replace("_", "-")} specified does not '
+                    'exist')
+        if [self.options.to_file,
+                self.options.cc_file,
+                self.options.bcc_file].count('-') > 1:
+            raise argparse.ArgumentTypeError('Only a recipients file can be '
+                                             'read from stdin')
+
         # Check the content_type arguments
         # It must be one of the following:
         # - zero values = no content type
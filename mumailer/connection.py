@@ -18,15 +18,30 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 ##
 
+import collections
+import contextlib
+import itertools
 import smtplib
 import ssl
-from typing import Optional
+import time
+from typing import Iterable, Iterator, Optional, Union
 
-from .encryption import ENCRYPTION_PROTOCOLS
-from .message import Message
+from .attachment_cache import AttachmentCache
+from .encryption import SessionContext, get_ssl_context, set_tls_session
+from .message import FrozenMessage, Message
+from .metrics import Metrics, TimedChunks
+from .rate_limiter import RateLimitExceeded, RateLimiter
+from .send_result import SendResult
+from .smtp_data import quote_address, quote_envelope
 
 
 class Connection(object):
+    # Minimum size for each write to the socket
+    WRITE_BUFFER_SIZE = 65536
+    # Recipients for each transaction when the server doesn't advertise its
+    # limit, every server must accept at least 100 recipients (RFC 5321)
+    MAX_RECIPIENTS = 100
+
     def __init__(self,
                  server: str,
                  port: int = 25,
@@ -38,6 +53,12 @@ class Connection(object):
         self.password = password
         self.connection = None
         self.context = None
+        self.attachment_cache = None
+        self.rate_limiter = None
+        self.metrics = None
+        self.max_recipients = self.MAX_RECIPIENTS
+        # Whether the last TLS handshake resumed a previous session
+        self.session_reused = None
         self._use_ssl = False
         self._use_tls = False
 
@@ -47,15 +68,89 @@ class Connection(object):
         """
         Set the encryption protocol and ciphers
 
+        The SSLContext object is shared by the connections using the same
+        protocol and ciphers, so the TLS sessions can be resumed.
+
         :param encryption: encryption method from ENCRYPTION_PROTOCOLS
         :param ciphers: encryption ciphers for the selected protocol
         """
         self._use_ssl = encryption.startswith('SSL') if encryption else False
         self._use_tls = encryption.startswith('TLS') if encryption else False
-        if protocol := ENCRYPTION_PROTOCOLS.get(encryption):
-            self.context = ssl.SSLContext(protocol=protocol)
-            if ciphers:
-                self.context.set_ciphers(ciphers)
+        self.context = get_ssl_context(encryption=encryption,
+                                       ciphers=ciphers)
+
+    def set_attachment_cache(self,
+                             attachment_cache: Optional[AttachmentCache]
+                             ) -> None:
+        """
+        Set the cache used to get the encoded attachments
+
+        :param attachment_cache: AttachmentCache object or None to disable it
+        """
+        self.attachment_cache = attachment_cache
+
+    def set_rate_limiter(self,
+                         rate_limiter: Optional[RateLimiter]) -> None:
+        """
+        Set the limiter used to pace the messages sent
+
+        The same RateLimiter object can be shared between many connections
+        using the same account.
+
+        :param rate_limiter: RateLimiter object or None to disable it
+        """
+        self.rate_limiter = rate_limiter
+
+    def set_max_recipients(self,
+                           max_recipients: Optional[int]) -> None:
+        """
+        Set the maximum number of recipients for each transaction, the
+        messages with more recipients are sent using many transactions
+
+        The lower limit advertised by the server using the LIMITS extension
+        is used in place of this value.
+
+        :param max_recipients: maximum number of recipients or None to use
+                               only the limit advertised by the server
+        """
+        self.max_recipients = max_recipients
+
+    def get_max_recipients(self) -> Optional[int]:
+        """
+        Get the maximum number of recipients for each transaction
+
+        :return: maximum number of recipients or None for no limits
+        """
+        limit = self.max_recipients
+        self.connection.ehlo_or_helo_if_needed()
+        if self.connection.has_extn('limits'):
+            # LIMITS extension (RFC 9422), like RCPTMAX=100 MAILMAX=1000
+            for item in self.connection.esmtp_features['limits'].split():
+                name, _, value = item.partition('=')
+                if name.upper() == 'RCPTMAX' and value.isdigit():
+                    limit = min(limit or int(value), int(value))
+        return limit
+
+    def set_metrics(self,
+                    metrics: Optional[Metrics]) -> None:
+        """
+        Set the object recording the timings and the counters
+
+        :param metrics: Metrics object or None to disable it
+        """
+        self.metrics = metrics
+
+    def _measure(self,
+                 phase: str) -> contextlib.AbstractContextManager:
+        """
+        Get a context manager recording the time spent in a phase
+
+        :param phase: phase name from Metrics.PHASES
+        :return: context manager
+        """
+        return (self.metrics.measure(phase=phase)
+                if self.metrics
+                else contextlib.nullcontext())
 
     def connect(self,
                 timeout: int = 30) -> None:
@@ -64,29 +159,68 @@ class Connection(object):
 
         :param timeout: timeout in seconds before aborting the connection
         """
-        if not self._use_ssl:
-            # Use plain text
-            self.connection = smtplib.SMTP(host=self.server,
-                                           port=self.port,
-                                           timeout=timeout)
-        else:
-            # Use SSL
-            self.connection = smtplib.SMTP_SSL(host=self.server,
-                                               port=self.port,
-                                               timeout=timeout,
-                                               context=self.context)
-        if self._use_tls:
-            # Use TLS
-            self.connection.starttls(context=self.context)
-        if self.username:
-            # Authenticate with user and password
-            self.connection.login(user=self.username,
-                                  password=self.password)
+        # Resume the last TLS session with the same server, if any
+        context = (SessionContext(context=self.context,
+                                  server=self.server,
+                                  port=self.port)
+                   if self.context else None)
+        self.session_reused = None
+        try:
+            with self._measure('connect'):
+                if not self._use_ssl:
+                    # Use plain text
+                    self.connection = smtplib.SMTP(host=self.server,
+                                                   port=self.port,
+                                                   timeout=timeout)
+                else:
+                    # Use SSL
+                    self.connection = smtplib.SMTP_SSL(host=self.server,
+                                                       port=self.port,
+                                                       timeout=timeout,
+                                                       context=context)
+                self.connection.ehlo_or_helo_if_needed()
+            if self._use_tls:
+                # Use TLS
+                with self._measure('tls'):
+                    self.connection.starttls(context=context)
+            if self.username:
+                # Authenticate with user and password
+                with self._measure('auth'):
+                    self.connection.login(user=self.username,
+                                          password=self.password)
+        except (smtplib.SMTPException, OSError) as error:
+            if self.metrics:
+                self.metrics.increment(name='connections',
+                                       status='failed')
+                self.metrics.record_error(error=error)
+            raise
+        if isinstance(self.connection.sock, ssl.SSLSocket):
+            self.session_reused = self.connection.sock.session_reused
+            self._save_tls_session()
+            if self.metrics:
+                self.metrics.increment(
+                    name='tls_handshakes',
+                    resumed='true' if self.session_reused else 'false')
+        if self.metrics:
+            self.metrics.increment(name='connections',
+                                   status='connected')
+
+    def _save_tls_session(self) -> None:
+        """
+        Save the current TLS session to resume it in the next connections
+        """
+        if isinstance(self.connection.sock, ssl.SSLSocket):
+            set_tls_session(context=self.context,
+                            server=self.server,
+                            port=self.port,
+                            session=self.connection.sock.session)
 
     def disconnect(self) -> None:
         """
         Disconnect from the SMTP server
         """
+        # The TLS 1.3 session tickets can be received after the handshake
+        self._save_tls_session()
         self.connection.quit()
 
     def noop(self) -> None:
@@ -96,10 +230,627 @@ class Connection(object):
         self.connection.noop()
 
     def send(self,
-             message: Message) -> None:
+             message: Union[Message, FrozenMessage],
+             recipients: Optional[list[str]] = None
+             ) -> dict[str, tuple[int, bytes]]:
         """
         Send message to the server
 
-        :param message: Message object to send
+        The recipients refused for too many recipients (452 reply) are sent
+        again in the following transactions.
+
+        :param message: Message or FrozenMessage object to send
+        :param recipients: envelope recipients addresses to use instead of
+                           the message recipients
+        :return: dictionary with the refused recipients, like smtplib
+        """
+        sender = message._get_envelope_sender()
+        if recipients is None:
+            recipients = message._get_envelope_recipients()
+        # Refuse the addresses with line breaks before sending any command
+        quote_envelope(sender=sender,
+                       recipients=recipients)
+        limit = self.get_max_recipients()
+        if limit and len(recipients) > limit:
+            # Too many recipients for a single transaction
+            result = self.send_chunked(message=message,
+                                       recipients=recipients)
+            if result.error is not None and not result.accepted:
+                raise result.error
+            return result.refused
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        if self._is_international(sender=sender,
+                                  recipients=recipients):
+            # Internationalized addresses require the SMTPUTF8 handling
+            # from smtplib
+            send = self._send_international
+        else:
+            # Stream the message content while it's being serialized
+            send = self._send_data
+        if not self.metrics:
+            refused = send(message=message,
+                           sender=sender,
+                           recipients=recipients)
+            deferred = self._send_deferred(
+                message=message,
+                sender=sender,
+                refused=refused,
+                limit=len(recipients) - len(refused))
+            refused.update(deferred.refused)
+            return refused
+        result = SendResult(message=message)
+        try:
+            result.refused = send(message=message,
+                                  sender=sender,
+                                  recipients=recipients)
+            deferred = self._send_deferred(
+                message=message,
+                sender=sender,
+                refused=result.refused,
+                limit=len(recipients) - len(result.refused))
+            result.refused.update(deferred.refused)
+        except smtplib.SMTPRecipientsRefused as error:
+            result.refused = error.recipients
+            result.error = error
+            raise
+        except (smtplib.SMTPException, OSError) as error:
+            result.error = error
+            raise
+        else:
+            result.accepted = [recipient for recipient in recipients
+                               if recipient not in result.refused]
+        finally:
+            self.metrics.record_result(result=result)
+        return result.refused
+
+    def send_chunked(self,
+                     message: Union[Message, FrozenMessage],
+                     recipients: Optional[Iterable[str]] = None
+                     ) -> SendResult:
+        """
+        Send a message splitting its recipients in many transactions, within
+        the maximum recipients for each transaction
+
+        The message content is serialized only once and sent again for each
+        transaction. The recipients refused by the server for too many
+        recipients (452 reply) are sent in the following transaction.
+        The recipients are read lazily, a transaction at a time, so they can
+        be generated while the message is being sent, and the recipients
+        with line breaks are refused without sending them.
+
+        :param message: Message or FrozenMessage object to send
+        :param recipients: envelope recipients addresses to use instead of
+                           the message recipients
+        :return: SendResult object with the accepted and refused recipients
+        """
+        if recipients is None:
+            recipients = message._get_envelope_recipients()
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        result = self._send_chunked(message=message,
+                                    sender=message._get_envelope_sender(),
+                                    recipients=recipients,
+                                    limit=self.get_max_recipients())
+        if self.metrics:
+            self.metrics.record_result(result=result)
+        return result
+
+    def _send_chunked(self,
+                      message: Union[Message, FrozenMessage],
+                      sender: str,
+                      recipients: Iterable[str],
+                      limit: Optional[int]) -> SendResult:
+        """
+        Send a message splitting its recipients in many transactions
+
+        :param message: Message or FrozenMessage object to send
+        :param sender: envelope sender address
+        :param recipients: envelope recipients addresses
+        :param limit: maximum recipients for each transaction or None
+        :return: SendResult object with the accepted and refused recipients
+        """
+        result = SendResult(message=message)
+        try:
+            quote_address(sender)
+        except ValueError as error:
+            result.error = error
+            return result
+        recipients = self._valid_recipients(recipients=recipients,
+                                            result=result)
+        content = None
+        pending = collections.deque()
+        while True:
+            # Read a recipient more than the transaction limit, to know if
+            # another transaction will follow
+            pending.extend(itertools.islice(recipients,
+                                            max(limit + 1 - len(pending), 0))
+                           if limit
+                           else recipients)
+            if not pending:
+                break
+            batch = [pending.popleft()
+                     for _ in range(min(limit or len(pending),
+                                        len(pending)))]
+            international = self._is_international(sender=sender,
+                                                   recipients=batch)
+            if not international and content is None and pending:
+                # Serialize the content once for all the transactions
+                content = b''.join(message._iter_data(
+                    attachment_cache=self.attachment_cache))
+            try:
+                if international:
+                    refused = self._send_international(message=message,
+                                                       sender=sender,
+                                                       recipients=batch)
+                else:
+                    refused = self._send_data(
+                        message=message,
+                        sender=sender,
+                        recipients=batch,
+                        chunks=(content, ) if content is not None else None)
+            except smtplib.SMTPRecipientsRefused as error:
+                refused = error.recipients
+            except smtplib.SMTPResponseException as error:
+                # The transaction failed for every recipient in the batch
+                result.error = error
+                refused = {recipient: (error.smtp_code, error.smtp_error)
+                           for recipient in batch}
+            except (smtplib.SMTPException, OSError) as error:
+                # Connection error, nothing else can be sent
+                result.error = error
+                reply = (-1, str(error).encode('utf-8'))
+                for recipient in itertools.chain(batch, pending, recipients):
+                    result.refused[recipient] = reply
+                break
+            deferred = [recipient for recipient in batch
+                        if refused.get(recipient, (0, ))[0] == 452]
+            if deferred and len(deferred) < len(batch):
+                # Too many recipients, use the accepted count as new limit
+                pending.extendleft(reversed(deferred))
+                limit = len(batch) - len(deferred)
+                for recipient in deferred:
+                    del refused[recipient]
+            for recipient in batch:
+                if recipient in refused:
+                    result.refused[recipient] = refused[recipient]
+                elif recipient not in deferred:
+                    result.accepted.append(recipient)
+        if (result.error is None and not result.accepted and
+                result.refused):
+            result.error = smtplib.SMTPRecipientsRefused(result.refused)
+        return result
+
+    def _send_deferred(self,
+                       message: Union[Message, FrozenMessage],
+                       sender: str,
+                       refused: dict[str, tuple[int, bytes]],
+                       limit: int) -> SendResult:
+        """
+        Send again the recipients refused for too many recipients (452
+        reply) in the following transactions, like send_chunked does
+
+        :param message: Message or FrozenMessage object to send
+        :param sender: envelope sender address
+        :param refused: dictionary with the refused recipients, the deferred
+                        recipients are removed from it
+        :param limit: number of recipients accepted by the last transaction,
+                      used as limit for the following transactions
+        :return: SendResult object with the deferred recipients accepted
+                 and refused again
+        """
+        deferred = [recipient
+                    for recipient, (code, _) in refused.items()
+                    if code == 452]
+        if not deferred or limit <= 0:
+            # No recipients deferred or the server accepted no recipients,
+            # the 452 replies are kept as temporary failures
+            return SendResult(message=message)
+        for recipient in deferred:
+            del refused[recipient]
+        return self._send_chunked(message=message,
+                                  sender=sender,
+                                  recipients=deferred,
+                                  limit=limit)
+
+    @staticmethod
+    def _valid_recipients(recipients: Iterable[str],
+                          result: SendResult) -> Iterator[str]:
         """
-        self.connection.send_message(msg=message._to_email_message())
+        Filter the recipients with line breaks, setting them as refused
+
+        :param recipients: envelope recipients addresses
+        :param result: SendResult object to update with the refused
+                       recipients
+        :return: iterator with the valid recipients
+        """
+        for recipient in recipients:
+            try:
+                quote_address(recipient)
+            except ValueError as error:
+                result.refused[recipient] = (501, str(error).encode('utf-8'))
+            else:
+                yield recipient
+
+    def _send_international(self,
+                            message: Union[Message, FrozenMessage],
+                            sender: str,
+                            recipients: list[str]
+                            ) -> dict[str, tuple[int, bytes]]:
+        """
+        Send a message with internationalized addresses using smtplib
+
+        :param message: Message or FrozenMessage object to send
+        :param sender: envelope sender address
+        :param recipients: envelope recipients addresses
+        :return: dictionary with the refused recipients, like smtplib
+        """
+        with self._measure('build'):
+            email_message = message._to_email_message(include_bcc=False)
+        return self.connection.send_message(msg=email_message,
+                                            from_addr=sender,
+                                            to_addrs=recipients)
+
+    def _send_data(self,
+                   message: Union[Message, FrozenMessage],
+                   sender: str,
+                   recipients: list[str],
+                   chunks: Optional[Iterable[bytes]] = None
+                   ) -> dict[str, tuple[int, bytes]]:
+        """
+        Execute a mail transaction streaming the message content while it's
+        being serialized
+
+        :param message: Message or FrozenMessage object to send
+        :param sender: envelope sender address
+        :param recipients: envelope recipients addresses
+        :param chunks: message content chunks already serialized, already
+                       quoted for the DATA command, or None to serialize the
+                       message
+        :return: dictionary with the refused recipients, like smtplib
+        """
+        with self._measure('envelope'):
+            self.connection.ehlo_or_helo_if_needed()
+            code, reply = self.connection.mail(sender)
+            if code != 250:
+                self.connection.rset()
+                raise smtplib.SMTPSenderRefused(code, reply, sender)
+            refused = {}
+            for recipient in recipients:
+                code, reply = self.connection.rcpt(recipient)
+                if code not in (250, 251):
+                    refused[recipient] = (code, reply)
+            if len(refused) == len(recipients):
+                self.connection.rset()
+                raise smtplib.SMTPRecipientsRefused(refused)
+            code, reply = self.connection.docmd('DATA')
+            if code != 354:
+                self.connection.rset()
+                raise smtplib.SMTPDataError(code, reply)
+        if chunks is None:
+            chunks = message._iter_data(
+                attachment_cache=self.attachment_cache)
+        if self.metrics:
+            chunks = TimedChunks(chunks)
+            start = time.perf_counter()
+        self._write(chunks)
+        code, reply = self.connection.getreply()
+        if self.metrics:
+            self.metrics.observe_chunks(chunks=chunks,
+                                        elapsed=time.perf_counter() - start)
+        if code != 250:
+            raise smtplib.SMTPDataError(code, reply)
+        return refused
+
+    def _write(self,
+               chunks: Iterable[bytes],
+               trailer: bytes = b'') -> None:
+        """
+        Write data chunks to the socket, joining the smaller chunks to avoid
+        many small writes
+
+        :param chunks: data chunks to write
+        :param trailer: data to write after the last chunk
+        """
+        buffer = []
+        size = 0
+        for chunk in chunks:
+            buffer.append(chunk)
+            size += len(chunk)
+            if size >= self.WRITE_BUFFER_SIZE:
+                self.connection.send(buffer[0] if len(buffer) == 1
+                                     else b''.join(buffer))
+                buffer.clear()
+                size = 0
+        buffer.append(trailer)
+        self.connection.send(b''.join(buffer))
+
+    def send_many(self,
+                  messages: Iterable[Union[Message, FrozenMessage]]
+                  ) -> list[SendResult]:
+        """
+        Send many messages to the server
+
+        When the server supports the PIPELINING extension the envelope
+        commands for each message are sent in a single group, together with
+        the content for the previous message, requiring a single round-trip
+        for each message.
+        A refused message, including one with line breaks in its addresses,
+        doesn't stop the following messages, while a connection error is set
+        for the current and all the remaining messages.
+        The recipients refused for too many recipients (452 reply) are sent
+        in the following transactions, after the other messages.
+
+        :param messages: Message or FrozenMessage objects to send
+        :return: list of SendResult objects, one for each message
+        """
+        results = [SendResult(message=message) for message in messages]
+        self.connection.ehlo_or_helo_if_needed()
+        try:
+            if self.connection.has_extn('pipelining'):
+                self._send_many_pipelined(results)
+            else:
+                self._send_many_serial(results)
+            for result in results:
+                if result.success:
+                    deferred = self._send_deferred(
+                        message=result.message,
+                        sender=result.message._get_envelope_sender(),
+                        refused=result.refused,
+                        limit=len(result.accepted))
+                    result.accepted = [*result.accepted, *deferred.accepted]
+                    result.refused.update(deferred.refused)
+        except (smtplib.SMTPServerDisconnected, OSError,
+                RateLimitExceeded) as error:
+            # The session is either closed or clean, after the last
+            # completed transaction
+            for result in results:
+                if result.error is None and not result.accepted:
+                    result.error = error
+        except Exception as error:
+            # The session was interrupted in an unknown state, it can't be
+            # used anymore
+            self.connection.close()
+            for result in results:
+                if result.error is None and not result.accepted:
+                    result.error = error
+        if self.metrics:
+            for result in results:
+                self.metrics.record_result(result=result)
+        return results
+
+    def _send_many_serial(self,
+                          results: list[SendResult]) -> None:
+        """
+        Send many messages waiting the reply for each command
+
+        :param results: SendResult objects with the messages to send
+        """
+        limit = self.get_max_recipients()
+        for result in results:
+            sender = result.message._get_envelope_sender()
+            recipients = result.message._get_envelope_recipients()
+            try:
+                quote_envelope(sender=sender,
+                               recipients=recipients)
+            except ValueError as error:
+                # Refuse the addresses with line breaks without sending them
+                result.error = error
+                continue
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            if limit and len(recipients) > limit:
+                chunked = self._send_chunked(
+                    message=result.message,
+                    sender=sender,
+                    recipients=recipients,
+                    limit=limit)
+                self._copy_result(result=result,
+                                  source=chunked)
+                continue
+            self._send_result(result=result,
+                              sender=sender,
+                              recipients=recipients)
+
+    def _send_result(self,
+                     result: SendResult,
+                     sender: str,
+                     recipients: list[str]) -> None:
+        """
+        Send a message in a single transaction, waiting the reply for each
+        command, and set the accepted and refused recipients in its result
+
+        The messages with internationalized addresses are sent using the
+        SMTPUTF8 handling from smtplib.
+
+        :param result: SendResult object with the message to send
+        :param sender: envelope sender address
+        :param recipients: envelope recipients addresses
+        """
+        send = (self._send_international
+                if self._is_international(sender=sender,
+                                          recipients=recipients)
+                else self._send_data)
+        try:
+            result.refused = send(message=result.message,
+                                  sender=sender,
+                                  recipients=recipients)
+        except smtplib.SMTPRecipientsRefused as error:
+            result.refused = error.recipients
+            result.error = error
+        except (smtplib.SMTPSenderRefused,
+                smtplib.SMTPDataError,
+                smtplib.SMTPNotSupportedError) as error:
+            result.error = error
+        else:
+            result.accepted = [recipient for recipient in recipients
+                               if recipient not in result.refused]
+
+    @staticmethod
+    def _is_international(sender: str,
+                          recipients: list[str]) -> bool:
+        """
+        Check if the envelope has internationalized addresses, which can't
+        be sent using ASCII commands
+
+        :param sender: envelope sender address
+        :param recipients: envelope recipients addresses
+        :return: True if any address has non-ASCII characters
+        """
+        return not ''.join([sender, *recipients]).isascii()
+
+    def _send_many_pipelined(self,
+                             results: list[SendResult]) -> None:
+        """
+        Send many messages using the PIPELINING extension
+
+        :param results: SendResult objects with the messages to send
+        """
+        # Message waiting for its content to be sent, with the accepted
+        # recipients to confirm after the end of data reply and its content
+        pending = None
+        pending_data = iter(())
+        reset_needed = False
+        limit = self.get_max_recipients()
+        for result in results:
+            sender = result.message._get_envelope_sender()
+            recipients = result.message._get_envelope_recipients()
+            try:
+                quoted_sender, quoted_recipients = quote_envelope(
+                    sender=sender,
+                    recipients=recipients)
+            except ValueError as error:
+                # Refuse the addresses with line breaks, which would inject
+                # other commands in the pipelined group
+                result.error = error
+                continue
+            if self.rate_limiter:
+                try:
+                    self.rate_limiter.acquire()
+                except RateLimitExceeded:
+                    # Complete the pending transaction before giving up
+                    self._complete_pending(pending=pending,
+                                           pending_data=pending_data,
+                                           reset_needed=reset_needed)
+                    raise
+            chunked = bool(limit and len(recipients) > limit)
+            if chunked or self._is_international(sender=sender,
+                                                 recipients=recipients):
+                # Complete the pending transaction and send the message
+                # using many transactions or using smtplib for the
+                # internationalized addresses
+                self._complete_pending(pending=pending,
+                                       pending_data=pending_data,
+                                       reset_needed=reset_needed)
+                pending = None
+                pending_data = iter(())
+                reset_needed = False
+                if chunked:
+                    self._copy_result(result=result,
+                                      source=self._send_chunked(
+                                          message=result.message,
+                                          sender=sender,
+                                          recipients=recipients,
+                                          limit=limit))
+                else:
+                    self._send_result(result=result,
+                                      sender=sender,
+                                      recipients=recipients)
+                continue
+            commands = [
+                'RSET\r\n' if reset_needed else '',
+                f'MAIL FROM:{quoted_sender}\r\n',
+                *(f'RCPT TO:{recipient}\r\n'
+                  for recipient in quoted_recipients),
+                'DATA\r\n']
+            self._write(chunks=pending_data,
+                        trailer=''.join(commands).encode('ascii'))
+            if pending:
+                self._read_data_reply(*pending)
+            if reset_needed:
+                self.connection.getreply()
+            mail_reply = self.connection.getreply()
+            accepted = []
+            for recipient in recipients:
+                code, reply = self.connection.getreply()
+                if code in (250, 251):
+                    accepted.append(recipient)
+                else:
+                    result.refused[recipient] = (code, reply)
+            code, reply = self.connection.getreply()
+            if code == 354:
+                pending_data = result.message._iter_data(
+                    attachment_cache=self.attachment_cache)
+                if self.metrics:
+                    pending_data = TimedChunks(pending_data)
+                pending = (result, accepted, pending_data)
+                reset_needed = False
+            else:
+                # The transaction failed, it must be reset
+                if mail_reply[0] != 250:
+                    result.error = smtplib.SMTPSenderRefused(
+                        *mail_reply, sender)
+                elif not accepted:
+                    result.error = smtplib.SMTPRecipientsRefused(
+                        result.refused)
+                else:
+                    result.error = smtplib.SMTPDataError(code, reply)
+                pending = None
+                pending_data = iter(())
+                reset_needed = True
+        self._complete_pending(pending=pending,
+                               pending_data=pending_data,
+                               reset_needed=False)
+
+    def _complete_pending(self,
+                          pending: Optional[tuple[SendResult,
+                                                  list[str],
+                                                  Iterable[bytes]]],
+                          pending_data: Iterable[bytes],
+                          reset_needed: bool) -> None:
+        """
+        Complete the pipelined transaction waiting for its content and reset
+        the failed transaction, if any
+
+        :param pending: result, accepted recipients and content chunks for
+                        the message waiting for its content, or None
+        :param pending_data: content chunks to send for the pending message
+        :param reset_needed: reset the last failed transaction
+        """
+        if pending:
+            self._write(pending_data)
+            self._read_data_reply(*pending)
+        if reset_needed:
+            self.connection.rset()
+
+    @staticmethod
+    def _copy_result(result: SendResult,
+                     source: SendResult) -> None:
+        """
+        Copy the accepted and refused recipients and the error to a result
+
+        :param result: SendResult object to update
+        :param source: SendResult object to copy
+        """
+        result.accepted = source.accepted
+        result.refused = source.refused
+        result.error = source.error
+
+    def _read_data_reply(self,
+                         result: SendResult,
+                         accepted: list[str],
+                         chunks: Iterable[bytes]) -> None:
+        """
+        Read the reply after the message content was sent
+
+        :param result: SendResult object for the sent message
+        :param accepted: recipients accepted for the message
+        :param chunks: message content chunks already sent
+        """
+        if self.metrics:
+            self.metrics.observe_chunks(chunks=chunks)
+        code, reply = self.connection.getreply()
+        if code == 250:
+            result.accepted = accepted
+        else:
+            result.error = smtplib.SMTPDataError(code, reply)
@@ -0,0 +1,425 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import contextlib
+import dataclasses
+import smtplib
+import threading
+import time
+from typing import TYPE_CHECKING, Iterator, Optional, Union
+
+from .attachment_cache import AttachmentCache
+from .connection import Connection
+from .message import FrozenMessage, Message
+from .metrics import Metrics
+from .rate_limiter import RateLimitExceeded, RateLimiter
+from .send_result import SendResult
+
+if TYPE_CHECKING:
+    # Avoid loading the YAML module until a profile is used
+    from .profile_smtp import ProfileSmtp
+
+
+@dataclasses.dataclass
+class PoolEntry(object):
+    connection: Connection
+    connected_time: float
+    released_time: float
+    messages_count: int = 0
+
+
+class ConnectionPool(object):
+    def __init__(self,
+                 server: str,
+                 port: int = 25,
+                 username: str = None,
+                 password: str = None,
+                 encryption: Optional[str] = None,
+                 ciphers: Optional[str] = None,
+                 size: int = 4,
+                 timeout: int = 30,
+                 max_age: float = 300,
+                 max_messages: int = 100,
+                 check_interval: float = 10,
+                 attachment_cache: Optional[AttachmentCache] = None,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 metrics: Optional[Metrics] = None,
+                 max_recipients: Optional[int] = Connection.MAX_RECIPIENTS):
+        self.server = server
+        self.port = port
+        self.username = username
+        self.password = password
+        self.encryption = encryption
+        self.ciphers = ciphers
+        self.size = size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.max_messages = max_messages
+        self.check_interval = check_interval
+        self.attachment_cache = attachment_cache
+        # Limits shared by all the connections for the same account
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics
+        self.max_recipients = max_recipients
+        # Idle connections ready to be used, the most recent at the end
+        self._idle: list[PoolEntry] = []
+        # Connections in use by the callers, indexed by object id
+        self._busy: dict[int, PoolEntry] = {}
+        # Number of connections being established
+        self._connecting = 0
+        self._condition = threading.Condition()
+        self._closed = False
+
+    @staticmethod
+    def from_profile(profile: 'ProfileSmtp',
+                     **kwargs) -> 'ConnectionPool':
+        """
+        Create a ConnectionPool object using the settings from a ProfileSmtp
+
+        The settings and the limits from the profile are used unless the
+        same arguments are passed, like a server from the command line.
+
+        :param profile: ProfileSmtp object with the SMTP settings
+        :param kwargs: additional arguments for the ConnectionPool object
+        :return: ConnectionPool object
+        """
+        for option in ('server', 'port', 'username', 'password',
+                       'encryption', 'ciphers'):
+            kwargs.setdefault(option, getattr(profile, option))
+        if 'rate_limiter' not in kwargs:
+            kwargs['rate_limiter'] = RateLimiter.from_profile(profile=profile)
+        if profile.max_recipients:
+            kwargs.setdefault('max_recipients', profile.max_recipients)
+        return ConnectionPool(**kwargs)
+
+    def __enter__(self) -> 'ConnectionPool':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def _new_entry(self) -> PoolEntry:
+        """
+        Create a new connected and authenticated pool entry
+
+        :return: PoolEntry object with the new connection
+        """
+        connection = Connection(server=self.server,
+                                port=self.port,
+                                username=self.username,
+                                password=self.password)
+        connection.set_encryption(encryption=self.encryption,
+                                  ciphers=self.ciphers)
+        connection.set_attachment_cache(self.attachment_cache)
+        connection.set_rate_limiter(self.rate_limiter)
+        connection.set_metrics(self.metrics)
+        connection.set_max_recipients(self.max_recipients)
+        connection.connect(timeout=self.timeout)
+        now = time.monotonic()
+        return PoolEntry(connection=connection,
+                         connected_time=now,
+                         released_time=now)
+
+    @staticmethod
+    def _close_entry(entry: PoolEntry) -> None:
+        """
+        Close the connection for a pool entry ignoring any error
+
+        :param entry: PoolEntry object to close
+        """
+        try:
+            entry.connection.disconnect()
+        except (smtplib.SMTPException, OSError):
+            # The connection is already broken, close the socket only
+            entry.connection.connection.close()
+
+    def _is_expired(self, entry: PoolEntry) -> bool:
+        """
+        Check if a pool entry has reached its age or messages limits
+
+        :param entry: PoolEntry object to check
+        :return: True if the entry must not be reused anymore
+        """
+        return ((self.max_age and
+                 time.monotonic() - entry.connected_time >= self.max_age) or
+                (self.max_messages and
+                 entry.messages_count >= self.max_messages))
+
+    def _is_healthy(self, entry: PoolEntry) -> bool:
+        """
+        Check if an idle pool entry is still usable
+
+        The NOOP command is sent only if the connection has been idle for
+        more than `check_interval` seconds
+
+        :param entry: PoolEntry object to check
+        :return: True if the connection is still alive
+        """
+        if time.monotonic() - entry.released_time < self.check_interval:
+            return True
+        try:
+            entry.connection.noop()
+        except (smtplib.SMTPException, OSError):
+            return False
+        return True
+
+    def _count(self) -> int:
+        """
+        Get the number of connections owned by the pool
+
+        :return: number of idle, busy and connecting connections
+        """
+        return len(self._idle) + len(self._busy) + self._connecting
+
+    def open(self) -> None:
+        """
+        Establish all the pool connections in advance
+        """
+        with self._condition:
+            missing = self.size - self._count()
+        for _ in range(missing):
+            entry = self._new_entry()
+            with self._condition:
+                self._idle.append(entry)
+                self._condition.notify()
+
+    def acquire(self,
+                timeout: Optional[float] = None) -> Connection:
+        """
+        Get a connected Connection object from the pool
+
+        If no idle connections are available a new connection is established
+        until the pool size is reached, then the call waits for a connection
+        to be released.
+
+        :param timeout: seconds to wait for a free connection or None to wait
+                        forever
+        :return: connected Connection object
+        """
+        while True:
+            with self._condition:
+                if self._closed:
+                    raise RuntimeError('The connection pool is closed')
+                if not self._idle and self._count() >= self.size:
+                    if not self._condition.wait_for(
+                            lambda: (self._idle or
+                                     self._count() < self.size or
+                                     self._closed),
+                            timeout=timeout):
+                        raise TimeoutError('No available connections '
+                                           'in the pool')
+                    continue
+                entry = self._idle.pop() if self._idle else None
+                if entry:
+                    self._busy[id(entry.connection)] = entry
+                else:
+                    # Reserve the slot while connecting outside the lock
+                    self._connecting += 1
+            if entry is None:
+                try:
+                    entry = self._new_entry()
+                finally:
+                    with self._condition:
+                        self._connecting -= 1
+                        if entry:
+                            self._busy[id(entry.connection)] = entry
+                        self._condition.notify()
+                return entry.connection
+            if not self._is_expired(entry) and self._is_healthy(entry):
+                return entry.connection
+            # Replace the stale connection with a new one
+            self._close_entry(entry)
+            with self._condition:
+                del self._busy[id(entry.connection)]
+                self._condition.notify()
+
+    def release(self,
+                connection: Connection,
+                discard: bool = False,
+                messages: int = 0) -> None:
+        """
+        Return a Connection object to the pool
+
+        :param connection: Connection object obtained from acquire
+        :param discard: close the connection instead of reusing it
+        :param messages: number of messages sent using the connection
+        """
+        with self._condition:
+            entry = self._busy.pop(id(connection))
+            entry.released_time = time.monotonic()
+            entry.messages_count += messages
+            reuse = (not discard and
+                     not self._closed and
+                     not self._is_expired(entry))
+            if reuse:
+                self._idle.append(entry)
+            self._condition.notify()
+        if not reuse:
+            self._close_entry(entry)
+
+    @contextlib.contextmanager
+    def connection(self,
+                   timeout: Optional[float] = None) -> Iterator[Connection]:
+        """
+        Context manager to acquire a Connection object and to release it
+
+        A disconnected connection, or one interrupted by an unexpected
+        error, is discarded instead of being reused.
+
+        :param timeout: seconds to wait for a free connection or None to wait
+                        forever
+        :return: connected Connection object
+        """
+        connection = self.acquire(timeout=timeout)
+        try:
+            yield connection
+        except smtplib.SMTPServerDisconnected:
+            self.release(connection=connection,
+                         discard=True)
+            raise
+        except (smtplib.SMTPException, RateLimitExceeded):
+            # The server refused the message or the rate limit deferred it,
+            # the connection is still valid
+            self.release(connection=connection)
+            raise
+        except OSError:
+            self.release(connection=connection,
+                         discard=True)
+            raise
+        except BaseException:
+            # The session is in an unknown state after any other error
+            self.release(connection=connection,
+                         discard=True)
+            raise
+        else:
+            self.release(connection=connection)
+
+    def send(self,
+             message: Union[Message, FrozenMessage],
+             timeout: Optional[float] = None,
+             recipients: Optional[list[str]] = None
+             ) -> dict[str, tuple[int, bytes]]:
+        """
+        Send a message using a connection from the pool
+
+        If the server closed the connection the message is sent again once
+        using a new connection.
+
+        :param message: Message or FrozenMessage object to send
+        :param timeout: seconds to wait for a free connection or None to wait
+                        forever
+        :param recipients: envelope recipients addresses to use instead of
+                           the message recipients
+        :return: dictionary with the refused recipients
+        """
+        try:
+            return self._send(message=message,
+                              timeout=timeout,
+                              recipients=recipients)
+        except smtplib.SMTPServerDisconnected:
+            return self._send(message=message,
+                              timeout=timeout,
+                              recipients=recipients)
+
+    def _send(self,
+              message: Union[Message, FrozenMessage],
+              timeout: Optional[float],
+              recipients: Optional[list[str]]
+              ) -> dict[str, tuple[int, bytes]]:
+        """
+        Send a message using a connection from the pool
+
+        :param message: Message or FrozenMessage object to send
+        :param timeout: seconds to wait for a free connection or None to wait
+                        forever
+        :param recipients: envelope recipients addresses or None to use the
+                           message recipients
+        :return: dictionary with the refused recipients
+        """
+        with self.connection(timeout=timeout) as connection:
+            entry = self._busy[id(connection)]
+            refused = connection.send(message=message,
+                                      recipients=recipients)
+            entry.messages_count += 1
+            return refused
+
+    def send_many(self,
+                  messages: list[Union[Message, FrozenMessage]],
+                  timeout: Optional[float] = None) -> list[SendResult]:
+        """
+        Send many messages using a single connection from the pool
+
+        The messages not sent because the server closed the connection are
+        sent again once using a new connection. The errors are reported in
+        the results instead of being raised.
+
+        :param messages: Message or FrozenMessage objects to send
+        :param timeout: seconds to wait for a free connection or None to wait
+                        forever
+        :return: list of SendResult objects, one for each message
+        """
+        results = [SendResult(message=message) for message in messages]
+        indexes = list(range(len(results)))
+        for _ in range(2):
+            if not indexes:
+                break
+            try:
+                connection = self.acquire(timeout=timeout)
+            except Exception as error:
+                for index in indexes:
+                    results[index].error = error
+                break
+            # The connection is discarded unless the batch was completed
+            discard = True
+            try:
+                sent = connection.send_many([results[index].message
+                                             for index in indexes])
+                discard = any(result.disconnected for result in sent)
+            except Exception as error:
+                # The session is in an unknown state, sending the messages
+                # again would fail the same way
+                sent = [SendResult(message=results[index].message,
+                                   error=error)
+                        for index in indexes]
+            finally:
+                self.release(connection=connection,
+                             discard=discard,
+                             messages=len(indexes))
+            disconnected = [index
+                            for index, result in zip(indexes, sent)
+                            if result.disconnected]
+            for index, result in zip(indexes, sent):
+                results[index] = result
+            indexes = disconnected
+        return results
+
+    def close(self) -> None:
+        """
+        Disconnect all the idle connections and refuse new requests
+
+        The connections in use are closed as soon as they are released.
+        """
+        with self._condition:
+            self._closed = True
+            entries = self._idle
+            self._idle = []
+            self._condition.notify_all()
+        for entry in entries:
+            self._close_entry(entry)
@@ -18,7 +18,10 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 ##
 
+import socket
 import ssl
+import threading
+from typing import Optional
 
 
 ENCRYPTION_PROTOCOLS = {
@@ -31,3 +34,107 @@ ENCRYPTION_PROTOCOLS = {
     'TLSv1_1': ssl.PROTOCOL_TLSv1_1,
     'TLSv1_2': ssl.PROTOCOL_TLSv1_2,
 }
+
+# Configured contexts indexed by (encryption, ciphers)
+_contexts: dict[tuple[str, str], ssl.SSLContext] = {}
+# Last TLS session indexed by (server, port), with its context
+_sessions: dict[tuple[str, int], tuple[ssl.SSLContext, ssl.SSLSession]] = {}
+_lock = threading.Lock()
+
+
+def get_ssl_context(encryption: Optional[str],
+                    ciphers: Optional[str] = None
+                    ) -> Optional[ssl.SSLContext]:
+    """
+    Get a configured SSLContext shared by every connection using the same
+    encryption protocol and ciphers
+
+    Any change to the returned context applies to all those connections.
+
+    :param encryption: encryption method from ENCRYPTION_PROTOCOLS
+    :param ciphers: encryption ciphers for the selected protocol
+    :return: SSLContext object or None for no encryption
+    """
+    if not (protocol := ENCRYPTION_PROTOCOLS.get(encryption)):
+        return None
+    key = (encryption, ciphers or '')
+    with _lock:
+        if (context := _contexts.get(key)) is None:
+            context = ssl.SSLContext(protocol=protocol)
+            if ciphers:
+                context.set_ciphers(ciphers)
+            _contexts[key] = context
+        return context
+
+
+def get_tls_session(context: ssl.SSLContext,
+                    server: str,
+                    port: int) -> Optional[ssl.SSLSession]:
+    """
+    Get the last TLS session established with a server
+
+    :param context: SSLContext object used for the connection
+    :param server: server address
+    :param port: server port number
+    :return: SSLSession object or None if no session can be resumed
+    """
+    with _lock:
+        stored_context, session = _sessions.get((server, port),
+                                                (None, None))
+    # Sessions can be resumed only with the same context
+    return session if stored_context is context else None
+
+
+def set_tls_session(context: ssl.SSLContext,
+                    server: str,
+                    port: int,
+                    session: Optional[ssl.SSLSession]) -> None:
+    """
+    Save the TLS session established with a server to resume it later
+
+    :param context: SSLContext object used for the connection
+    :param server: server address
+    :param port: server port number
+    :param session: SSLSession object to save
+    """
+    if session is not None:
+        with _lock:
+            _sessions[(server, port)] = (context, session)
+
+
+class SessionContext(object):
+    def __init__(self,
+                 context: ssl.SSLContext,
+                 server: str,
+                 port: int):
+        """
+        Wrapper for an SSLContext object resuming the last TLS session with
+        the server when the socket is wrapped
+
+        It can be passed to smtplib in place of the SSLContext object both
+        for SMTP_SSL and starttls.
+
+        :param context: SSLContext object to wrap
+        :param server: server address
+        :param port: server port number
+        """
+        self.context = context
+        self.server = server
+        self.port = port
+
+    def wrap_socket(self,
+                    sock: socket.socket,
+                    **kwargs) -> ssl.SSLSocket:
+        """
+        Wrap a socket using the last TLS session with the server
+
+        :param sock: socket object to wrap
+        :param kwargs: additional arguments for SSLContext.wrap_socket
+        :return: SSLSocket object
+        """
+        return self.context.wrap_socket(
+            sock,
+            session=get_tls_session(context=self.context,
+                                    server=self.server,
+                                    port=self.port),
+            **kwargs)
@@ -0,0 +1,75 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import dataclasses
+import pathlib
+from typing import Iterator
+
+from .attachment import Attachment
+
+
+@dataclasses.dataclass
+class FileAttachment(object):
+    """
+    Attachment whose content is read from the file only while sending
+
+    The file content is never loaded completely in memory when the message
+    is sent by a Connection object, instead it's encoded and sent in chunks.
+    """
+    path: str
+    content_type: str = 'application/octet-stream'
+    filename: str = None
+
+    CHUNK_SIZE = Attachment.CHUNK_SIZE
+
+    def __post_init__(self):
+        if self.filename is None:
+            self.filename = pathlib.Path(self.path).name
+
+    @property
+    def content(self) -> bytes:
+        """
+        Read the whole file content
+
+        :return: file content
+        """
+        with open(self.path, 'rb') as file:
+            return file.read()
+
+    def iter_content(self) -> Iterator[bytes]:
+        """
+        Read the file content in chunks of CHUNK_SIZE bytes
+
+        :return: iterator of content chunks
+        """
+        with open(self.path, 'rb') as file:
+            while chunk := file.read(self.CHUNK_SIZE):
+                yield chunk
+
+    def iter_encoded(self) -> Iterator[bytes]:
+        """
+        Encode the file content in base64 chunks, with lines terminated by
+        CRLF
+
+        Only the chunk being encoded is kept in memory.
+
+        :return: iterator of base64 encoded chunks
+        """
+        return map(Attachment.encode_chunk, self.iter_content())
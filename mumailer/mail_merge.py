@@ -0,0 +1,257 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import csv
+import dataclasses
+import itertools
+import json
+import re
+import string
+from typing import Any, Iterable, Iterator, Optional, Union
+
+from .connection import Connection
+from .header import Header
+from .message import FrozenMessage, Message
+from .recipient import Recipient
+from .send_result import SendResult
+
+
+class MergeTemplate(object):
+    """
+    Text template with {field} placeholders, parsed only once
+
+    The placeholders use the str.format syntax, with the record as keyword
+    arguments: the record key can be followed by attribute (.name) and
+    index ([key]) lookups, by the optional !s, !r and !a conversions and by
+    a standard format spec, like {amount:>10,.2f}, while the literal braces,
+    like the ones in the CSS rules, are written as {{ and }}.
+    Unlike str.format, there are no positional fields ({} is refused and
+    {0} is a record key), the format spec can't contain nested fields and
+    the attributes starting with an underscore are refused.
+    """
+    CONVERSIONS = {
+        's': str,
+        'r': repr,
+        'a': ascii,
+    }
+    # Standard format spec: [[fill]align][sign][#][0][width][,][.prec][type]
+    SPEC_PATTERN = re.compile(r'(?:.?[<>=^])?[-+ ]?#?0?\d*[,_]?'
+                              r'(?:\.\d+)?[bcdeEfFgGnosxX%]?',
+                              re.DOTALL)
+    # Attribute (.name) or index ([key]) lookup following the record key
+    LOOKUP_PATTERN = re.compile(r'\.([^.\[\]]+)|\[([^\[\]]+)\]')
+
+    def __init__(self, text: Optional[str]):
+        self.text = text
+        # List of literal texts and fields to render, a template without
+        # fields is kept as a single literal text
+        self.parts = []
+        if text:
+            try:
+                parsed = list(string.Formatter().parse(text))
+            except ValueError as error:
+                raise ValueError(f'Invalid template, {error}, use {{{{ '
+                                 'and }} for the literal braces') from error
+            for literal, field, spec, conversion in parsed:
+                if literal:
+                    self.parts.append((literal, None, None, None, None))
+                if field is None:
+                    continue
+                key, lookups = self._parse_field(field)
+                if conversion and conversion not in self.CONVERSIONS:
+                    raise ValueError(f'Unknown conversion !{conversion} '
+                                     f'for the field {field}')
+                if spec and '{' in spec:
+                    raise ValueError('Nested fields are not supported in '
+                                     f'the format spec for the field '
+                                     f'{field}')
+                if spec and not self.SPEC_PATTERN.fullmatch(spec):
+                    # Likely a literal brace, like in "p {color: red}"
+                    raise ValueError(f'Invalid format spec "{spec}" for the '
+                                     f'field {field}, use {{{{ and }}}} for '
+                                     'the literal braces')
+                self.parts.append((None, key, lookups, spec, conversion))
+        self.is_static = all(part[1] is None for part in self.parts)
+
+    def _parse_field(self,
+                     field: str) -> tuple[str, tuple]:
+        """
+        Split a field name in the record key and the following lookups
+
+        :param field: field name, like name, user.name or emails[0]
+        :return: tuple with the record key and the lookups as tuples with
+                 True for the attributes and the attribute name or the
+                 index, converted to int if numeric
+        """
+        key = re.match(r'[^.\[]*', field).group()
+        if not key or key != key.strip():
+            # Likely a literal brace, like in "p { color: red }"
+            raise ValueError(f'Invalid field name "{field}", use {{{{ and '
+                             '}} for the literal braces')
+        lookups = []
+        position = len(key)
+        while position < len(field):
+            match = self.LOOKUP_PATTERN.match(field, position)
+            if not match:
+                raise ValueError(f'Invalid field name "{field}"')
+            attribute, index = match.groups()
+            if attribute is not None:
+                if attribute.startswith('_'):
+                    raise ValueError('Private attributes are not allowed '
+                                     f'for the field {field}')
+                lookups.append((True, attribute))
+            else:
+                lookups.append((False,
+                                int(index) if index.isdigit() else index))
+            position = match.end()
+        return key, tuple(lookups)
+
+    def render(self, record: dict[str, Any]) -> Optional[str]:
+        """
+        Render the template using the values from a record
+
+        :param record: dictionary with the values for the fields
+        :return: rendered text
+        """
+        if self.is_static:
+            return self.text
+        result = []
+        for literal, key, lookups, spec, conversion in self.parts:
+            if key is None:
+                result.append(literal)
+            else:
+                value = record[key]
+                for is_attribute, name in lookups:
+                    value = (getattr(value, name)
+                             if is_attribute
+                             else value[name])
+                if conversion:
+                    value = self.CONVERSIONS[conversion](value)
+                result.append(format(value, spec) if spec else str(value))
+        return ''.join(result)
+
+
+class MailMerge(object):
+    """
+    Render a template Message for each recipient record
+    """
+    def __init__(self,
+                 template: Message,
+                 address_field: str = 'address',
+                 name_field: str = 'name'):
+        self.template = template
+        self.address_field = address_field
+        self.name_field = name_field
+        # Compile the templates only once
+        self.subject = MergeTemplate(template.subject)
+        self.body = MergeTemplate(template.body)
+        self.headers = [(header.name, MergeTemplate(header.value))
+                        for header in template.headers]
+        # Without fields in the body, the body and the attachments are
+        # serialized only once
+        self.frozen = template.freeze() if self.body.is_static else None
+
+    def render(self,
+               record: dict[str, Any]) -> Union[Message, FrozenMessage]:
+        """
+        Render a new Message object for a recipient record
+
+        The attachments and the other fields are shared with the template.
+        If the body has no fields a FrozenMessage object is returned instead.
+
+        :param record: dictionary with the recipient address, name and the
+                       values for the template fields
+        :return: Message or FrozenMessage object for the recipient
+        """
+        if self.frozen:
+            return self.frozen.replace(
+                to=[Recipient(name=record.get(self.name_field),
+                              address=record[self.address_field])],
+                subject=self.subject.render(record),
+                headers=[Header(name=name,
+                                value=value.render(record))
+                         for name, value in self.headers])
+        return dataclasses.replace(
+            self.template,
+            to=[Recipient(name=record.get(self.name_field),
+                          address=record[self.address_field])],
+            subject=self.subject.render(record),
+            body=self.body.render(record),
+            headers=[Header(name=name,
+                            value=value.render(record))
+                     for name, value in self.headers])
+
+    def messages(self,
+                 records: Iterable[dict[str, Any]]
+                 ) -> Iterator[Union[Message, FrozenMessage]]:
+        """
+        Render a Message object for each recipient record
+
+        The records are consumed lazily, one at a time.
+
+        :param records: iterable with the recipient records
+        :return: iterator of Message or FrozenMessage objects
+        """
+        return map(self.render, records)
+
+    def send(self,
+             connection: Connection,
+             records: Iterable[dict[str, Any]],
+             batch_size: int = 100) -> Iterator[SendResult]:
+        """
+        Render and send a Message for each recipient record
+
+        The messages are rendered and sent in batches of `batch_size`
+        messages, so only a batch at a time is kept in memory.
+
+        :param connection: connected Connection object
+        :param records: iterable with the recipient records
+        :param batch_size: number of messages to send for each batch
+        :return: iterator of SendResult objects, one for each record
+        """
+        messages = self.messages(records)
+        while batch := list(itertools.islice(messages, batch_size)):
+            yield from connection.send_many(batch)
+
+    @staticmethod
+    def read_csv(filename: str,
+                 **kwargs) -> Iterator[dict[str, str]]:
+        """
+        Read the recipient records from a CSV file with a header row
+
+        :param filename: CSV filename to read
+        :param kwargs: additional arguments for csv.DictReader
+        :return: iterator of dictionaries, one for each row
+        """
+        with open(filename, 'r', newline='') as file:
+            yield from csv.DictReader(file, **kwargs)
+
+    @staticmethod
+    def read_jsonl(filename: str) -> Iterator[dict[str, Any]]:
+        """
+        Read the recipient records from a JSON Lines file
+
+        :param filename: JSON Lines filename to read
+        :return: iterator of dictionaries, one for each non-empty line
+        """
+        with open(filename, 'r') as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
@@ -18,15 +18,24 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 ##
 
+import base64
 import dataclasses
 import datetime
+import email.generator
 import email.message
+import email.policy
 import email.utils
-from typing import Optional
+import io
+import uuid
+from typing import Iterator, Optional, Union
 
 from .attachment import Attachment
+from .attachment_cache import AttachmentCache
+from .file_attachment import FileAttachment
 from .header import Header
 from .recipient import Recipient
+from .recipient_list import RecipientList
+from .smtp_data import quote_data, quote_periods
 
 
 @dataclasses.dataclass
@@ -34,24 +43,44 @@ class Message(object):
     sender: Recipient
     subject: str
     body: str
-    to: Optional[list[Recipient]] = None
-    cc: Optional[list[Recipient]] = None
-    bcc: Optional[list[Recipient]] = None
+    to: Optional[Union[list[Recipient], RecipientList]] = None
+    cc: Optional[Union[list[Recipient], RecipientList]] = None
+    bcc: Optional[Union[list[Recipient], RecipientList]] = None
     reply_to: Optional[Recipient] = None
     use_html: bool = False
     date: Optional[datetime.datetime] = None
-    attachments: Optional[list[Attachment]] = dataclasses.field(
-        default_factory=lambda: [])
+    attachments: Optional[list[Union[Attachment, FileAttachment]]] = (
+        dataclasses.field(default_factory=lambda: []))
     headers: Optional[list[Header]] = dataclasses.field(
         default_factory=lambda: [])
 
-    def _to_email_message(self) -> email.message.EmailMessage:
+    def _to_email_message(self,
+                          include_bcc: bool = True
+                          ) -> email.message.EmailMessage:
         """
         Create a new EmailMessage object with the fields from attributes
 
+        :param include_bcc: add the Bcc header
         :return: EmailMessage with the fields set
         """
         message = email.message.EmailMessage()
+        self._add_headers(message=message,
+                          include_bcc=include_bcc)
+        self._add_content(message)
+        return message
+
+    def _add_headers(self,
+                     message: email.message.EmailMessage,
+                     include_bcc: bool = True) -> None:
+        """
+        Add the addresses, subject, date and custom headers to an
+        EmailMessage object
+
+        :param message: EmailMessage object to set the headers
+        :param include_bcc: add the Bcc header, it's removed anyway before
+                            sending and building it for many recipients
+                            is expensive
+        """
         message['From'] = str(self.sender)
         if self.reply_to:
             message['Reply-To'] = str(self.reply_to)
@@ -59,25 +88,135 @@ class Message(object):
             message['To'] = ', '.join(map(str, self.to))
         if self.cc:
             message['Cc'] = ', '.join(map(str, self.cc))
-        if self.bcc:
+        if self.bcc and include_bcc:
             message['Bcc'] = ', '.join(map(str, self.bcc))
         message['Subject'] = self.subject
         message['Date'] = email.utils.formatdate(timeval=self.date)
         # Add custom headers
         for header in self.headers:
             message[header.name] = header.value
+
+    def _add_content(self,
+                     message: email.message.EmailMessage,
+                     placeholders: Optional[list[bytes]] = None) -> None:
+        """
+        Add the body and the attachments to an EmailMessage object
+
+        :param message: EmailMessage object to set the content
+        :param placeholders: list of contents to use instead of the
+                             attachments contents
+        """
         message.set_content(self.body,
                             subtype='html' if self.use_html else 'plain')
         if self.attachments:
             # Add attachments
-            for attachment in self.attachments:
+            for index, attachment in enumerate(self.attachments):
                 maintype, subtype = attachment.content_type.split(sep='/',
                                                                   maxsplit=1)
-                message.add_attachment(obj=attachment.content,
+                message.add_attachment(obj=(placeholders[index]
+                                            if placeholders
+                                            else attachment.content),
                                        maintype=maintype,
                                        subtype=subtype,
                                        filename=attachment.filename)
-        return message
+
+    def _get_envelope_sender(self) -> str:
+        """
+        Get the sender address to use for the SMTP envelope
+
+        :return: sender address
+        """
+        return self.sender.address
+
+    def _get_envelope_recipients(self) -> list[str]:
+        """
+        Get the recipients addresses to use for the SMTP envelope
+
+        :return: list with the addresses from the to, cc and bcc fields
+        """
+        addresses = []
+        for recipients in (self.to, self.cc, self.bcc):
+            if isinstance(recipients, RecipientList):
+                # Get the addresses without creating the Recipient objects
+                addresses.extend(recipients.get_addresses())
+            elif recipients:
+                addresses.extend(recipient.address
+                                 for recipient in recipients)
+        return addresses
+
+    def _to_bytes(self) -> bytes:
+        """
+        Flatten the message in bytes, ready to be sent using the DATA command
+
+        The Bcc header is removed and the lines are terminated by CRLF.
+
+        :return: message content as bytes
+        """
+        return self._flatten(self._to_email_message(include_bcc=False))
+
+    def _iter_data(self,
+                   attachment_cache: Optional[AttachmentCache] = None
+                   ) -> Iterator[bytes]:
+        """
+        Get the message content in chunks, ready to be sent after the DATA
+        command, including the end of data marker
+
+        The message structure is serialized with a placeholder for each
+        attachment, then the attachments are encoded only while iterating,
+        one chunk at a time, so the whole message is never kept in memory.
+
+        :param attachment_cache: AttachmentCache object to get the encoded
+                                 attachments from
+        :return: iterator of message content chunks
+        """
+        placeholders = [uuid.uuid4().hex.encode('ascii')
+                        for _ in self.attachments]
+        message = email.message.EmailMessage()
+        self._add_headers(message=message,
+                          include_bcc=False)
+        self._add_content(message=message,
+                          placeholders=placeholders)
+        data = self._flatten(message)
+        start = 0
+        # Replace each placeholder with the encoded attachment content
+        for attachment, placeholder in zip(self.attachments, placeholders):
+            placeholder = base64.b64encode(placeholder) + b'\r\n'
+            index = data.index(placeholder, start)
+            # Each segment starts at the beginning of a line, the base64
+            # content doesn't need to be quoted
+            yield quote_periods(data[start:index])
+            yield from (attachment_cache.iter_encoded(attachment)
+                        if attachment_cache
+                        else attachment.iter_encoded())
+            start = index + len(placeholder)
+        yield quote_data(data[start:])
+
+    @staticmethod
+    def _flatten(message: email.message.EmailMessage) -> bytes:
+        """
+        Flatten an EmailMessage object in bytes with lines terminated by CRLF
+
+        :param message: EmailMessage object to flatten
+        :return: message content as bytes
+        """
+        with io.BytesIO() as buffer:
+            generator = email.generator.BytesGenerator(buffer)
+            generator.flatten(message, linesep='\r\n')
+            return buffer.getvalue()
+
+    def freeze(self) -> 'FrozenMessage':
+        """
+        Serialize the body and the attachments only once
+
+        The returned FrozenMessage object renders again only the headers for
+        each send, the body and the attachments cannot be changed anymore.
+
+        :return: FrozenMessage object
+        """
+        content = email.message.EmailMessage()
+        self._add_content(content)
+        return FrozenMessage(message=dataclasses.replace(self),
+                             content=self._flatten(content))
 
     def add_attachment(self,
                        attachment: Attachment) -> None:
@@ -96,3 +235,173 @@ class Message(object):
         :param header: Header object to append
         """
         self.headers.append(header)
+
+
+@dataclasses.dataclass
+class FrozenMessage(object):
+    message: Message
+    content: bytes
+    quoted_content: Optional[bytes] = dataclasses.field(default=None,
+                                                        repr=False,
+                                                        compare=False)
+
+    def replace(self, **changes) -> 'FrozenMessage':
+        """
+        Get a new FrozenMessage object with some changed header fields,
+        sharing the same serialized content
+
+        :param changes: Message fields to change (to, cc, subject, date...)
+        :return: FrozenMessage object with the changed fields
+        """
+        return FrozenMessage(message=dataclasses.replace(self.message,
+                                                         **changes),
+                             content=self.content,
+                             quoted_content=self._get_quoted_content())
+
+    def _get_envelope_sender(self) -> str:
+        """
+        Get the sender address to use for the SMTP envelope
+
+        :return: sender address
+        """
+        return self.message._get_envelope_sender()
+
+    def _get_envelope_recipients(self) -> list[str]:
+        """
+        Get the recipients addresses to use for the SMTP envelope
+
+        :return: list with the addresses from the to, cc and bcc fields
+        """
+        return self.message._get_envelope_recipients()
+
+    def _to_email_message(self,
+                          include_bcc: bool = True
+                          ) -> email.message.EmailMessage:
+        """
+        Create a new EmailMessage object, serializing again the whole message
+
+        :param include_bcc: add the Bcc header
+        :return: EmailMessage with the fields set
+        """
+        return self.message._to_email_message(include_bcc=include_bcc)
+
+    def _get_quoted_content(self) -> bytes:
+        """
+        Get the serialized content quoted for the DATA command, quoting it
+        only the first time
+
+        :return: quoted content including the end of data marker
+        """
+        if self.quoted_content is None:
+            self.quoted_content = quote_data(self.content)
+        return self.quoted_content
+
+    def _render_headers(self) -> bytes:
+        """
+        Render the headers, without the empty line separating them from
+        the content
+
+        :return: headers as bytes
+        """
+        headers = email.message.EmailMessage()
+        self.message._add_headers(message=headers,
+                                  include_bcc=False)
+        return Message._flatten(headers)[:-2]
+
+    def _iter_data(self,
+                   attachment_cache: Optional[AttachmentCache] = None
+                   ) -> Iterator[bytes]:
+        """
+        Get the message content, ready to be sent after the DATA command,
+        including the end of data marker
+
+        :param attachment_cache: unused, the content is already serialized
+        :return: iterator of message content chunks
+        """
+        yield quote_periods(self._render_headers())
+        yield self._get_quoted_content()
+
+    def _to_bytes(self) -> bytes:
+        """
+        Render the headers and join them to the serialized content
+
+        :return: message content as bytes
+        """
+        return self._render_headers() + self.content
+
+
+@dataclasses.dataclass
+class RawMessage(object):
+    """
+    Message already serialized with its envelope, which can be stored and
+    loaded again without running any code, unlike the pickled objects
+    """
+    sender: str
+    recipients: list[str]
+    # Message content with lines terminated by CRLF, without the Bcc header
+    content: bytes
+
+    @staticmethod
+    def from_message(message: Union[Message, FrozenMessage, 'RawMessage']
+                     ) -> 'RawMessage':
+        """
+        Serialize a message together with its envelope
+
+        The attachments files are read during the serialization.
+
+        :param message: Message, FrozenMessage or RawMessage object
+        :return: RawMessage object
+        """
+        if isinstance(message, RawMessage):
+            return message
+        return RawMessage(sender=message._get_envelope_sender(),
+                          recipients=message._get_envelope_recipients(),
+                          content=message._to_bytes())
+
+    def _get_envelope_sender(self) -> str:
+        """
+        Get the sender address to use for the SMTP envelope
+
+        :return: sender address
+        """
+        return self.sender
+
+    def _get_envelope_recipients(self) -> list[str]:
+        """
+        Get the recipients addresses to use for the SMTP envelope
+
+        :return: list with the envelope recipients addresses
+        """
+        return self.recipients
+
+    def _to_email_message(self,
+                          include_bcc: bool = True
+                          ) -> email.message.EmailMessage:
+        """
+        Parse the content in a new EmailMessage object
+
+        :param include_bcc: unused, the Bcc header was already removed
+        :return: EmailMessage with the fields set
+        """
+        return email.message_from_bytes(self.content,
+                                        policy=email.policy.default)
+
+    def _iter_data(self,
+                   attachment_cache: Optional[AttachmentCache] = None
+                   ) -> Iterator[bytes]:
+        """
+        Get the message content, ready to be sent after the DATA command,
+        including the end of data marker
+
+        :param attachment_cache: unused, the content is already serialized
+        :return: iterator of message content chunks
+        """
+        yield quote_data(self.content)
+
+    def _to_bytes(self) -> bytes:
+        """
+        Get the message content
+
+        :return: message content as bytes
+        """
+        return self.content
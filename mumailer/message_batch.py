@@ -0,0 +1,271 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import collections
+import concurrent.futures
+import itertools
+import json
+import os
+import sys
+import time
+from typing import Any, Iterable, Iterator, Optional, Union
+
+from .connection_pool import ConnectionPool
+from .file_attachment import FileAttachment
+from .header import Header
+from .message import Message
+from .recipient import Recipient
+from .recipient_parser import RecipientParser
+from .send_result import SendResult
+
+
+class MessageBatch(object):
+    """
+    Send many messages described by specs using the connections from a
+    ConnectionPool
+    """
+    FIELDS = ('sender', 'to', 'cc', 'bcc', 'reply_to',
+              'to_file', 'cc_file', 'bcc_file',
+              'subject', 'body', 'body_file', 'use_html',
+              'attachments', 'content_types', 'headers')
+    # Options replacing each other when set by a spec
+    ALTERNATIVES = (('body', 'body_file'),
+                    ('to', 'to_file'),
+                    ('cc', 'cc_file'),
+                    ('bcc', 'bcc_file'))
+
+    def __init__(self,
+                 pool: ConnectionPool,
+                 defaults: Optional[dict[str, Any]] = None,
+                 workers: int = 1,
+                 batch_size: int = 100):
+        """
+        Send many messages described by specs using the connections from a
+        ConnectionPool
+
+        Each spec is a dictionary with any of the FIELDS keys, the missing
+        keys are taken from the defaults. A spec setting the body or the
+        recipients ignores the default file for the same field, and vice
+        versa.
+        The messages are sent in batches of `batch_size` messages, each batch
+        using a single connection, with up to `workers` batches in parallel.
+
+        :param pool: ConnectionPool object with the SMTP settings
+        :param defaults: dictionary with the default values for the specs
+        :param workers: number of batches to send in parallel
+        :param batch_size: number of messages to send for each batch
+        """
+        self.pool = pool
+        self.defaults = defaults or {}
+        self.workers = workers
+        self.batch_size = batch_size
+        self.sent = 0
+        self.failed = 0
+        self.started_time = None
+        self.stopped_time = None
+        # Bodies read from files, shared by the messages using them
+        self._bodies = {}
+
+    def get_rate(self) -> float:
+        """
+        Get the number of sent messages per second since the start
+
+        :return: messages per second
+        """
+        elapsed = (self.stopped_time or time.monotonic()) - self.started_time
+        return self.sent / elapsed if elapsed else 0.0
+
+    def build(self, spec: Union[dict[str, Any], str]) -> Message:
+        """
+        Build a Message object from a spec
+
+        :param spec: dictionary with the message fields or its JSON text
+        :return: Message object
+        """
+        if isinstance(spec, str):
+            spec = json.loads(spec)
+        if not isinstance(spec, dict):
+            raise TypeError('The message spec must be an object, not '
+                            f'{type(spec).__name__}')
+        options = dict(self.defaults)
+        for alternatives in self.ALTERNATIVES:
+            if any(option in spec for option in alternatives):
+                for option in alternatives:
+                    options.pop(option, None)
+        options.update(spec)
+        spec = options
+        body = spec.get('body')
+        if body_file := spec.get('body_file'):
+            if body_file not in self._bodies:
+                with open(body_file, 'r') as file:
+                    self._bodies[body_file] = file.read()
+            body = self._bodies[body_file]
+        # Validate the recipients, sending a single copy to each address
+        recipients = RecipientParser()
+        fields = []
+        for field in ('to', 'cc', 'bcc'):
+            items = self._get_list(spec.get(field))
+            if filename := spec.get(f'{field}_file'):
+                items = itertools.chain(items,
+                                        RecipientParser.read_file(filename))
+            fields.append(recipients.parse(items=items,
+                                           compact=bool(filename)))
+        to, cc, bcc = fields
+        if recipients.invalid:
+            raise ValueError('Invalid recipients: '
+                             f'{", ".join(recipients.invalid)}')
+        if not spec.get('sender'):
+            raise ValueError('Missing sender')
+        message = Message(
+            sender=Recipient.parse(spec['sender']),
+            reply_to=Recipient.parse(spec.get('reply_to')),
+            to=to,
+            cc=cc,
+            bcc=bcc,
+            subject=spec.get('subject'),
+            body=body,
+            use_html=spec.get('use_html', False),
+            headers=Header.parse_as_list(self._get_list(spec.get('headers'))))
+        content_types = self._get_list(spec.get('content_types'))
+        for index, path in enumerate(self._get_list(spec.get('attachments'))):
+            if not content_types:
+                content_type = 'application/octet-stream'
+            elif len(content_types) == 1:
+                content_type = content_types[0]
+            else:
+                content_type = content_types[index]
+            message.add_attachment(FileAttachment(
+                path=os.path.abspath(path),
+                content_type=content_type))
+        return message
+
+    @staticmethod
+    def _get_list(value: Any) -> list:
+        """
+        Get a list from a single value or a list of values
+
+        :param value: None, a single value or a list of values
+        :return: list of values
+        """
+        if value is None:
+            return []
+        if isinstance(value, (list, tuple)):
+            return value
+        return [value]
+
+    def send(self,
+             specs: Iterable[Union[dict[str, Any], str]]
+             ) -> Iterator[SendResult]:
+        """
+        Build and send a Message for each spec
+
+        The specs are consumed lazily, keeping only the batches being sent
+        in memory. The results are returned in the same order of the specs,
+        a spec which can't be built gets a SendResult object without message
+        and with the error.
+
+        :param specs: iterable with the message specs
+        :return: iterator of SendResult objects, one for each spec
+        """
+        if self.started_time is None:
+            self.started_time = time.monotonic()
+        specs = iter(specs)
+        pending = collections.deque()
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix='mumailer-batch') as executor:
+            while True:
+                # Keep a batch ready for the next free worker
+                while (len(pending) <= self.workers and
+                       (batch := list(itertools.islice(specs,
+                                                       self.batch_size)))):
+                    pending.append(executor.submit(self._send_batch, batch))
+                if not pending:
+                    break
+                for result in pending.popleft().result():
+                    if result.success:
+                        self.sent += 1
+                    else:
+                        self.failed += 1
+                    yield result
+        self.stopped_time = time.monotonic()
+
+    def _send_batch(self,
+                    specs: list[Union[dict[str, Any], str]]
+                    ) -> list[SendResult]:
+        """
+        Build and send a batch of messages using a single connection
+
+        The messages not sent because the server closed the connection are
+        sent again once using a new connection.
+
+        :param specs: message specs to send
+        :return: list of SendResult objects, one for each spec
+        """
+        results = []
+        for spec in specs:
+            try:
+                results.append(SendResult(message=self.build(spec)))
+            except Exception as error:
+                # Report the invalid spec without stopping the batch
+                results.append(SendResult(message=None,
+                                          error=error))
+        indexes = [index for index, result in enumerate(results)
+                   if result.error is None]
+        sent = self.pool.send_many([results[index].message
+                                    for index in indexes])
+        for index, result in zip(indexes, sent):
+            results[index] = result
+        return results
+
+    @staticmethod
+    def read_jsonl(filename: str
+                   ) -> Iterator[Union[dict[str, Any], str]]:
+        """
+        Read the message specs from a JSON Lines file
+
+        The lines which are not valid JSON are returned as text, so they're
+        reported as errors by the send method instead of stopping the batch.
+
+        :param filename: JSON Lines filename to read or - to read from stdin
+        :return: iterator of dictionaries or texts, one for each non-empty
+                 line
+        """
+        if filename == '-':
+            yield from map(MessageBatch._load_spec,
+                           filter(str.strip, sys.stdin))
+            return
+        with open(filename, 'r') as file:
+            yield from map(MessageBatch._load_spec,
+                           filter(str.strip, file))
+
+    @staticmethod
+    def _load_spec(line: str) -> Union[dict[str, Any], str]:
+        """
+        Load a spec from a JSON line
+
+        :param line: JSON text
+        :return: decoded spec or the line itself if it's not a JSON object
+        """
+        try:
+            spec = json.loads(line)
+        except ValueError:
+            return line
+        return spec if isinstance(spec, dict) else line
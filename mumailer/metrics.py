@@ -0,0 +1,342 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import bisect
+import contextlib
+import smtplib
+import threading
+import time
+from typing import Callable, Iterable, Iterator, Optional
+
+from .send_result import SendResult
+
+
+class TimedChunks(object):
+    def __init__(self, chunks: Iterable[bytes]):
+        """
+        Wrap the message content chunks measuring the time spent to build
+        them and their size
+
+        :param chunks: message content chunks
+        """
+        self.chunks = chunks
+        self.build_time = 0.0
+        self.size = 0
+
+    def __iter__(self) -> Iterator[bytes]:
+        iterator = iter(self.chunks)
+        while True:
+            start = time.perf_counter()
+            chunk = next(iterator, None)
+            self.build_time += time.perf_counter() - start
+            if chunk is None:
+                return
+            self.size += len(chunk)
+            yield chunk
+
+
+class Histogram(object):
+    def __init__(self, buckets: tuple[float, ...]):
+        """
+        Cumulative histogram of the observed values
+
+        :param buckets: upper bounds for the buckets, in ascending order
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """
+        Add a value to the histogram
+
+        :param value: observed value
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Metrics(object):
+    """
+    Timings and counters for the connections and the messages sent
+
+    The phases are:
+    - connect: TCP connection, greeting and EHLO (including the TLS
+      handshake for SSL connections)
+    - tls: STARTTLS command and TLS handshake
+    - auth: authentication
+    - envelope: MAIL, RCPT and DATA commands
+    - build: message serialization
+    - data: message content transfer, excluding its serialization
+    """
+    PHASES = ('connect', 'tls', 'auth', 'envelope', 'build', 'data')
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+               1.0, 2.5, 5.0, 10.0, 30.0)
+    PREFIX = 'mumailer'
+    COUNTERS = {
+        'connections': 'Connections established or failed',
+        'tls_handshakes': 'TLS handshakes resuming a session or not',
+        'messages': 'Messages sent or failed',
+        'recipients': 'Recipients accepted or refused',
+        'bytes_sent': 'Message content bytes sent',
+        'errors': 'Errors by SMTP reply code or exception name',
+    }
+
+    def __init__(self,
+                 buckets: tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.histograms = {phase: Histogram(buckets=buckets)
+                           for phase in self.PHASES}
+        # Counter values indexed by (name, sorted labels)
+        self.counters = {}
+        self.callbacks = []
+        self._lock = threading.Lock()
+
+    def add_callback(self,
+                     callback: Callable[[str, float, dict[str, str]], None]
+                     ) -> None:
+        """
+        Add a function called for each timing and counter update
+
+        The callback receives the metric name (`phase_seconds` for the
+        timings), the value and the labels dictionary.
+
+        :param callback: function to call
+        """
+        self.callbacks.append(callback)
+
+    def observe(self,
+                phase: str,
+                seconds: float) -> None:
+        """
+        Record the time spent in a phase
+
+        :param phase: phase name from PHASES
+        :param seconds: elapsed seconds
+        """
+        with self._lock:
+            self.histograms[phase].observe(seconds)
+        for callback in self.callbacks:
+            callback('phase_seconds', seconds, {'phase': phase})
+
+    def increment(self,
+                  name: str,
+                  value: float = 1,
+                  **labels: str) -> None:
+        """
+        Increment a counter
+
+        :param name: counter name from COUNTERS
+        :param value: value to add
+        :param labels: counter labels
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        for callback in self.callbacks:
+            callback(name, value, labels)
+
+    def get_counter(self,
+                    name: str,
+                    **labels: str) -> float:
+        """
+        Get a counter value
+
+        :param name: counter name from COUNTERS
+        :param labels: counter labels
+        :return: counter value
+        """
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    @contextlib.contextmanager
+    def measure(self, phase: str) -> Iterator[None]:
+        """
+        Context manager to record the time spent in a phase
+
+        :param phase: phase name from PHASES
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase=phase,
+                         seconds=time.perf_counter() - start)
+
+    def observe_chunks(self,
+                       chunks: TimedChunks,
+                       elapsed: Optional[float] = None) -> None:
+        """
+        Record the build time and the size of the message content
+
+        :param chunks: TimedChunks object with the sent content
+        :param elapsed: seconds spent sending the content, including its
+                        serialization, or None if unknown
+        """
+        self.observe(phase='build',
+                     seconds=chunks.build_time)
+        if elapsed is not None:
+            self.observe(phase='data',
+                         seconds=max(0.0, elapsed - chunks.build_time))
+        self.increment(name='bytes_sent',
+                       value=chunks.size)
+
+    def record_error(self,
+                     error: BaseException) -> None:
+        """
+        Count an error by its SMTP reply code or exception name
+
+        :param error: exception raised
+        """
+        if isinstance(error, smtplib.SMTPRecipientsRefused):
+            for code, _ in error.recipients.values():
+                self.increment(name='errors',
+                               code=str(code))
+        elif isinstance(error, smtplib.SMTPResponseException):
+            self.increment(name='errors',
+                           code=str(error.smtp_code))
+        else:
+            self.increment(name='errors',
+                           code=type(error).__name__)
+
+    def record_result(self,
+                      result: SendResult) -> None:
+        """
+        Count a message sending result
+
+        :param result: SendResult object for the message
+        """
+        self.increment(name='messages',
+                       status='sent' if result.success else 'failed')
+        if result.accepted:
+            self.increment(name='recipients',
+                           value=len(result.accepted),
+                           status='accepted')
+        if result.refused:
+            self.increment(name='recipients',
+                           value=len(result.refused),
+                           status='refused')
+        # The refused recipients codes are counted below
+        if (result.error is not None and
+                not isinstance(result.error, smtplib.SMTPRecipientsRefused)):
+            self.record_error(error=result.error)
+        for code, _ in result.refused.values():
+            self.increment(name='errors',
+                           code=str(code))
+
+    def to_openmetrics(self) -> str:
+        """
+        Export the metrics using the OpenMetrics text format
+
+        :return: metrics text
+        """
+        lines = []
+        name = f'{self.PREFIX}_phase_seconds'
+        lines.append(f'# TYPE {name} histogram')
+        lines.append(f'# UNIT {name} seconds')
+        lines.append(f'# HELP {name} Time spent in each sending phase')
+        with self._lock:
+            for phase, histogram in self.histograms.items():
+                cumulative = 0
+                for bound, count in zip((*self.buckets, '+Inf'),
+                                        histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{phase="{phase}",'
+                                 f'le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_count{{phase="{phase}"}} '
+                             f'{histogram.count}')
+                lines.append(f'{name}_sum{{phase="{phase}"}} '
+                             f'{histogram.sum}')
+            counters = sorted(self.counters.items())
+        for counter, description in self.COUNTERS.items():
+            name = f'{self.PREFIX}_{counter}'
+            lines.append(f'# TYPE {name} counter')
+            lines.append(f'# HELP {name} {description}')
+            for (key, labels), value in counters:
+                if key == counter:
+                    text = ','.join(f'{label}="{label_value}"'
+                                    for label, label_value in labels)
+                    lines.append(f'{name}_total{{{text}}} {value}'
+                                 if text else f'{name}_total {value}')
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer(object):
+    """
+    HTTP server running in a background thread to export the metrics for
+    Prometheus or any OpenMetrics compatible collector
+    """
+    CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+    def __init__(self,
+                 metrics: Metrics,
+                 host: str = '127.0.0.1',
+                 port: int = 9464):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    def __enter__(self) -> 'MetricsServer':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        """
+        Start the HTTP server, using a random port if port is 0
+        """
+        # The HTTP server is loaded only when needed
+        import http.server
+
+        metrics = self.metrics
+        content_type = self.CONTENT_TYPE
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                body = metrics.to_openmetrics().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self._server = http.server.ThreadingHTTPServer((self.host, self.port),
+                                                       Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the HTTP server
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
@@ -0,0 +1,431 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import json
+import sqlite3
+import threading
+import time
+from typing import Optional, Union
+
+from .connection_pool import ConnectionPool
+from .message import FrozenMessage, Message, RawMessage
+from .retry import RetryPolicy
+
+
+class Outbox(object):
+    """
+    Persistent queue of messages to send, stored in a SQLite database
+
+    The messages are stored as RawMessage objects, with their envelope as
+    JSON and their content as bytes, so loading them doesn't run any code.
+    Each message is marked as sent only after the server has accepted it, so
+    a message being sent when the process crashed is sent again (at least
+    once delivery) after its lease has expired.
+    The messages released after a temporary failure are sent again after a
+    delay growing with their attempts, until the maximum attempts from the
+    retry policy are reached and they are marked as failed.
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+
+    def __init__(self,
+                 filename: str,
+                 lease_time: float = 300,
+                 policy: Optional[RetryPolicy] = None):
+        self.filename = filename
+        self.lease_time = lease_time
+        self.policy = policy or RetryPolicy(max_attempts=10,
+                                            initial_delay=60,
+                                            max_delay=3600)
+        self._lock = threading.Lock()
+        self._database = sqlite3.connect(filename,
+                                         isolation_level=None,
+                                         check_same_thread=False)
+        self._database.execute('PRAGMA journal_mode=WAL')
+        self._database.execute('PRAGMA synchronous=NORMAL')
+        self._database.execute('PRAGMA busy_timeout=30000')
+        self._database.execute('CREATE TABLE IF NOT EXISTS messages ('
+                               'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                               'status TEXT NOT NULL, '
+                               'envelope TEXT, '
+                               'data BLOB NOT NULL, '
+                               'attempts INTEGER NOT NULL DEFAULT 0, '
+                               'queued_time REAL NOT NULL, '
+                               'lease_time REAL, '
+                               'sent_time REAL, '
+                               'next_time REAL, '
+                               'error TEXT)')
+        columns = [row[1] for row in self._database.execute(
+            'PRAGMA table_info(messages)')]
+        if 'next_time' not in columns:
+            # Outbox created before the delayed attempts
+            self._database.execute('ALTER TABLE messages '
+                                   'ADD COLUMN next_time REAL')
+        if 'envelope' not in columns:
+            # Outbox created with the pickled messages, which are not
+            # loaded as they could run any code
+            self._database.execute('ALTER TABLE messages '
+                                   'ADD COLUMN envelope TEXT')
+            self._database.execute(
+                'UPDATE messages SET status = ?, lease_time = NULL, '
+                'error = ? WHERE status IN (?, ?)',
+                (self.STATUS_FAILED,
+                 'Pickled message from an older version not loaded',
+                 self.STATUS_QUEUED, self.STATUS_SENDING))
+        self._database.execute('CREATE INDEX IF NOT EXISTS messages_status '
+                               'ON messages (status, lease_time)')
+
+    def close(self) -> None:
+        """
+        Close the database
+        """
+        with self._lock:
+            self._database.close()
+
+    def enqueue(self,
+                message: Union[Message, FrozenMessage, RawMessage]) -> int:
+        """
+        Add a message to the outbox
+
+        The message is serialized immediately, including its attachments
+        files.
+
+        :param message: Message, FrozenMessage or RawMessage object to send
+        :return: message identifier in the outbox
+        """
+        message = RawMessage.from_message(message)
+        envelope = json.dumps({'sender': message.sender,
+                               'recipients': message.recipients})
+        with self._lock:
+            return self._database.execute(
+                'INSERT INTO messages (status, envelope, data, queued_time) '
+                'VALUES (?, ?, ?, ?)',
+                (self.STATUS_QUEUED, envelope, message.content,
+                 time.time())).lastrowid
+
+    def claim(self,
+              limit: int = 100) -> list[tuple[int, RawMessage]]:
+        """
+        Get the queued messages to send, marking them as being sent
+
+        Messages waiting for their next attempt are skipped, messages being
+        sent whose lease has expired are claimed again.
+
+        :param limit: maximum number of messages to claim
+        :return: list of tuples with message identifier and message
+        """
+        now = time.time()
+        with self._lock:
+            self._database.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self._database.execute(
+                    'SELECT id, envelope, data FROM messages '
+                    'WHERE (status = ? AND '
+                    '(next_time IS NULL OR next_time <= ?)) OR '
+                    '(status = ? AND lease_time < ?) '
+                    'ORDER BY id LIMIT ?',
+                    (self.STATUS_QUEUED, now, self.STATUS_SENDING, now,
+                     limit)
+                ).fetchall()
+                self._database.executemany(
+                    'UPDATE messages '
+                    'SET status = ?, lease_time = ?, attempts = attempts + 1 '
+                    'WHERE id = ?',
+                    [(self.STATUS_SENDING, now + self.lease_time, row[0])
+                     for row in rows])
+                self._database.execute('COMMIT')
+            except BaseException:
+                self._database.execute('ROLLBACK')
+                raise
+        messages = []
+        for identifier, envelope, data in rows:
+            envelope = json.loads(envelope)
+            messages.append((identifier,
+                             RawMessage(sender=envelope['sender'],
+                                        recipients=envelope['recipients'],
+                                        content=data)))
+        return messages
+
+    def _set_status(self,
+                    identifiers: list[int],
+                    status: str,
+                    error: Optional[str] = None) -> None:
+        """
+        Set the status for some messages
+
+        :param identifiers: list of message identifiers
+        :param status: new status
+        :param error: error description
+        """
+        now = time.time()
+        with self._lock:
+            self._database.executemany(
+                'UPDATE messages '
+                'SET status = ?, lease_time = NULL, sent_time = ?, error = ? '
+                'WHERE id = ?',
+                [(status,
+                  now if status == self.STATUS_SENT else None,
+                  error,
+                  identifier)
+                 for identifier in identifiers])
+
+    def mark_sent(self,
+                  identifiers: list[int],
+                  error: Optional[str] = None) -> None:
+        """
+        Mark some messages as sent
+
+        :param identifiers: list of message identifiers
+        :param error: error description for refused recipients
+        """
+        self._set_status(identifiers=identifiers,
+                         status=self.STATUS_SENT,
+                         error=error)
+
+    def mark_failed(self,
+                    identifiers: list[int],
+                    error: str) -> None:
+        """
+        Mark some messages as permanently failed
+
+        :param identifiers: list of message identifiers
+        :param error: error description
+        """
+        self._set_status(identifiers=identifiers,
+                         status=self.STATUS_FAILED,
+                         error=error)
+
+    def release(self,
+                identifiers: list[int],
+                error: Optional[str] = None) -> int:
+        """
+        Put some messages back in the queue to send them again later
+
+        The next attempt is delayed using the retry policy, while the
+        messages which have reached the maximum attempts are marked as
+        failed.
+
+        :param identifiers: list of message identifiers
+        :param error: error description
+        :return: number of messages marked as failed
+        """
+        now = time.time()
+        with self._lock:
+            self._database.execute('BEGIN IMMEDIATE')
+            try:
+                queued = []
+                failed = []
+                for identifier in identifiers:
+                    attempts, = self._database.execute(
+                        'SELECT attempts FROM messages WHERE id = ?',
+                        (identifier, )).fetchone()
+                    if attempts >= self.policy.max_attempts:
+                        failed.append((self.STATUS_FAILED, None, identifier))
+                    else:
+                        queued.append((self.STATUS_QUEUED,
+                                       now + self.policy.get_delay(
+                                           attempt=attempts),
+                                       identifier))
+                self._database.executemany(
+                    'UPDATE messages '
+                    'SET status = ?, lease_time = NULL, next_time = ?, '
+                    'error = ? '
+                    'WHERE id = ?',
+                    [(status, next_time, error, identifier)
+                     for status, next_time, identifier in queued + failed])
+                self._database.execute('COMMIT')
+            except BaseException:
+                self._database.execute('ROLLBACK')
+                raise
+        return len(failed)
+
+    def recover(self) -> int:
+        """
+        Put back in the queue all the messages being sent, after a crash
+
+        Use it only when no other workers are running.
+
+        :return: number of recovered messages
+        """
+        with self._lock:
+            return self._database.execute(
+                'UPDATE messages SET status = ?, lease_time = NULL '
+                'WHERE status = ?',
+                (self.STATUS_QUEUED, self.STATUS_SENDING)).rowcount
+
+    def purge(self) -> int:
+        """
+        Delete the sent messages from the outbox
+
+        :return: number of deleted messages
+        """
+        with self._lock:
+            return self._database.execute(
+                'DELETE FROM messages WHERE status = ?',
+                (self.STATUS_SENT, )).rowcount
+
+    def get_counts(self) -> dict[str, int]:
+        """
+        Get the number of messages for each status
+
+        :return: dictionary with the status and the messages count
+        """
+        with self._lock:
+            return dict(self._database.execute(
+                'SELECT status, COUNT(*) FROM messages GROUP BY status'))
+
+
+class OutboxWorker(object):
+    """
+    Send the messages from an Outbox using the connections from a
+    ConnectionPool, with one or more background threads
+    """
+    def __init__(self,
+                 outbox: Outbox,
+                 pool: ConnectionPool,
+                 workers: int = 1,
+                 batch_size: int = 100,
+                 poll_interval: float = 1.0):
+        self.outbox = outbox
+        self.pool = pool
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.started_time = None
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def get_rate(self) -> float:
+        """
+        Get the number of sent messages per second since the start
+
+        :return: messages per second
+        """
+        elapsed = time.monotonic() - self.started_time
+        return self.sent / elapsed if elapsed else 0.0
+
+    def drain_batch(self) -> int:
+        """
+        Claim and send a batch of messages
+
+        :return: number of claimed messages
+        """
+        claimed = self.outbox.claim(limit=self.batch_size)
+        if not claimed:
+            return 0
+        identifiers = [identifier for identifier, _ in claimed]
+        try:
+            results = self.pool.send_many([message
+                                           for _, message in claimed])
+        except Exception as error:
+            # Send the messages again later instead of leaving them claimed
+            failed = self.outbox.release(identifiers=identifiers,
+                                         error=str(error))
+            with self._stats_lock:
+                self.failed += failed
+                self.retried += len(identifiers) - failed
+            return len(claimed)
+        sent = failed = retried = 0
+        for identifier, result in zip(identifiers, results):
+            if result.success:
+                self.outbox.mark_sent(identifiers=[identifier],
+                                      error=(str(result.refused)
+                                             if result.refused else None))
+                sent += 1
+            elif result.transient:
+                if self.outbox.release(identifiers=[identifier],
+                                       error=str(result.error)):
+                    # No attempts left
+                    failed += 1
+                else:
+                    retried += 1
+            else:
+                self.outbox.mark_failed(identifiers=[identifier],
+                                        error=str(result.error))
+                failed += 1
+        with self._stats_lock:
+            self.sent += sent
+            self.failed += failed
+            self.retried += retried
+        return len(claimed)
+
+    def run(self,
+            until_empty: bool = False) -> None:
+        """
+        Send the messages until stopped
+
+        :param until_empty: stop when no more messages are ready to be sent,
+                            leaving queued the messages waiting for their
+                            next attempt
+        """
+        if self.started_time is None:
+            self.started_time = time.monotonic()
+        while not self._stop.is_set():
+            if not self.drain_batch():
+                if until_empty:
+                    break
+                self._stop.wait(self.poll_interval)
+
+    def start(self,
+              until_empty: bool = False) -> None:
+        """
+        Start the background threads sending the messages
+
+        :param until_empty: stop when no more messages are ready to be sent,
+                            leaving queued the messages waiting for their
+                            next attempt
+        """
+        self.started_time = time.monotonic()
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self.run,
+                                          args=(until_empty, ),
+                                          daemon=True)
+                         for _ in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def wait(self,
+             timeout: Optional[float] = None) -> bool:
+        """
+        Wait for the background threads to finish
+
+        :param timeout: seconds to wait or None to wait forever
+        :return: True if all the threads have finished
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None
+                        else max(0.0, deadline - time.monotonic()))
+        return not any(thread.is_alive() for thread in self._threads)
+
+    def stop(self) -> None:
+        """
+        Stop the background threads, waiting the current batches
+        """
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
@@ -0,0 +1,343 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import dataclasses
+import itertools
+import multiprocessing
+import queue
+import zlib
+from typing import Callable, Iterable, Iterator, Optional, Union
+
+from .connection_pool import ConnectionPool
+from .message import FrozenMessage, Message
+from .rate_limiter import RateLimiter, SharedRateLimiter
+
+
+@dataclasses.dataclass
+class SendStatus(object):
+    index: int
+    accepted: list[str] = dataclasses.field(default_factory=lambda: [])
+    refused: dict[str, tuple[int, bytes]] = dataclasses.field(
+        default_factory=lambda: {})
+    error: Optional[str] = None
+
+    @property
+    def success(self) -> bool:
+        """
+        Check if the message was accepted for at least a recipient
+
+        :return: True if the message was sent
+        """
+        return self.error is None and bool(self.accepted)
+
+
+@dataclasses.dataclass
+class ConnectionSettings(object):
+    server: str
+    port: int = 25
+    username: str = None
+    password: str = None
+    encryption: Optional[str] = None
+    ciphers: Optional[str] = None
+    timeout: int = 30
+    rate: Optional[float] = None
+    burst: int = 1
+    daily_quota: Optional[int] = None
+
+    def get_rate_limiter(self,
+                         shared: bool = False) -> Optional[RateLimiter]:
+        """
+        Create a RateLimiter object for the configured limits
+
+        :param shared: create a SharedRateLimiter object to share the limits
+                       between many processes
+        :return: RateLimiter object or None if no limits are set
+        """
+        if not self.rate and not self.daily_quota:
+            return None
+        return (SharedRateLimiter if shared else RateLimiter)(
+            rate=self.rate,
+            burst=self.burst,
+            daily_quota=self.daily_quota)
+
+    def get_pool(self,
+                 rate_limiter: Optional[RateLimiter] = None
+                 ) -> ConnectionPool:
+        """
+        Create a ConnectionPool object with a single connection, kept open
+        across the batches until it's closed by the server
+
+        :param rate_limiter: RateLimiter object shared with other pools or
+                             None to create a new one for the configured
+                             limits
+        :return: ConnectionPool object
+        """
+        return ConnectionPool(server=self.server,
+                              port=self.port,
+                              username=self.username,
+                              password=self.password,
+                              encryption=self.encryption,
+                              ciphers=self.ciphers,
+                              size=1,
+                              timeout=self.timeout,
+                              max_age=0,
+                              max_messages=0,
+                              rate_limiter=(rate_limiter or
+                                            self.get_rate_limiter()))
+
+
+def get_domain_key(message: Union[Message, FrozenMessage]) -> str:
+    """
+    Get the sharding key for a message from its first recipient domain
+
+    :param message: Message or FrozenMessage object
+    :return: domain of the first recipient
+    """
+    recipients = message._get_envelope_recipients()
+    return recipients[0].rpartition('@')[2].lower() if recipients else ''
+
+
+def _worker(settings: ConnectionSettings,
+            rate_limiter: Optional[SharedRateLimiter],
+            input_queue: multiprocessing.Queue,
+            output_queue: multiprocessing.Queue) -> None:
+    """
+    Worker process sending the batches of messages from the input queue using
+    its own connection
+
+    :param settings: ConnectionSettings object
+    :param rate_limiter: SharedRateLimiter object shared by all the workers
+                         or None if no limits are set
+    :param input_queue: queue with lists of (index, message) tuples, or None
+                        to stop the worker
+    :param output_queue: queue for the lists of SendStatus objects, None is
+                         sent when the worker stops
+    """
+    pool = settings.get_pool(rate_limiter=rate_limiter)
+    while (batch := input_queue.get()) is not None:
+        results = pool.send_many([message for _, message in batch])
+        output_queue.put([SendStatus(
+            index=index,
+            accepted=result.accepted,
+            refused=result.refused,
+            error=(f'{type(result.error).__name__}: {result.error}'
+                   if result.error else None))
+            for (index, _), result in zip(batch, results)])
+    pool.close()
+    output_queue.put(None)
+
+
+class ProcessSender(object):
+    """
+    Send messages using many worker processes, each one with its own
+    connection
+
+    The messages are split between the processes using a sharding key, by
+    default the domain of the first recipient, so the messages for the same
+    domain are always sent by the same process.
+    The rate limits in the settings are shared by all the processes, so a
+    process sending most of the messages can use the whole limits.
+    """
+    # Seconds to wait for the statuses before checking the worker processes
+    POLL_INTERVAL = 1.0
+
+    def __init__(self,
+                 settings: ConnectionSettings,
+                 processes: Optional[int] = None,
+                 batch_size: int = 50,
+                 key: Callable[[Union[Message, FrozenMessage]],
+                               str] = get_domain_key):
+        self.settings = settings
+        self.processes = processes or multiprocessing.cpu_count()
+        self.batch_size = batch_size
+        self.key = key
+        self._output_queue = None
+        self._input_queues = []
+        self._workers = []
+        self._outstanding = {}
+        self._dead = set()
+        self._stopped = 0
+
+    def send(self,
+             messages: Iterable[Union[Message, FrozenMessage]]
+             ) -> Iterator[SendStatus]:
+        """
+        Send the messages, yielding a SendStatus object for each message as
+        soon as it's sent
+
+        The statuses are yielded in the order they are received from the
+        workers, use the index attribute to match the original message.
+        If a worker process dies, its messages not sent yet are reported
+        with an error.
+
+        :param messages: iterable with the Message objects to send
+        :return: iterator of SendStatus objects
+        """
+        context = multiprocessing.get_context()
+        self._output_queue = context.Queue()
+        # Limit the queued batches for each worker to keep bounded memory
+        self._input_queues = [context.Queue(maxsize=4)
+                              for _ in range(self.processes)]
+        # A single limiter for the account, whatever process sends
+        rate_limiter = self.settings.get_rate_limiter(shared=True)
+        self._workers = [context.Process(target=_worker,
+                                         args=(self.settings,
+                                               rate_limiter,
+                                               input_queue,
+                                               self._output_queue),
+                                         daemon=True)
+                         for input_queue in self._input_queues]
+        for worker in self._workers:
+            worker.start()
+        # Shard for each message not reported yet by the workers
+        self._outstanding = {}
+        # Shards whose worker process died and number of stopped workers
+        self._dead = set()
+        self._stopped = 0
+        batches = [[] for _ in range(self.processes)]
+        try:
+            for index, message in zip(itertools.count(), messages):
+                shard = zlib.crc32(
+                    self.key(message).encode('utf-8')) % self.processes
+                batches[shard].append((index, message))
+                self._outstanding[index] = shard
+                if len(batches[shard]) >= self.batch_size:
+                    yield from self._put(shard=shard,
+                                         batch=batches[shard])
+                    batches[shard] = []
+            for shard, batch in enumerate(batches):
+                if batch:
+                    yield from self._put(shard=shard,
+                                         batch=batch)
+            # Stop the workers after all the batches were queued
+            for shard in range(self.processes):
+                yield from self._put(shard=shard,
+                                     batch=None)
+            while self._is_running():
+                yield from self._get_ready(timeout=self.POLL_INTERVAL)
+        finally:
+            running = self._is_running()
+            for worker in self._workers:
+                if running:
+                    # Interrupted before the workers have finished
+                    worker.terminate()
+                worker.join()
+
+    def _is_running(self) -> bool:
+        """
+        Check if any worker process has still to finish
+
+        :return: True if any worker is still running
+        """
+        return self._stopped + len(self._dead) < self.processes
+
+    def _get_ready(self,
+                   timeout: float = 0) -> Iterator[SendStatus]:
+        """
+        Get the statuses already received from the workers, then check for
+        the worker processes which died
+
+        :param timeout: seconds to wait for the first statuses
+        :return: iterator of SendStatus objects
+        """
+        yield from self._receive(timeout=timeout)
+        for shard, worker in enumerate(self._workers):
+            if shard in self._dead or worker.exitcode in (None, 0):
+                continue
+            self._dead.add(shard)
+            # Get the statuses sent before the worker died
+            yield from self._receive()
+            yield from self._fail(
+                indexes=[index
+                         for index, value in self._outstanding.items()
+                         if value == shard],
+                error=self._get_exit_error(shard))
+
+    def _receive(self,
+                 timeout: float = 0) -> Iterator[SendStatus]:
+        """
+        Get the statuses already received from the workers
+
+        :param timeout: seconds to wait for the first statuses
+        :return: iterator of SendStatus objects
+        """
+        while True:
+            try:
+                statuses = (self._output_queue.get(timeout=timeout)
+                            if timeout
+                            else self._output_queue.get_nowait())
+            except queue.Empty:
+                return
+            timeout = 0
+            if statuses is None:
+                self._stopped += 1
+                continue
+            for status in statuses:
+                if self._outstanding.pop(status.index, None) is not None:
+                    yield status
+
+    def _fail(self,
+              indexes: Iterable[int],
+              error: str) -> Iterator[SendStatus]:
+        """
+        Report the messages which can't be sent
+
+        :param indexes: indexes of the messages
+        :param error: error description
+        :return: iterator of SendStatus objects
+        """
+        for index in indexes:
+            if self._outstanding.pop(index, None) is not None:
+                yield SendStatus(index=index,
+                                 error=error)
+
+    def _put(self,
+             shard: int,
+             batch: Optional[list]) -> Iterator[SendStatus]:
+        """
+        Put a batch in a worker queue, yielding the available statuses while
+        waiting for the worker queue to have free space
+
+        :param shard: worker number
+        :param batch: list of (index, message) tuples or None to stop the
+                      worker
+        :return: iterator of SendStatus objects
+        """
+        while shard not in self._dead:
+            yield from self._get_ready()
+            try:
+                self._input_queues[shard].put(batch, timeout=0.01)
+                return
+            except queue.Full:
+                pass
+        if batch:
+            # The worker process died, the messages can't be sent
+            yield from self._fail(indexes=[index for index, _ in batch],
+                                  error=self._get_exit_error(shard))
+
+    def _get_exit_error(self, shard: int) -> str:
+        """
+        Get the error for the messages of a worker process which died
+
+        :param shard: worker number
+        :return: error description
+        """
+        return ('RuntimeError: The worker process exited with code '
+                f'{self._workers[shard].exitcode}')
@@ -29,6 +29,9 @@ class ProfileMessage(YamlProfile):
     TO = 'TO'
     CC = 'CC'
     BCC = 'BCC'
+    TO_FILE = 'TO_FILE'
+    CC_FILE = 'CC_FILE'
+    BCC_FILE = 'BCC_FILE'
     REPLY_TO = 'REPLY_TO'
     SUBJECT = 'SUBJECT'
     BODY = 'BODY'
@@ -39,8 +42,11 @@ class ProfileMessage(YamlProfile):
     CONTENT_TYPES = 'CONTENT_TYPES'
     HEADERS = 'HEADERS'
 
-    def __init__(self, filename: str):
-        super().__init__(filename)
+    def __init__(self,
+                 filename: Optional[str] = None,
+                 config: Optional[dict] = None):
+        super().__init__(filename=filename,
+                         config=config)
         self.section_name = self.SECTION
         # Get options from profile file
         self.sender = self.get_option(option=self.SENDER)
@@ -50,6 +56,9 @@ class ProfileMessage(YamlProfile):
                                   default=[])
         self.bcc = self.get_option(option=self.BCC,
                                    default=[])
+        self.to_file = self.get_option(option=self.TO_FILE)
+        self.cc_file = self.get_option(option=self.CC_FILE)
+        self.bcc_file = self.get_option(option=self.BCC_FILE)
         self.reply_to = self.get_option(option=self.REPLY_TO)
         self.subject = self.get_option(option=self.SUBJECT)
         self.body = self.get_option(option=self.BODY)
@@ -0,0 +1,222 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import os
+import threading
+
+from .profile_message import ProfileMessage
+from .profile_smtp import ProfileSmtp
+from .yaml_profile import YamlProfile
+
+
+class ProfileRegistry(object):
+    """
+    Many named SMTP and MESSAGE profiles loaded from a single YAML file or
+    from all the YAML files in a directory
+
+    Each section contains the profiles indexed by name, a profile can
+    inherit the options from another profile of the same section using the
+    INHERITS option, while the DEFAULTS section contains the default options
+    for every profile of each section.
+    A file with a single profile, like the ones used by ProfileSmtp, is
+    loaded using the file name without extension as profile name.
+    """
+    SECTION_DEFAULTS = 'DEFAULTS'
+    OPTION_INHERITS = 'INHERITS'
+    PROFILE_TYPES = {
+        ProfileSmtp.SECTION: ProfileSmtp,
+        ProfileMessage.SECTION: ProfileMessage,
+    }
+    EXTENSIONS = ('.yaml', '.yml')
+
+    def __init__(self, path: str):
+        self.path = path
+        # Raw profile definitions indexed by section and name
+        self._definitions: dict[str, dict[str, dict]] = {}
+        # Default options for each section
+        self._defaults: dict[str, dict] = {}
+        # Resolved profile objects indexed by (section, name)
+        self._profiles: dict[tuple[str, str], YamlProfile] = {}
+        self._lock = threading.Lock()
+        self.reload()
+
+    def _get_filenames(self) -> list[str]:
+        """
+        Get the profile files to load
+
+        :return: list of files paths
+        """
+        if not os.path.isdir(self.path):
+            return [self.path]
+        return sorted(os.path.join(self.path, filename)
+                      for filename in os.listdir(self.path)
+                      if filename.endswith(self.EXTENSIONS))
+
+    def reload(self) -> set[tuple[str, str]]:
+        """
+        Load again the changed files, keeping the unchanged profiles
+
+        :return: set of (section, name) tuples for the changed profiles
+        """
+        definitions = {section: {} for section in self.PROFILE_TYPES}
+        defaults = {}
+        for filename in self._get_filenames():
+            # Only the changed files are parsed again
+            config = YamlProfile.load(filename=filename)
+            for section, profiles in (config or {}).items():
+                if not profiles:
+                    # Empty section
+                    continue
+                if section == self.SECTION_DEFAULTS:
+                    for name, options in profiles.items():
+                        defaults.setdefault(name, {}).update(options or {})
+                    continue
+                if section not in definitions:
+                    continue
+                if not all(isinstance(options, dict)
+                           for options in profiles.values()):
+                    # Single profile file
+                    name = os.path.splitext(os.path.basename(filename))[0]
+                    profiles = {name: profiles}
+                for name, options in profiles.items():
+                    if name in definitions[section]:
+                        raise ValueError(f'Duplicated {section} profile '
+                                         f'{name} in {filename}')
+                    definitions[section][name] = options or {}
+        with self._lock:
+            changed = set()
+            for section in self.PROFILE_TYPES:
+                old = self._definitions.get(section, {})
+                new = definitions[section]
+                if (self._defaults.get(section) !=
+                        defaults.get(section)):
+                    # The defaults apply to every profile in the section
+                    changed.update((section, name)
+                                   for name in {*old, *new})
+                    continue
+                changed.update((section, name)
+                               for name in {*old, *new}
+                               if old.get(name) != new.get(name))
+            changed = self._add_descendants(definitions=definitions,
+                                            changed=changed)
+            for key in changed:
+                self._profiles.pop(key, None)
+            self._definitions = definitions
+            self._defaults = defaults
+        return changed
+
+    def _add_descendants(self,
+                         definitions: dict[str, dict[str, dict]],
+                         changed: set[tuple[str, str]]
+                         ) -> set[tuple[str, str]]:
+        """
+        Add the profiles inheriting from the changed profiles
+
+        :param definitions: new profile definitions
+        :param changed: set of (section, name) tuples for changed profiles
+        :return: set of (section, name) tuples including the descendants
+        """
+        result = set(changed)
+        pending = list(changed)
+        while pending:
+            section, parent = pending.pop()
+            for name, options in definitions[section].items():
+                if (options.get(self.OPTION_INHERITS) == parent and
+                        (section, name) not in result):
+                    result.add((section, name))
+                    pending.append((section, name))
+        return result
+
+    def _resolve(self,
+                 section: str,
+                 name: str) -> dict:
+        """
+        Get the options for a profile merging its defaults and its parents
+
+        :param section: profile section name
+        :param name: profile name
+        :return: dictionary with the profile options
+        """
+        chain = []
+        while name is not None:
+            if name in chain:
+                raise ValueError(f'Circular inheritance for the {section} '
+                                 f'profile {name}')
+            chain.append(name)
+            try:
+                options = self._definitions[section][name]
+            except KeyError:
+                raise KeyError(f'{section} profile {name} not '
+                               'found') from None
+            name = options.get(self.OPTION_INHERITS)
+        result = dict(self._defaults.get(section, {}))
+        for name in reversed(chain):
+            result.update(self._definitions[section][name])
+        result.pop(self.OPTION_INHERITS, None)
+        return result
+
+    def get(self,
+            section: str,
+            name: str) -> YamlProfile:
+        """
+        Get a profile by section and name
+
+        :param section: profile section name, like SMTP or MESSAGE
+        :param name: profile name
+        :return: profile object
+        """
+        key = (section, name)
+        with self._lock:
+            if (profile := self._profiles.get(key)) is None:
+                profile = self.PROFILE_TYPES[section](
+                    config={section: self._resolve(section=section,
+                                                   name=name)})
+                self._profiles[key] = profile
+            return profile
+
+    def get_smtp(self, name: str) -> ProfileSmtp:
+        """
+        Get an SMTP profile by name
+
+        :param name: profile name
+        :return: ProfileSmtp object
+        """
+        return self.get(section=ProfileSmtp.SECTION,
+                        name=name)
+
+    def get_message(self, name: str) -> ProfileMessage:
+        """
+        Get a MESSAGE profile by name
+
+        :param name: profile name
+        :return: ProfileMessage object
+        """
+        return self.get(section=ProfileMessage.SECTION,
+                        name=name)
+
+    def get_names(self,
+                  section: str = ProfileSmtp.SECTION) -> list[str]:
+        """
+        Get the profile names for a section
+
+        :param section: profile section name
+        :return: list of profile names
+        """
+        return list(self._definitions.get(section, {}))
@@ -0,0 +1,50 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import os.path
+
+from .profile_smtp import ProfileSmtp
+from .yaml_profile import YamlProfile
+
+
+class ProfileRouter(YamlProfile):
+    SECTION = 'ROUTER'
+    OPTION_ROUTES = 'ROUTES'
+    OPTION_DEFAULT = 'DEFAULT'
+    OPTION_NAME = 'NAME'
+    OPTION_PROFILE = 'PROFILE'
+    OPTION_DOMAINS = 'DOMAINS'
+
+    def __init__(self, filename: str):
+        super().__init__(filename)
+        self.section_name = self.SECTION
+        # Get options from profile file
+        self.default = self.get_option(option=self.OPTION_DEFAULT)
+        self.routes = []
+        directory = os.path.dirname(os.path.abspath(filename))
+        for route in self.get_option(option=self.OPTION_ROUTES,
+                                     default=[]):
+            # SMTP profiles are relative to the router profile
+            profile = ProfileSmtp(os.path.join(
+                directory,
+                route[self.OPTION_PROFILE]))
+            self.routes.append((route[self.OPTION_NAME],
+                                route.get(self.OPTION_DOMAINS, []),
+                                profile))
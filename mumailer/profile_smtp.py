@@ -18,6 +18,8 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 ##
 
+from typing import Optional
+
 from .yaml_profile import YamlProfile
 
 
@@ -30,9 +32,16 @@ class ProfileSmtp(YamlProfile):
     OPTION_TIMEOUT = 'TIMEOUT'
     OPTION_ENCRYPTION = 'ENCRYPTION'
     OPTION_CIPHERS = 'CIPHERS'
+    OPTION_RATE = 'RATE'
+    OPTION_BURST = 'BURST'
+    OPTION_DAILY_QUOTA = 'DAILY_QUOTA'
+    OPTION_MAX_RECIPIENTS = 'MAX_RECIPIENTS'
 
-    def __init__(self, filename: str):
-        super().__init__(filename)
+    def __init__(self,
+                 filename: Optional[str] = None,
+                 config: Optional[dict] = None):
+        super().__init__(filename=filename,
+                         config=config)
         self.section_name = self.SECTION
         # Get options from profile file
         self.server = self.get_option(option=self.OPTION_SERVER)
@@ -42,3 +51,9 @@ class ProfileSmtp(YamlProfile):
         self.password = self.get_option(option=self.OPTION_PASSWORD)
         self.encryption = self.get_option(option=self.OPTION_ENCRYPTION)
         self.ciphers = self.get_option(option=self.OPTION_CIPHERS)
+        self.rate = self.get_option(option=self.OPTION_RATE)
+        self.burst = self.get_option(option=self.OPTION_BURST,
+                                     default=1)
+        self.daily_quota = self.get_option(option=self.OPTION_DAILY_QUOTA)
+        self.max_recipients = self.get_option(
+            option=self.OPTION_MAX_RECIPIENTS)
@@ -0,0 +1,242 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import multiprocessing
+import threading
+import time
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    # Avoid loading the YAML module until a profile is used
+    from .profile_smtp import ProfileSmtp
+
+
+class RateLimitExceeded(Exception):
+    """
+    The next message can't be sent within the maximum delay
+
+    It's not an OSError like TimeoutError, so the connection used to send
+    the message is still considered valid.
+    """
+
+
+class TokenBucket(object):
+    def __init__(self,
+                 rate: float,
+                 capacity: float = 1):
+        """
+        Token bucket refilled at a constant rate
+
+        The tokens can be reserved in advance making the bucket negative,
+        so the following reservations are delayed accordingly.
+
+        :param rate: tokens added each second
+        :param capacity: maximum number of tokens in the bucket
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_time = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        """
+        Add the tokens produced since the last update
+
+        :param now: current monotonic time
+        """
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated_time) * self.rate)
+        self.updated_time = now
+
+    def get_delay(self, count: float) -> float:
+        """
+        Get the seconds to wait before the tokens are available
+
+        :param count: number of tokens needed
+        :return: seconds to wait
+        """
+        return max(0.0, (count - self.tokens) / self.rate)
+
+
+class SharedTokenBucket(TokenBucket):
+    def __init__(self,
+                 rate: float,
+                 capacity: float = 1):
+        """
+        Token bucket kept in shared memory, used by many processes
+
+        The bucket must be passed to the processes when they are created.
+
+        :param rate: tokens added each second
+        :param capacity: maximum number of tokens in the bucket
+        """
+        # Tokens and last update time
+        self._values = multiprocessing.RawArray('d', 2)
+        super().__init__(rate=rate,
+                         capacity=capacity)
+
+    @property
+    def tokens(self) -> float:
+        """
+        Get the tokens in the bucket from the shared memory
+
+        :return: number of tokens
+        """
+        return self._values[0]
+
+    @tokens.setter
+    def tokens(self, value: float) -> None:
+        self._values[0] = value
+
+    @property
+    def updated_time(self) -> float:
+        """
+        Get the last update time from the shared memory
+
+        :return: monotonic time of the last update
+        """
+        return self._values[1]
+
+    @updated_time.setter
+    def updated_time(self, value: float) -> None:
+        self._values[1] = value
+
+
+class RateLimiter(object):
+    # Seconds in the daily quota period
+    DAY = 86400
+
+    def __init__(self,
+                 rate: Optional[float] = None,
+                 burst: int = 1,
+                 daily_quota: Optional[int] = None,
+                 max_delay: Optional[float] = None):
+        """
+        Limit the messages sent per second and per day
+
+        The messages are paced evenly at the rate, allowing at most `burst`
+        messages to be sent together. The daily quota is spread over the day
+        once the initial quota is used.
+
+        :param rate: messages per second or None for no limit
+        :param burst: messages that can be sent without waiting
+        :param daily_quota: messages per day or None for no limit
+        :param max_delay: maximum seconds to wait before raising
+                          RateLimitExceeded or None to wait forever
+        """
+        self.rate = rate
+        self.burst = burst
+        self.daily_quota = daily_quota
+        self.max_delay = max_delay
+        self.buckets = []
+        if rate:
+            self.buckets.append(TokenBucket(rate=rate,
+                                            capacity=burst))
+        if daily_quota:
+            self.buckets.append(TokenBucket(rate=daily_quota / self.DAY,
+                                            capacity=daily_quota))
+        # Total seconds spent waiting for the limits
+        self.waited_time = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def from_profile(profile: 'ProfileSmtp') -> Optional['RateLimiter']:
+        """
+        Create a RateLimiter object using the limits from a ProfileSmtp
+
+        :param profile: ProfileSmtp object with the limits
+        :return: RateLimiter object or None if no limits are set
+        """
+        if not profile.rate and not profile.daily_quota:
+            return None
+        return RateLimiter(rate=profile.rate,
+                           burst=profile.burst,
+                           daily_quota=profile.daily_quota)
+
+    def reserve(self,
+                count: int = 1,
+                max_delay: Optional[float] = None) -> Optional[float]:
+        """
+        Reserve the tokens to send some messages
+
+        :param count: number of messages to send
+        :param max_delay: maximum seconds to wait or None to wait forever
+        :return: seconds to wait before sending or None if the delay would
+                 be greater than max_delay, in this case nothing is reserved
+        """
+        with self._lock:
+            now = time.monotonic()
+            delay = 0.0
+            for bucket in self.buckets:
+                bucket.refill(now=now)
+                delay = max(delay, bucket.get_delay(count=count))
+            if max_delay is not None and delay > max_delay:
+                return None
+            for bucket in self.buckets:
+                bucket.tokens -= count
+            self.waited_time += delay
+            return delay
+
+    def acquire(self,
+                count: int = 1) -> None:
+        """
+        Wait until some messages can be sent
+
+        :param count: number of messages to send
+        """
+        delay = self.reserve(count=count,
+                             max_delay=self.max_delay)
+        if delay is None:
+            raise RateLimitExceeded('Rate limit exceeded, the next message '
+                                    'can not be sent within '
+                                    f'{self.max_delay} seconds')
+        if delay:
+            time.sleep(delay)
+
+
+class SharedRateLimiter(RateLimiter):
+    def __init__(self,
+                 rate: Optional[float] = None,
+                 burst: int = 1,
+                 daily_quota: Optional[int] = None,
+                 max_delay: Optional[float] = None):
+        """
+        Limit the messages sent per second and per day by many processes
+
+        The limits are shared by all the processes using the object, which
+        must be passed to the processes when they are created, like the
+        ProcessSender does for its worker processes.
+
+        :param rate: messages per second or None for no limit
+        :param burst: messages that can be sent without waiting
+        :param daily_quota: messages per day or None for no limit
+        :param max_delay: maximum seconds to wait before raising
+                          RateLimitExceeded or None to wait forever
+        """
+        super().__init__(rate=rate,
+                         burst=burst,
+                         daily_quota=daily_quota,
+                         max_delay=max_delay)
+        # The monotonic clock is system-wide, so it's the same for every
+        # process
+        self.buckets = [SharedTokenBucket(rate=bucket.rate,
+                                          capacity=bucket.capacity)
+                        for bucket in self.buckets]
+        self._lock = multiprocessing.Lock()
@@ -0,0 +1,325 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import array
+import collections.abc
+import itertools
+import operator
+import sys
+from typing import Iterable, Iterator, Optional, Union
+
+from .recipient import Recipient
+
+
+class _DomainIds(dict):
+    """
+    Identifier for each distinct domain, assigned on the first use
+    """
+    def __init__(self, domains: list[str]):
+        super().__init__((domain, index)
+                         for index, domain in enumerate(domains))
+        self.domains = domains
+
+    def __missing__(self, domain: str) -> int:
+        index = len(self.domains)
+        self.domains.append(domain)
+        self[domain] = index
+        return index
+
+
+class RecipientList(collections.abc.Sequence):
+    # Number of recipients packed together by add_many
+    BATCH_SIZE = 65536
+
+    def __init__(self,
+                 recipients: Iterable[Recipient] = ()):
+        """
+        Compact list of recipients
+
+        The local parts and the names are stored as UTF-8 in packed buffers
+        and each distinct domain is stored only once, using a few bytes for
+        each recipient instead of a Recipient object. The Recipient objects
+        are created only while accessing the items, so any change to them
+        is not stored in the list.
+
+        :param recipients: Recipient objects to add
+        """
+        # Local parts and their end offsets
+        self._local_parts = bytearray()
+        self._local_ends = array.array('Q')
+        # Names and their end offsets, the empty names are None
+        self._names = bytearray()
+        self._name_ends = array.array('Q')
+        # Domains, including the at sign, and the domain for each recipient
+        self._domains = []
+        self._domain_indexes = array.array('I')
+        self._domain_ids = _DomainIds(domains=self._domains)
+        self.extend(recipients)
+
+    def __len__(self) -> int:
+        return len(self._local_ends)
+
+    def __getitem__(self,
+                    index: Union[int, slice]
+                    ) -> Union[Recipient, 'RecipientList']:
+        if isinstance(index, slice):
+            result = RecipientList()
+            result.add_many(addresses=self.get_addresses()[index],
+                            names=self.get_names()[index])
+            return result
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('RecipientList index out of range')
+        return Recipient(name=self.get_name(index),
+                         address=self.get_address(index))
+
+    def __iter__(self) -> Iterator[Recipient]:
+        return map(Recipient, self.get_names(), self.get_addresses())
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, RecipientList):
+            return (self.get_addresses() == other.get_addresses() and
+                    self.get_names() == other.get_names())
+        if isinstance(other, collections.abc.Sequence):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f'RecipientList({len(self)} recipients)'
+
+    def __getstate__(self) -> dict:
+        # The domains identifiers are rebuilt after unpickling
+        state = self.__dict__.copy()
+        del state['_domain_ids']
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._domain_ids = _DomainIds(domains=self._domains)
+
+    def add(self,
+            address: str,
+            name: Optional[str] = None) -> None:
+        """
+        Add a recipient without creating a Recipient object
+
+        :param address: recipient address
+        :param name: recipient name or None
+        """
+        at = address.rfind('@')
+        if at < 0:
+            at = len(address)
+        self._local_parts += address[:at].encode('utf-8')
+        self._local_ends.append(len(self._local_parts))
+        self._domain_indexes.append(self._domain_ids[address[at:]])
+        if name:
+            self._names += name.encode('utf-8')
+        self._name_ends.append(len(self._names))
+
+    def add_many(self,
+                 addresses: Iterable[str],
+                 names: Optional[Iterable[Optional[str]]] = None) -> None:
+        """
+        Add many recipients without creating the Recipient objects
+
+        The addresses are read and packed in batches, so they can be
+        generated lazily without keeping all of them in memory.
+
+        :param addresses: recipients addresses
+        :param names: recipients names, in the same order of the addresses,
+                      or None to add the recipients without names
+        """
+        addresses = iter(addresses)
+        if names is not None:
+            names = iter(names)
+        while batch := list(itertools.islice(addresses, self.BATCH_SIZE)):
+            self._add_batch(addresses=batch,
+                            names=(None
+                                   if names is None
+                                   else list(itertools.islice(names,
+                                                              len(batch)))))
+
+    def _add_batch(self,
+                   addresses: list[str],
+                   names: Optional[list[Optional[str]]]) -> None:
+        """
+        Add a batch of recipients
+
+        :param addresses: recipients addresses
+        :param names: recipients names or None
+        """
+        # Split each address in its local part and its domain, including
+        # the at sign, the addresses without domain have an empty domain
+        splits = [address.rpartition('@') for address in addresses]
+        local_parts = [local_part if at else domain
+                       for local_part, at, domain in splits]
+        domains = [at + domain if at else ''
+                   for _, at, domain in splits]
+        del splits
+        self._extend_buffer(buffer=self._local_parts,
+                            ends=self._local_ends,
+                            values=local_parts)
+        self._domain_indexes.extend(map(self._domain_ids.__getitem__,
+                                        domains))
+        if names is None:
+            self._name_ends.extend(itertools.repeat(len(self._names),
+                                                    len(addresses)))
+        else:
+            self._extend_buffer(buffer=self._names,
+                                ends=self._name_ends,
+                                values=[name or '' for name in names])
+
+    @staticmethod
+    def _extend_buffer(buffer: bytearray,
+                       ends: array.array,
+                       values: list[str]) -> None:
+        """
+        Append many strings to a packed buffer
+
+        :param buffer: buffer to extend
+        :param ends: end offsets for the strings in the buffer
+        :param values: strings to append
+        """
+        text = ''.join(values)
+        if text.isascii():
+            # Each character is encoded as a single byte
+            data = text.encode('ascii')
+            lengths = map(len, values)
+        else:
+            encoded = [value.encode('utf-8') for value in values]
+            data = b''.join(encoded)
+            lengths = map(len, encoded)
+        ends.extend(itertools.islice(itertools.accumulate(
+            lengths, initial=len(buffer)), 1, None))
+        buffer += data
+
+    def append(self, recipient: Recipient) -> None:
+        """
+        Add a Recipient object
+
+        :param recipient: Recipient object to add
+        """
+        self.add(address=recipient.address,
+                 name=recipient.name)
+
+    def extend(self, recipients: Iterable[Recipient]) -> None:
+        """
+        Add many Recipient objects
+
+        :param recipients: Recipient objects to add
+        """
+        if isinstance(recipients, RecipientList):
+            self.add_many(addresses=recipients.get_addresses(),
+                          names=recipients.get_names())
+        else:
+            recipients = iter(recipients)
+            while batch := list(itertools.islice(recipients,
+                                                 self.BATCH_SIZE)):
+                self._add_batch(addresses=[recipient.address
+                                           for recipient in batch],
+                                names=[recipient.name
+                                       for recipient in batch])
+
+    def get_address(self, index: int) -> str:
+        """
+        Get the address for a recipient
+
+        :param index: recipient index
+        :return: recipient address
+        """
+        start = self._local_ends[index - 1] if index else 0
+        return (self._local_parts[start:self._local_ends[index]].decode(
+                    'utf-8') +
+                self._domains[self._domain_indexes[index]])
+
+    def get_name(self, index: int) -> Optional[str]:
+        """
+        Get the name for a recipient
+
+        :param index: recipient index
+        :return: recipient name or None
+        """
+        start = self._name_ends[index - 1] if index else 0
+        return self._names[start:self._name_ends[index]].decode(
+            'utf-8') or None
+
+    @staticmethod
+    def _split_buffer(buffer: bytearray,
+                      ends: array.array) -> Iterator[str]:
+        """
+        Get the strings from a packed buffer
+
+        :param buffer: buffer with the strings
+        :param ends: end offsets for the strings in the buffer
+        :return: iterator of strings
+        """
+        slices = map(slice, itertools.chain((0, ), ends), ends)
+        if buffer.isascii():
+            # The offsets are the same for the decoded text
+            return map(buffer.decode('ascii').__getitem__, slices)
+        return map(bytearray.decode, map(buffer.__getitem__, slices))
+
+    def get_addresses(self) -> list[str]:
+        """
+        Get the addresses for all the recipients
+
+        :return: list of addresses
+        """
+        return list(map(operator.add,
+                        self._split_buffer(buffer=self._local_parts,
+                                           ends=self._local_ends),
+                        map(self._domains.__getitem__,
+                            self._domain_indexes)))
+
+    def get_names(self) -> list[Optional[str]]:
+        """
+        Get the names for all the recipients
+
+        :return: list of names, None for the recipients without a name
+        """
+        if not self._names:
+            return [None] * len(self)
+        return [name or None
+                for name in self._split_buffer(buffer=self._names,
+                                               ends=self._name_ends)]
+
+    def get_domains(self) -> list[str]:
+        """
+        Get the distinct domains, without the at sign
+
+        :return: list of domains
+        """
+        return [domain[1:] for domain in self._domains if len(domain) > 1]
+
+    def get_size(self) -> int:
+        """
+        Get the memory used by the list
+
+        :return: memory used in bytes
+        """
+        return (sys.getsizeof(self._local_parts) +
+                sys.getsizeof(self._local_ends) +
+                sys.getsizeof(self._names) +
+                sys.getsizeof(self._name_ends) +
+                sys.getsizeof(self._domain_indexes) +
+                sys.getsizeof(self._domains) +
+                sum(map(sys.getsizeof, self._domains)) +
+                sys.getsizeof(self._domain_ids))
@@ -0,0 +1,376 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import collections
+import itertools
+import operator
+import re
+import string
+import sys
+from typing import Iterable, Iterator, Optional, Sequence, Union
+
+from .recipient import Recipient
+from .recipient_list import RecipientList
+
+# RFC 5322 address syntax, with the UTF-8 characters allowed by RFC 6532
+ATEXT = r"[\w!#$%&'*+/=?^`{|}~-]"
+LOCAL_PART = (rf'(?:{ATEXT}+(?:\.{ATEXT}+)*'
+              r'|"(?:[^"\\\r\n]|\\[^\r\n])*")')
+DOMAIN_LABEL = r'[^\W_](?:[\w-]*[^\W_])?'
+DOMAIN = (rf'(?:{DOMAIN_LABEL}(?:\.{DOMAIN_LABEL})*'
+          r'|\[[^\[\]\\\s]+\])')
+# Translation table removing the ASCII characters allowed in the dot-atom
+# addresses, used to check many addresses together
+DOT_ATOM_CHARACTERS = dict.fromkeys(map(ord, string.ascii_letters +
+                                        string.digits +
+                                        "!#$%&'*+/=?^_`{|}~-.@\n"))
+# Two at signs in the same line, a line without at signs would otherwise be
+# compensated by another line with two of them
+MANY_AT_SIGNS_PATTERN = re.compile(r'@[^@\n]*@')
+
+
+class _DomainCache(dict):
+    """
+    Normalized domains for the domains already seen
+
+    Each domain is validated and case-folded only the first time, the
+    value is None for the invalid domains.
+    """
+    def __missing__(self, domain: str) -> Optional[str]:
+        if RecipientParser.DOMAIN_PATTERN.fullmatch(domain):
+            folded = domain.casefold()
+        else:
+            folded = None
+        self[domain] = folded
+        return folded
+
+
+class RecipientParser(object):
+    LOCAL_PART_PATTERN = re.compile(LOCAL_PART)
+    DOMAIN_PATTERN = re.compile(DOMAIN)
+    ADDRESS_PATTERN = re.compile(rf'{LOCAL_PART}@{DOMAIN}')
+    # Display name followed by an address with a quoted local part
+    QUOTED_LOCAL_PATTERN = re.compile(rf'(?:(.*?)\s+)?({LOCAL_PART}@\S+)',
+                                      re.DOTALL)
+    QUOTED_PAIR_PATTERN = re.compile(r'\\(.)')
+    # Number of recipients to parse together when they're read lazily
+    BATCH_SIZE = 65536
+
+    def __init__(self):
+        """
+        Parse, validate and deduplicate many recipients addresses
+
+        The domains are case-folded while the local parts are kept as they
+        are, an address is accepted only once for all the lists parsed by
+        the same object, so the parser can be used to deduplicate the
+        addresses across the To, Cc and Bcc fields.
+        """
+        # Normalized addresses already accepted
+        self.addresses = set()
+        # Invalid items found while parsing
+        self.invalid = []
+        # Number of duplicated items skipped
+        self.duplicates = 0
+        self._domains = _DomainCache()
+
+    @staticmethod
+    def split(item: str) -> tuple[Optional[str], str]:
+        """
+        Split a recipient in its display name and address
+
+        Accepts "address", "<address>", "Name <address>",
+        "\"Quoted name\" <address>", "address (Name)" and the legacy
+        "Name address" forms.
+
+        :param item: recipient string to split
+        :return: tuple with the display name or None and the address
+        """
+        item = item.strip()
+        if item.endswith('>'):
+            name, _, address = item[:-1].rpartition('<')
+            name = name.strip()
+            if len(name) > 1 and name[0] == name[-1] == '"':
+                name = name[1:-1]
+                if '\\' in name:
+                    name = RecipientParser.QUOTED_PAIR_PATTERN.sub(r'\1',
+                                                                   name)
+        elif item.endswith(')') and '(' in item:
+            address, _, name = item[:-1].partition('(')
+            address = address.rstrip()
+        elif '"' in item:
+            match = RecipientParser.QUOTED_LOCAL_PATTERN.fullmatch(item)
+            name, address = match.groups() if match else (None, item)
+        else:
+            name, _, address = item.rpartition(' ')
+        return (name.strip() or None) if name else None, address.strip()
+
+    @staticmethod
+    def is_valid(address: str) -> bool:
+        """
+        Check if an address is valid
+
+        :param address: address to check, without the display name
+        :return: True if the address is valid
+        """
+        return RecipientParser.ADDRESS_PATTERN.fullmatch(address) is not None
+
+    def normalize(self, address: str) -> Optional[str]:
+        """
+        Normalize an address case-folding its domain
+
+        :param address: address to normalize, without the display name
+        :return: normalized address or None if the address is invalid
+        """
+        local_part, _, domain = address.rpartition('@')
+        folded = self._domains[domain]
+        if folded is None or not self.LOCAL_PART_PATTERN.fullmatch(
+                local_part):
+            return None
+        return (address
+                if folded == domain
+                else f'{local_part}@{folded}')
+
+    def parse(self,
+              items: Iterable[str],
+              compact: bool = False
+              ) -> Union[list[Recipient], RecipientList]:
+        """
+        Parse many recipients skipping the invalid and duplicated ones
+
+        When every address uses the common dot-atom syntax the addresses
+        are validated, normalized and deduplicated all together using a few
+        string and dict operations, otherwise each one is normalized and,
+        only if the local parts check fails, validated using the complete
+        RFC 5322 syntax.
+
+        :param items: recipients strings in any form accepted by split
+        :param compact: return a RecipientList object instead of a list
+        :return: Recipients list for the new valid addresses, in the same
+                 order
+        """
+        if not isinstance(items, (list, tuple)):
+            if compact:
+                # Read the items in batches, without keeping all of them
+                recipients = RecipientList()
+                items = iter(items)
+                while batch := list(itertools.islice(items,
+                                                     self.BATCH_SIZE)):
+                    recipients.extend(self.parse(items=batch,
+                                                 compact=True))
+                return recipients
+            items = list(items)
+        if not items:
+            return RecipientList() if compact else []
+        result = self._parse_plain(items=items)
+        if result is None:
+            result = self._parse(items=items,
+                                 strict=False)
+            if result[0] and not self._check_local_parts(
+                    text='\n'.join(result[0]),
+                    count=len(result[0])):
+                result = self._parse(items=items,
+                                     strict=True)
+        names, invalid, duplicates = result
+        # Skip the addresses accepted by the previous calls
+        for address in self.addresses.intersection(names):
+            del names[address]
+            duplicates += 1
+        self.addresses.update(names)
+        self.invalid.extend(invalid)
+        self.duplicates += duplicates
+        if compact:
+            recipients = RecipientList()
+            recipients.add_many(addresses=names,
+                                names=names.values())
+            return recipients
+        return list(map(Recipient, names.values(), names))
+
+    def iter_parse(self, items: Iterable[str]) -> Iterator[Recipient]:
+        """
+        Parse many recipients lazily, skipping the invalid and duplicated ones
+
+        The items are consumed in batches of BATCH_SIZE, so only a batch at
+        a time is kept in memory, apart from the accepted addresses used to
+        skip the duplicated ones.
+
+        :param items: recipients strings in any form accepted by split
+        :return: iterator of Recipient objects for the new valid addresses
+        """
+        items = iter(items)
+        while batch := list(itertools.islice(items, self.BATCH_SIZE)):
+            yield from self.parse(items=batch)
+
+    @staticmethod
+    def read_file(filename: str) -> Iterator[str]:
+        """
+        Read the recipients from a text file, one for each line
+
+        :param filename: text filename to read or - to read from stdin
+        :return: iterator of recipients strings, one for each non-empty line
+        """
+        if filename == '-':
+            yield from filter(None, map(str.strip, sys.stdin))
+            return
+        with open(filename, 'r') as file:
+            yield from filter(None, map(str.strip, file))
+
+    def _parse_plain(self, items: Sequence[str]) -> Optional[
+            tuple[dict[str, Optional[str]], list[str], int]]:
+        """
+        Validate and deduplicate the recipients without checking each one
+
+        :param items: recipients strings in any form accepted by split
+        :return: tuple with the dictionary of the addresses and their names,
+                 the invalid items and the number of duplicates or None if
+                 the addresses need to be checked one by one
+        """
+        text = '\n'.join(items)
+        if ' ' in text or '<' in text:
+            # Split the display names, keeping the items order
+            names = [None] * len(items)
+            addresses = list(items)
+            split = self.split
+            for index, item in enumerate(items):
+                if ' ' in item or '<' in item:
+                    names[index], addresses[index] = split(item)
+            text = '\n'.join(addresses)
+        else:
+            names = None
+            addresses = items
+        if not self._check_local_parts(text=text,
+                                       count=len(addresses)):
+            return None
+        # Each address has a single at sign, so the local parts and the
+        # domains alternate and each distinct domain is validated only once
+        parts = text.replace('\n', '@').split('@')
+        domains = parts[1::2]
+        folded_domains = self._domains
+        unfolded = False
+        for domain in set(domains):
+            folded = folded_domains[domain]
+            if folded is None:
+                return None
+            unfolded = unfolded or folded != domain
+        if unfolded:
+            # Replace only the addresses with a changed domain
+            folded = list(map(folded_domains.__getitem__, domains))
+            addresses = list(addresses)
+            for index in itertools.compress(range(len(domains)),
+                                            map(operator.ne,
+                                                folded,
+                                                domains)):
+                addresses[index] = f'{parts[index * 2]}@{folded[index]}'
+        if names is None:
+            result = dict.fromkeys(addresses)
+        else:
+            # Keep the first name for each address
+            result = {}
+            collections.deque(map(result.setdefault, addresses, names),
+                              maxlen=0)
+        return result, [], len(addresses) - len(result)
+
+    def _parse(self,
+               items: Sequence[str],
+               strict: bool) -> tuple[dict[str, Optional[str]],
+                                      list[str],
+                                      int]:
+        """
+        Split, normalize and deduplicate the recipients one by one
+
+        :param items: recipients strings in any form accepted by split
+        :param strict: validate each local part
+        :return: tuple with the dictionary of the addresses and their names,
+                 the invalid items and the number of duplicates
+        """
+        # The dict keeps the order of the addresses and the first name for
+        # each address, checking the duplicates only once
+        names = {}
+        invalid = []
+        add_address = names.setdefault
+        domains = self._domains
+        split = self.split
+        match_local_part = self.LOCAL_PART_PATTERN.fullmatch
+        for item in items:
+            if ' ' in item or '<' in item:
+                name, address = split(item)
+            else:
+                # Most of the items are plain addresses
+                name = None
+                address = item
+            at = address.rfind('@')
+            domain = address[at + 1:]
+            folded = domains[domain]
+            if (folded is None or at < 1 or
+                    (strict and not match_local_part(address[:at]))):
+                invalid.append(item)
+                continue
+            if folded != domain:
+                address = address[:at + 1] + folded
+            add_address(address, name)
+        return names, invalid, len(items) - len(invalid) - len(names)
+
+    @staticmethod
+    def _check_local_parts(text: str,
+                           count: int) -> bool:
+        """
+        Check the local parts for many addresses all together
+
+        Only the ASCII dot-atom local parts are accepted, the addresses
+        using any other syntax need to be checked one by one.
+
+        :param text: addresses to check, one for each line
+        :param count: number of addresses
+        :return: True if every line has a single at sign and a valid local
+                 part
+        """
+        return (text.isascii() and
+                not text.translate(DOT_ATOM_CHARACTERS) and
+                text.count('\n') == count - 1 and
+                text.count('@') == count and
+                not MANY_AT_SIGNS_PATTERN.search(text) and
+                text[0] not in '.@' and
+                '\n.' not in text and
+                '\n@' not in text and
+                '..' not in text and
+                '.@' not in text)
+
+    def parse_fields(self,
+                     to: Iterable[str] = (),
+                     cc: Iterable[str] = (),
+                     bcc: Iterable[str] = (),
+                     compact: bool = False) -> tuple[
+            Union[list[Recipient], RecipientList], ...]:
+        """
+        Parse the recipients for the To, Cc and Bcc fields
+
+        An address found in many fields is kept only in the first one.
+
+        :param to: recipients strings for the To field
+        :param cc: recipients strings for the Cc field
+        :param bcc: recipients strings for the Bcc field
+        :param compact: return RecipientList objects instead of lists
+        :return: tuple with the Recipients lists for the three fields
+        """
+        return (self.parse(items=to or (),
+                           compact=compact),
+                self.parse(items=cc or (),
+                           compact=compact),
+                self.parse(items=bcc or (),
+                           compact=compact))
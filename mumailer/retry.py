@@ -0,0 +1,292 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import concurrent.futures
+import dataclasses
+import heapq
+import itertools
+import random
+import smtplib
+import threading
+import time
+from typing import Any, Callable, Iterable, Optional, Union
+
+from .connection_pool import ConnectionPool
+from .message import FrozenMessage, Message
+from .send_result import SendResult, is_transient_code, is_transient_error
+
+
+@dataclasses.dataclass
+class RetryPolicy(object):
+    max_attempts: int = 5
+    initial_delay: float = 1.0
+    max_delay: float = 300.0
+    multiplier: float = 2.0
+    jitter: float = 0.5
+
+    def get_delay(self, attempt: int) -> float:
+        """
+        Get the seconds to wait after a failed attempt
+
+        The delay grows exponentially and a random part of it (the jitter
+        fraction) is removed, to spread the retries of many messages.
+
+        :param attempt: number of the failed attempt, starting from 1
+        :return: seconds to wait before the next attempt
+        """
+        delay = min(self.max_delay,
+                    self.initial_delay * self.multiplier ** (attempt - 1))
+        return delay - random.uniform(0, delay * self.jitter)
+
+    def call(self,
+             function: Callable[..., Any],
+             *args,
+             **kwargs) -> Any:
+        """
+        Call a function retrying it after the temporary errors
+
+        Useful to establish a connection, like
+        `policy.call(connection.connect)`
+
+        :param function: function to call
+        :param args: positional arguments for the function
+        :param kwargs: keyword arguments for the function
+        :return: value returned by the function
+        """
+        for attempt in itertools.count(1):
+            try:
+                return function(*args, **kwargs)
+            except (smtplib.SMTPException, OSError) as error:
+                if (attempt >= self.max_attempts or
+                        not is_transient_error(error)):
+                    raise
+            time.sleep(self.get_delay(attempt=attempt))
+
+
+@dataclasses.dataclass
+class RetryTask(object):
+    result: SendResult
+    future: concurrent.futures.Future
+    recipients: list[str]
+    attempts: int = 0
+    error: Optional[Exception] = None
+    # Last temporary reply for each recipient to send again
+    deferred: dict[str, tuple[int, bytes]] = dataclasses.field(
+        default_factory=lambda: {})
+
+
+class RetrySender(object):
+    """
+    Send messages retrying the temporary failures with exponential backoff
+
+    The messages waiting for their next attempt are kept in a schedule, so
+    the worker threads continue sending the other messages in the meantime.
+    When only some recipients are temporarily refused, only those recipients
+    are sent again.
+    """
+    def __init__(self,
+                 pool: ConnectionPool,
+                 policy: Optional[RetryPolicy] = None,
+                 workers: int = 1,
+                 timeout: Optional[float] = None):
+        self.pool = pool
+        self.policy = policy or RetryPolicy()
+        self.workers = workers
+        self.timeout = timeout
+        # Statistics
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        # Scheduled tasks as (due time, sequence, task) tuples
+        self._schedule = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._threads = [threading.Thread(target=self._run,
+                                          daemon=True)
+                         for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self) -> 'RetrySender':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def submit(self,
+               message: Union[Message, FrozenMessage]
+               ) -> concurrent.futures.Future:
+        """
+        Schedule a message to be sent as soon as possible
+
+        :param message: Message or FrozenMessage object to send
+        :return: Future object for the final SendResult object
+        """
+        task = RetryTask(result=SendResult(message=message),
+                         future=concurrent.futures.Future(),
+                         recipients=message._get_envelope_recipients())
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('The sender is closed')
+            self._schedule_task(task=task,
+                                due_time=time.monotonic())
+        return task.future
+
+    def send(self,
+             messages: Iterable[Union[Message, FrozenMessage]]
+             ) -> list[SendResult]:
+        """
+        Send many messages waiting for their final results
+
+        :param messages: Message or FrozenMessage objects to send
+        :return: list of SendResult objects, one for each message
+        """
+        futures = [self.submit(message) for message in messages]
+        return [future.result() for future in futures]
+
+    def _schedule_task(self,
+                       task: RetryTask,
+                       due_time: float) -> None:
+        """
+        Add a task to the schedule, the condition lock must be held
+
+        :param task: RetryTask object to schedule
+        :param due_time: monotonic time for the next attempt
+        """
+        heapq.heappush(self._schedule,
+                       (due_time, next(self._sequence), task))
+        self._condition.notify()
+
+    def _get_task(self) -> Optional[RetryTask]:
+        """
+        Wait for the next task to be due
+
+        :return: RetryTask object or None when the sender is closed
+        """
+        with self._condition:
+            while True:
+                if self._schedule:
+                    delay = self._schedule[0][0] - time.monotonic()
+                    if delay <= 0:
+                        return heapq.heappop(self._schedule)[2]
+                elif self._closed:
+                    return None
+                else:
+                    delay = None
+                self._condition.wait(delay)
+
+    def _run(self) -> None:
+        """
+        Send the scheduled tasks until the sender is closed
+        """
+        while (task := self._get_task()) is not None:
+            self._attempt(task=task)
+
+    def _attempt(self,
+                 task: RetryTask) -> None:
+        """
+        Send a message to its remaining recipients and schedule it again
+        after a temporary failure
+
+        :param task: RetryTask object to send
+        """
+        task.attempts += 1
+        task.error = None
+        task.deferred = {}
+        try:
+            refused = self.pool.send(message=task.result.message,
+                                     timeout=self.timeout,
+                                     recipients=task.recipients)
+        except smtplib.SMTPRecipientsRefused as error:
+            refused = error.recipients
+        except Exception as error:
+            # The errors other than the temporary ones complete the task,
+            # like a closed pool
+            refused = None
+            task.error = error
+        if refused is not None:
+            for recipient in task.recipients:
+                if recipient not in refused:
+                    task.result.accepted.append(recipient)
+                elif is_transient_code(refused[recipient][0]):
+                    task.deferred[recipient] = refused[recipient]
+                else:
+                    task.result.refused[recipient] = refused[recipient]
+            retry = list(task.deferred)
+        else:
+            retry = (task.recipients
+                     if is_transient_error(task.error)
+                     else [])
+        if retry and task.attempts < self.policy.max_attempts:
+            task.recipients = retry
+            with self._condition:
+                self.retried += 1
+                self._schedule_task(
+                    task=task,
+                    due_time=(time.monotonic() +
+                              self.policy.get_delay(attempt=task.attempts)))
+            return
+        self._complete(task=task)
+
+    def _complete(self,
+                  task: RetryTask) -> None:
+        """
+        Set the final result for a task
+
+        :param task: RetryTask object to complete
+        """
+        task.result.refused.update(task.deferred)
+        task.result.error = task.error
+        if (task.error is None and not task.result.accepted and
+                task.result.refused):
+            task.result.error = smtplib.SMTPRecipientsRefused(
+                task.result.refused)
+        with self._condition:
+            if task.result.success:
+                self.sent += 1
+            else:
+                self.failed += 1
+        task.future.set_result(task.result)
+
+    def close(self,
+              wait: bool = True) -> None:
+        """
+        Stop the worker threads
+
+        :param wait: wait for the scheduled retries to complete, otherwise
+                     the scheduled messages are completed with their last
+                     error
+        """
+        with self._condition:
+            self._closed = True
+            if not wait:
+                tasks = [task for _, _, task in self._schedule]
+                self._schedule.clear()
+            else:
+                tasks = []
+            self._condition.notify_all()
+        for task in tasks:
+            if task.attempts:
+                self._complete(task=task)
+            else:
+                task.future.cancel()
+        for thread in self._threads:
+            thread.join()
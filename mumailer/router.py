@@ -0,0 +1,226 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import concurrent.futures
+import fnmatch
+import smtplib
+import threading
+from typing import TYPE_CHECKING, Optional, Union
+
+from .connection_pool import ConnectionPool
+from .message import FrozenMessage, Message
+from .rate_limiter import RateLimitExceeded
+from .send_result import SendResult
+
+if TYPE_CHECKING:
+    # Avoid loading the YAML module until a profile is used
+    from .profile_router import ProfileRouter
+
+
+class Router(object):
+    def __init__(self,
+                 default: Optional[str] = None,
+                 max_workers: Optional[int] = None):
+        """
+        Route the recipients to different SMTP servers using their domain
+
+        :param default: name of the route for the unmatched domains or None
+                        to refuse them
+        :param max_workers: maximum number of routes to send in parallel or
+                            None to use a thread for each route
+        """
+        self.default = default
+        self.max_workers = max_workers
+        self.pools = {}
+        self._patterns = []
+        self._domains = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def from_profile(profile: 'ProfileRouter',
+                     **kwargs) -> 'Router':
+        """
+        Create a Router object using the routes from a ProfileRouter
+
+        :param profile: ProfileRouter object with the routes
+        :param kwargs: additional arguments for the ConnectionPool objects
+        :return: Router object
+        """
+        router = Router(default=profile.default)
+        for name, domains, profile_smtp in profile.routes:
+            router.add_route(name=name,
+                             domains=domains,
+                             pool=ConnectionPool.from_profile(
+                                 profile=profile_smtp,
+                                 **kwargs))
+        return router
+
+    def __enter__(self) -> 'Router':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def add_route(self,
+                  name: str,
+                  domains: list[str],
+                  pool: ConnectionPool) -> None:
+        """
+        Add a new route
+
+        The domains are checked in the same order the routes were added and
+        they can contain shell-style wildcards like `*.example.com`.
+
+        :param name: route name
+        :param domains: recipients domains to send using this route
+        :param pool: ConnectionPool object used to send the messages
+        """
+        self.pools[name] = pool
+        for domain in domains:
+            self._patterns.append((domain.lower(), name))
+        # Routes changed, clear the previous matches
+        self._domains.clear()
+
+    def get_route(self,
+                  address: str) -> Optional[str]:
+        """
+        Get the route name for a recipient address
+
+        :param address: recipient address
+        :return: route name or None if no route matches the address
+        """
+        domain = address.rpartition('@')[2].lower()
+        try:
+            return self._domains[domain]
+        except KeyError:
+            route = self.default
+            for pattern, name in self._patterns:
+                if fnmatch.fnmatchcase(domain, pattern):
+                    route = name
+                    break
+            self._domains[domain] = route
+            return route
+
+    def split(self,
+              message: Union[Message, FrozenMessage]) -> dict[str, list[str]]:
+        """
+        Split the message envelope recipients by route
+
+        :param message: Message or FrozenMessage object to split
+        :return: dictionary with the recipients addresses for each route
+        """
+        routes = {}
+        for address in message._get_envelope_recipients():
+            route = self.get_route(address=address)
+            if route is None:
+                raise ValueError(f'No route for the recipient {address}')
+            routes.setdefault(route, []).append(address)
+        return routes
+
+    def send(self,
+             message: Union[Message, FrozenMessage],
+             timeout: Optional[float] = None) -> dict[str, SendResult]:
+        """
+        Send a message to every route in parallel
+
+        Each route receives the same message content with only its own
+        recipients in the envelope. The errors for a route are reported in
+        its result, without losing the results of the other routes.
+
+        :param message: Message or FrozenMessage object to send
+        :param timeout: seconds to wait for a free connection or None to wait
+                        forever
+        :return: dictionary with the SendResult object for each route
+        """
+        routes = self.split(message=message)
+        if len(routes) == 1:
+            # A single route doesn't need any other thread
+            ((name, recipients),) = routes.items()
+            return {name: self._send(name=name,
+                                     message=message,
+                                     recipients=recipients,
+                                     timeout=timeout)}
+        executor = self._get_executor()
+        futures = {name: executor.submit(self._send,
+                                         name=name,
+                                         message=message,
+                                         recipients=recipients,
+                                         timeout=timeout)
+                   for name, recipients in routes.items()}
+        return {name: future.result()
+                for name, future in futures.items()}
+
+    def _send(self,
+              name: str,
+              message: Union[Message, FrozenMessage],
+              recipients: list[str],
+              timeout: Optional[float]) -> SendResult:
+        """
+        Send a message to the recipients using a single route
+
+        :param name: route name
+        :param message: Message or FrozenMessage object to send
+        :param recipients: envelope recipients addresses for the route
+        :param timeout: seconds to wait for a free connection or None to wait
+                        forever
+        :return: SendResult object
+        """
+        result = SendResult(message=message)
+        try:
+            result.refused = self.pools[name].send(message=message,
+                                                   timeout=timeout,
+                                                   recipients=recipients)
+        except smtplib.SMTPRecipientsRefused as error:
+            result.refused = error.recipients
+            result.error = error
+        except (smtplib.SMTPException, OSError, RateLimitExceeded,
+                ValueError) as error:
+            # The exceeded rate limit is a temporary error, while addresses
+            # with line breaks are refused before sending them
+            result.error = error
+        else:
+            result.accepted = [recipient for recipient in recipients
+                               if recipient not in result.refused]
+        return result
+
+    def _get_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        """
+        Get the executor used to send the routes in parallel
+
+        :return: ThreadPoolExecutor object
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers or len(self.pools),
+                    thread_name_prefix='mumailer-router')
+            return self._executor
+
+    def close(self) -> None:
+        """
+        Close every route connections pool
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+        for pool in self.pools.values():
+            pool.close()
@@ -0,0 +1,62 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import argparse
+from types import SimpleNamespace
+from typing import Optional, Union
+
+from mumailer import ConnectionPool, ProfileRegistry, ProfileSmtp
+
+
+def load_profile_smtp(options: argparse.Namespace) -> Optional[ProfileSmtp]:
+    """
+    Load the SMTP settings from a profile file or from the registry
+
+    :param options: command-line options
+    :return: ProfileSmtp object or None if no profile was requested
+    """
+    if not options.profile_smtp:
+        return None
+    if options.profile_registry:
+        return ProfileRegistry(
+            path=options.profile_registry).get_smtp(options.profile_smtp)
+    return ProfileSmtp(filename=options.profile_smtp)
+
+
+def create_pool(options: Union[argparse.Namespace, SimpleNamespace],
+                profile: Optional[ProfileSmtp],
+                **kwargs) -> ConnectionPool:
+    """
+    Create a ConnectionPool object using the SMTP settings from the profile,
+    if any, overridden by the command-line options
+
+    :param options: command-line or merged options with the SMTP settings
+    :param profile: ProfileSmtp object or None
+    :param kwargs: additional arguments for the ConnectionPool object
+    :return: ConnectionPool object
+    """
+    for option in ('server', 'port', 'username', 'password',
+                   'encryption', 'ciphers'):
+        if getattr(options, option):
+            kwargs[option] = getattr(options, option)
+    if profile:
+        return ConnectionPool.from_profile(profile=profile,
+                                           **kwargs)
+    return ConnectionPool(**kwargs)
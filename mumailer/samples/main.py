@@ -19,20 +19,30 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 ##
 
+import collections
+import itertools
+import json
+import operator
+import os
+import sys
 from types import SimpleNamespace
-from typing import Union
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional, Union
 
-from mumailer import (Attachment,
-                      CommandLineOptions,
+from mumailer import (CommandLineOptions,
                       Connection,
+                      FileAttachment,
                       Header,
                       Message,
-                      ProfileMessage,
-                      ProfileSmtp,
-                      Recipient)
+                      Recipient,
+                      RecipientParser)
 
+if TYPE_CHECKING:
+    # The optional features are loaded only when used, to keep the
+    # command-line startup fast
+    from mumailer import ProfileMessage, ProfileSmtp
 
-def choose_option(profile: Union[ProfileSmtp, ProfileMessage],
+
+def choose_option(profile: Union['ProfileSmtp', 'ProfileMessage'],
                   cmdline: CommandLineOptions,
                   options: Union[str, tuple[str]]) -> Union[None, str, int]:
     """
@@ -57,8 +67,18 @@ def choose_option(profile: Union[ProfileSmtp, ProfileMessage],
 
 def merge_options(cmdline: CommandLineOptions) -> SimpleNamespace:
     result = {}
+    if cmdline.options.profile_registry:
+        # The profiles are names in the registry
+        from mumailer import ProfileRegistry
+        registry = ProfileRegistry(path=cmdline.options.profile_registry)
+        get_smtp = registry.get_smtp
+        get_message = registry.get_message
+    elif cmdline.options.profile_smtp or cmdline.options.profile_message:
+        from mumailer import ProfileMessage, ProfileSmtp
+        get_smtp = ProfileSmtp
+        get_message = ProfileMessage
     # Get available options from both command line and SMTP profile
-    profile = (ProfileSmtp(filename=cmdline.options.profile_smtp)
+    profile = (get_smtp(cmdline.options.profile_smtp)
                if cmdline.options.profile_smtp
                else None)
     for option in ('server', 'port', 'username', 'password',
@@ -66,11 +86,13 @@ def merge_options(cmdline: CommandLineOptions) -> SimpleNamespace:
         result[option] = choose_option(profile=profile,
                                        cmdline=cmdline,
                                        options=option)
+    result['smtp_profile'] = profile
     # Get available options from both command line and Message profile
-    profile = (ProfileMessage(filename=cmdline.options.profile_message)
+    profile = (get_message(cmdline.options.profile_message)
                if cmdline.options.profile_message
                else None)
     for option in ('sender', 'to', 'cc', 'bcc', 'reply_to',
+                   'to_file', 'cc_file', 'bcc_file',
                    'subject', 'body', 'body_file'):
         result[option] = choose_option(profile=profile,
                                        cmdline=cmdline,
@@ -86,27 +108,128 @@ def merge_options(cmdline: CommandLineOptions) -> SimpleNamespace:
     return SimpleNamespace(**result)
 
 
+def read_recipients(items: list[str],
+                    filename: Optional[str]) -> Iterable[str]:
+    """
+    Get the recipients from both the options and a recipients file
+
+    :param items: recipients strings from the options
+    :param filename: recipients filename, - for stdin or None
+    :return: iterable with the recipients strings
+    """
+    if not filename:
+        return items
+    return itertools.chain(items, RecipientParser.read_file(filename))
+
+
+def send_batch(cmdline: CommandLineOptions,
+               options: SimpleNamespace) -> None:
+    """
+    Send a message for each spec in the batch file, reusing the connections
+
+    :param cmdline: CommandLineOptions object
+    :param options: merged options, used as defaults for the specs
+    """
+    from mumailer import MessageBatch
+    from mumailer.samples.common import create_pool
+    pool = create_pool(options=options,
+                       profile=options.smtp_profile,
+                       size=cmdline.options.connections)
+    batch = MessageBatch(
+        pool=pool,
+        defaults={option: getattr(options, option)
+                  for option in MessageBatch.FIELDS},
+        workers=cmdline.options.connections,
+        batch_size=cmdline.options.batch_size)
+    # Identifiers of the specs being sent, the results are in the same order
+    identifiers = collections.deque()
+
+    def read_specs() -> Iterator[Union[dict, str]]:
+        for spec in MessageBatch.read_jsonl(cmdline.options.batch):
+            identifiers.append(spec.get('id')
+                               if isinstance(spec, dict)
+                               else None)
+            yield spec
+
+    try:
+        for index, result in enumerate(batch.send(read_specs())):
+            print(json.dumps({
+                'index': index,
+                'id': identifiers.popleft(),
+                'status': 'sent' if result.success else 'failed',
+                'accepted': len(result.accepted),
+                'refused': {recipient: [code, reply.decode('utf-8',
+                                                           'replace')]
+                            for recipient, (code, reply)
+                            in result.refused.items()},
+                'error': str(result.error) if result.error else None}),
+                flush=True)
+    finally:
+        pool.close()
+        print(f'sent: {batch.sent} failed: {batch.failed} '
+              f'rate: {batch.get_rate():.1f} msg/s',
+              file=sys.stderr)
+    if batch.failed:
+        sys.exit(1)
+
+
 def main():
+    if sys.argv[1:2] == ['queue']:
+        # Manage the outbox queue
+        from mumailer.samples.outbox import main as main_queue
+        main_queue(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ['serve']:
+        # Accept the messages from the local clients
+        from mumailer.samples.serve import main as main_serve
+        main_serve(sys.argv[2:])
+        return
     # Get command-line options
     command_line = CommandLineOptions()
     command_line.add_smtp_arguments()
     command_line.add_encryption_arguments()
     command_line.add_recipients_arguments()
     command_line.add_message_arguments()
+    command_line.add_outbox_arguments()
+    command_line.add_batch_arguments()
     command_line.parse_options()
     options = merge_options(cmdline=command_line)
+    if command_line.options.batch:
+        # Send many messages using the same connections
+        send_batch(cmdline=command_line,
+                   options=options)
+        return
     # Get message body from body_file or body options
     if options.body_file:
         with open(options.body_file, 'r') as file:
             body = file.read()
     else:
         body = options.body
+    # The BCC recipients file is read while sending the message, unless
+    # the message is stored or routed
+    stream_bcc = bool(options.bcc_file and
+                      not command_line.options.outbox and
+                      not command_line.options.profile_router)
+    # Validate the recipients, sending a single copy to each address
+    recipients = RecipientParser()
+    to, cc, bcc = recipients.parse_fields(
+        to=read_recipients(items=options.to,
+                           filename=options.to_file),
+        cc=read_recipients(items=options.cc,
+                           filename=options.cc_file),
+        bcc=read_recipients(items=options.bcc,
+                            filename=(None
+                                      if stream_bcc
+                                      else options.bcc_file)),
+        compact=bool(options.to_file or options.cc_file or options.bcc_file))
+    if recipients.invalid:
+        sys.exit(f'Invalid recipients: {", ".join(recipients.invalid)}')
     message = Message(
         sender=Recipient.parse(options.sender),
         reply_to=Recipient.parse(options.reply_to),
-        to=Recipient.parse_as_list(options.to),
-        cc=Recipient.parse_as_list(options.cc),
-        bcc=Recipient.parse_as_list(options.bcc),
+        to=to,
+        cc=cc,
+        bcc=bcc,
         subject=options.subject,
         body=body,
         use_html=options.use_html,
@@ -114,12 +237,32 @@ def main():
     )
     # Add attachments
     for index, attachment_file in enumerate(options.attachments):
-        content_type = (options.content_type[0]
-                        if len(options.content_types) == 1
-                        else options.content_types[index])
-        message.add_attachment(Attachment.load_filename(
-            filename=attachment_file,
+        if not options.content_types:
+            content_type = 'application/octet-stream'
+        elif len(options.content_types) == 1:
+            content_type = options.content_types[0]
+        else:
+            content_type = options.content_types[index]
+        message.add_attachment(FileAttachment(
+            path=os.path.abspath(attachment_file),
             content_type=content_type))
+    if command_line.options.outbox:
+        # Add the message to the outbox instead of sending it
+        from mumailer import Outbox
+        outbox = Outbox(filename=command_line.options.outbox)
+        outbox.enqueue(message)
+        outbox.close()
+        return
+    if command_line.options.profile_router:
+        # Send the message to each route for the recipients domains
+        from mumailer import ProfileRouter, Router
+        with Router.from_profile(profile=ProfileRouter(
+                filename=command_line.options.profile_router),
+                size=1) as router:
+            for name, result in router.send(message).items():
+                if result.error:
+                    print(f'Route {name}: {result.error}', file=sys.stderr)
+        return
     mailer = Connection(server=options.server,
                         port=options.port,
                         username=options.username,
@@ -127,6 +270,19 @@ def main():
     mailer.set_encryption(encryption=options.encryption,
                           ciphers=options.ciphers)
     mailer.connect()
+    if stream_bcc:
+        # Validate and send the BCC recipients in batches while reading them
+        addresses = map(operator.attrgetter('address'),
+                        itertools.chain(to, cc, bcc, recipients.iter_parse(
+                            RecipientParser.read_file(options.bcc_file))))
+        result = mailer.send_chunked(message=message,
+                                     recipients=addresses)
+        mailer.disconnect()
+        if result.error is not None and not result.accepted:
+            raise result.error
+        if recipients.invalid:
+            sys.exit(f'Invalid recipients: {", ".join(recipients.invalid)}')
+        return
     mailer.send(message)
     mailer.disconnect()
 
@@ -0,0 +1,71 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+from mumailer import CommandLineOptions, Outbox, OutboxWorker
+from mumailer.samples.common import create_pool, load_profile_smtp
+
+
+def main(arguments: list[str] = None):
+    # Get command-line options
+    command_line = CommandLineOptions()
+    command_line.parser.prog = f'{command_line.parser.prog} queue'
+    command_line.add_queue_arguments()
+    command_line.add_smtp_arguments()
+    command_line.add_encryption_arguments()
+    options = command_line.parser.parse_args(arguments)
+    outbox = Outbox(filename=options.outbox)
+    outbox.policy.max_attempts = options.max_attempts
+    if options.action == 'stats':
+        for status, count in sorted(outbox.get_counts().items()):
+            print(f'{status}: {count}')
+    elif options.action == 'recover':
+        print(f'recovered: {outbox.recover()}')
+    elif options.action == 'purge':
+        print(f'purged: {outbox.purge()}')
+    elif options.action == 'run':
+        if not options.profile_smtp and not options.server:
+            command_line.parser.error('Missing profile-smtp or server '
+                                      'options')
+        pool = create_pool(options=options,
+                           profile=load_profile_smtp(options),
+                           size=options.connections)
+        worker = OutboxWorker(outbox=outbox,
+                              pool=pool,
+                              workers=options.workers,
+                              batch_size=options.batch_size)
+        worker.start(until_empty=options.until_empty)
+        try:
+            while not worker.wait(timeout=10):
+                print(f'sent: {worker.sent} failed: {worker.failed} '
+                      f'retried: {worker.retried} '
+                      f'rate: {worker.get_rate():.1f} msg/s')
+        except KeyboardInterrupt:
+            pass
+        finally:
+            worker.stop()
+            pool.close()
+        print(f'sent: {worker.sent} failed: {worker.failed} '
+              f'retried: {worker.retried} '
+              f'rate: {worker.get_rate():.1f} msg/s')
+    outbox.close()
+
+
+if __name__ == '__main__':
+    main()
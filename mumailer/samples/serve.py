@@ -0,0 +1,62 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import signal
+
+from mumailer import CommandLineOptions, SubmissionServer
+from mumailer.samples.common import create_pool, load_profile_smtp
+
+
+def main(arguments: list[str] = None):
+    # Get command-line options
+    command_line = CommandLineOptions()
+    command_line.parser.prog = f'{command_line.parser.prog} serve'
+    command_line.add_serve_arguments()
+    command_line.add_smtp_arguments()
+    command_line.add_encryption_arguments()
+    options = command_line.parser.parse_args(arguments)
+    if not options.profile_smtp and not options.server:
+        command_line.parser.error('Missing profile-smtp or server options')
+    pool = create_pool(options=options,
+                       profile=load_profile_smtp(options),
+                       size=options.connections)
+    server = SubmissionServer(pool=pool,
+                              path=options.socket,
+                              workers=options.connections,
+                              batch_size=options.batch_size)
+    # Stop gracefully on SIGTERM too, sending the queued messages
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    server.start()
+    try:
+        while not server.wait(timeout=10):
+            print(f'sent: {server.sent} failed: {server.failed} '
+                  f'queued: {server.get_queued()} '
+                  f'rate: {server.get_rate():.1f} msg/s')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        pool.close()
+    print(f'sent: {server.sent} failed: {server.failed} '
+          f'rate: {server.get_rate():.1f} msg/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import dataclasses
+import smtplib
+from typing import Optional, Union
+
+from .message import FrozenMessage, Message
+from .rate_limiter import RateLimitExceeded
+
+
+def is_transient_code(code: int) -> bool:
+    """
+    Check if an SMTP reply code is a temporary failure
+
+    :param code: SMTP reply code, -1 for the recipients not sent because of
+                 a connection error
+    :return: True for the 4xx reply codes and for the connection errors
+    """
+    return code == -1 or 400 <= code < 500
+
+
+def is_transient_error(error: Optional[BaseException]) -> bool:
+    """
+    Check if an error is temporary, so the operation can be tried again
+
+    Disconnections, timeouts, network errors, exceeded rate limits and 4xx
+    replies are temporary, while 5xx replies and any other error are
+    permanent.
+
+    :param error: exception raised while connecting or sending
+    :return: True if the operation can be tried again
+    """
+    if isinstance(error, (smtplib.SMTPServerDisconnected,
+                          RateLimitExceeded)):
+        return True
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return any(is_transient_code(code)
+                   for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return is_transient_code(error.smtp_code)
+    # SMTP errors are OSError subclasses too
+    return (isinstance(error, OSError) and
+            not isinstance(error, smtplib.SMTPException))
+
+
+@dataclasses.dataclass
+class SendResult(object):
+    # The message is None when it could not be built
+    message: Optional[Union[Message, FrozenMessage]]
+    accepted: list[str] = dataclasses.field(default_factory=lambda: [])
+    refused: dict[str, tuple[int, bytes]] = dataclasses.field(
+        default_factory=lambda: {})
+    error: Optional[Exception] = None
+
+    @property
+    def success(self) -> bool:
+        """
+        Check if the message was accepted for at least a recipient
+
+        :return: True if the message was sent
+        """
+        return self.error is None and bool(self.accepted)
+
+    @property
+    def disconnected(self) -> bool:
+        """
+        Check if the error was caused by the connection, so the message can
+        be sent again
+
+        :return: True if the message can be sent again
+        """
+        # SMTP errors are OSError subclasses too
+        return (isinstance(self.error, smtplib.SMTPServerDisconnected) or
+                (isinstance(self.error, OSError) and
+                 not isinstance(self.error, smtplib.SMTPException)))
+
+    @property
+    def transient(self) -> bool:
+        """
+        Check if the message was not sent because of a temporary error, so
+        it can be sent again later
+
+        :return: True for the disconnections, the network errors, the
+                 exceeded rate limits and the 4xx replies
+        """
+        return not self.success and is_transient_error(self.error)
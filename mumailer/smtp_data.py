@@ -0,0 +1,82 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import re
+import smtplib
+
+
+QUOTE_PERIODS_REGEX = re.compile(rb'(?m)^\.')
+
+
+def quote_periods(data: bytes) -> bytes:
+    """
+    Double the period at the beginning of each line
+
+    :param data: message content starting at the beginning of a line
+    :return: quoted message content
+    """
+    return QUOTE_PERIODS_REGEX.sub(b'..', data)
+
+
+def quote_data(data: bytes) -> bytes:
+    """
+    Prepare the message content to be sent after the DATA command
+
+    Every line starting with a period is doubled, the content is terminated
+    by CRLF and followed by the end of data marker.
+
+    :param data: message content with lines terminated by CRLF
+    :return: message content ready to be sent
+    """
+    data = quote_periods(data)
+    if data and not data.endswith(b'\r\n'):
+        data += b'\r\n'
+    return data + b'.\r\n'
+
+
+def quote_address(address: str) -> str:
+    """
+    Quote an envelope address for the MAIL and RCPT commands, like smtplib
+
+    An address containing line breaks raises ValueError, as it would inject
+    other commands in the session.
+
+    :param address: envelope address
+    :return: address enclosed in angle brackets
+    """
+    if '\r' in address or '\n' in address:
+        raise ValueError(f'Invalid envelope address {address!r}, line '
+                         'breaks are not allowed')
+    return smtplib.quoteaddr(address)
+
+
+def quote_envelope(sender: str,
+                   recipients: list[str]) -> tuple[str, list[str]]:
+    """
+    Quote the envelope sender and recipients for the MAIL and RCPT commands
+
+    Any address containing line breaks raises ValueError.
+
+    :param sender: envelope sender address
+    :param recipients: envelope recipients addresses
+    :return: tuple with the quoted sender and the quoted recipients
+    """
+    return (quote_address(sender),
+            [quote_address(recipient) for recipient in recipients])
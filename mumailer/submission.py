@@ -0,0 +1,529 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import concurrent.futures
+import contextlib
+import json
+import os
+import pathlib
+import queue
+import smtplib
+import socket
+import socketserver
+import stat
+import struct
+import threading
+import time
+from typing import TYPE_CHECKING, Any, BinaryIO, Optional, Union
+
+from .message import FrozenMessage, Message, RawMessage
+from .rate_limiter import RateLimitExceeded
+from .send_result import SendResult
+
+if TYPE_CHECKING:
+    # The clients don't need the connections modules
+    from .connection_pool import ConnectionPool
+
+# Each frame is prefixed by its length as a 4 bytes unsigned integer
+FRAME_HEADER = struct.Struct('!I')
+# Errors sent to the clients, any other error is sent using the nearest
+# parent class
+ERRORS = {error.__name__: error
+          for error in (smtplib.SMTPException,
+                        smtplib.SMTPServerDisconnected,
+                        smtplib.SMTPResponseException,
+                        smtplib.SMTPSenderRefused,
+                        smtplib.SMTPRecipientsRefused,
+                        smtplib.SMTPDataError,
+                        smtplib.SMTPConnectError,
+                        smtplib.SMTPHeloError,
+                        smtplib.SMTPAuthenticationError,
+                        smtplib.SMTPNotSupportedError,
+                        RateLimitExceeded,
+                        OSError,
+                        ConnectionError,
+                        ConnectionRefusedError,
+                        ConnectionResetError,
+                        BrokenPipeError,
+                        TimeoutError,
+                        RuntimeError,
+                        TypeError,
+                        ValueError,
+                        Exception)}
+
+
+def _read_frame(file: BinaryIO) -> Optional[bytes]:
+    """
+    Read a length-prefixed frame
+
+    :param file: binary file to read
+    :return: frame data or None when the connection was closed
+    """
+    header = file.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        return None
+    size, = FRAME_HEADER.unpack(header)
+    data = file.read(size)
+    return data if len(data) == size else None
+
+
+def _pack_frame(data: bytes) -> bytes:
+    """
+    Prefix the data with its length
+
+    :param data: frame data
+    :return: frame header and data
+    """
+    return FRAME_HEADER.pack(len(data)) + data
+
+
+def _pack_json(value: Any) -> bytes:
+    """
+    Serialize a value as JSON in a frame
+
+    :param value: value to serialize
+    :return: frame header and data
+    """
+    return _pack_frame(json.dumps(value).encode('utf-8'))
+
+
+def _decode_reply(reply: Union[bytes, str]) -> str:
+    """
+    Convert a reply from the server to be serialized as JSON, keeping the
+    bytes which are not valid UTF-8
+
+    :param reply: reply text as bytes
+    :return: reply text
+    """
+    return (reply.decode('utf-8', 'surrogateescape')
+            if isinstance(reply, bytes)
+            else reply)
+
+
+def _encode_refused(refused: dict[str, tuple[int, bytes]]
+                    ) -> dict[str, tuple[int, str]]:
+    """
+    Convert the refused recipients replies to be serialized as JSON
+
+    :param refused: dictionary with the refused recipients
+    :return: dictionary with the replies as text
+    """
+    return {recipient: (code, _decode_reply(reply))
+            for recipient, (code, reply) in refused.items()}
+
+
+def _decode_refused(refused: dict[str, list]
+                    ) -> dict[str, tuple[int, bytes]]:
+    """
+    Convert the refused recipients replies deserialized from JSON
+
+    :param refused: dictionary with the replies as text
+    :return: dictionary with the refused recipients, like smtplib
+    """
+    return {recipient: (code, reply.encode('utf-8', 'surrogateescape'))
+            for recipient, (code, reply) in refused.items()}
+
+
+def _encode_error(error: Optional[Exception]) -> Optional[dict[str, Any]]:
+    """
+    Convert an error to be serialized as JSON
+
+    :param error: exception to convert or None
+    :return: dictionary with the error class name and arguments or None
+    """
+    if error is None:
+        return None
+    name = next((parent.__name__
+                 for parent in type(error).__mro__
+                 if ERRORS.get(parent.__name__) is parent),
+                Exception.__name__)
+    data = {'type': name,
+            'message': (str(error)
+                        if name == type(error).__name__
+                        else f'{type(error).__name__}: {error}')}
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        data['recipients'] = _encode_refused(error.recipients)
+    elif isinstance(error, smtplib.SMTPResponseException):
+        data['code'] = error.smtp_code
+        data['reply'] = _decode_reply(error.smtp_error)
+        if isinstance(error, smtplib.SMTPSenderRefused):
+            data['sender'] = error.sender
+    return data
+
+
+def _decode_error(data: Optional[dict[str, Any]]) -> Optional[Exception]:
+    """
+    Create the error deserialized from JSON
+
+    :param data: dictionary with the error class name and arguments or None
+    :return: exception object or None
+    """
+    if data is None:
+        return None
+    error_class = ERRORS.get(data['type'], Exception)
+    if issubclass(error_class, smtplib.SMTPRecipientsRefused):
+        return error_class(_decode_refused(data['recipients']))
+    if issubclass(error_class, smtplib.SMTPResponseException):
+        reply = data['reply'].encode('utf-8', 'surrogateescape')
+        if issubclass(error_class, smtplib.SMTPSenderRefused):
+            return error_class(data['code'], reply, data['sender'])
+        return error_class(data['code'], reply)
+    return error_class(data['message'])
+
+
+class SubmissionServer(object):
+    """
+    Accept the messages from the local clients using a Unix domain socket
+    and send them using the warm connections from a ConnectionPool
+
+    The messages are exchanged as JSON envelopes followed by their
+    serialized content, so a client can't run any code in the server, while
+    the socket is created accessible only by the user running the server.
+    """
+    def __init__(self,
+                 pool: 'ConnectionPool',
+                 path: str,
+                 workers: int = 1,
+                 batch_size: int = 100):
+        """
+        Accept the messages from the local clients using a Unix domain
+        socket and send them using the connections from a ConnectionPool
+
+        The queued messages are sent in batches of up to `batch_size`
+        messages, each batch using a single connection, with `workers`
+        batches in parallel.
+
+        :param pool: ConnectionPool object with the SMTP settings
+        :param path: Unix domain socket path
+        :param workers: number of sending threads
+        :param batch_size: maximum number of messages for each batch
+        """
+        self.pool = pool
+        self.path = path
+        self.workers = workers
+        self.batch_size = batch_size
+        self.sent = 0
+        self.failed = 0
+        self.started_time = None
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._server = None
+        self._threads = []
+        # Sockets of the connected clients, closed while stopping
+        self._clients = set()
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._disconnecting = False
+
+    def __enter__(self) -> 'SubmissionServer':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+    def get_rate(self) -> float:
+        """
+        Get the number of sent messages per second since the start
+
+        :return: messages per second
+        """
+        elapsed = time.monotonic() - self.started_time
+        return self.sent / elapsed if elapsed else 0.0
+
+    def get_queued(self) -> int:
+        """
+        Get the number of messages waiting to be sent
+
+        :return: number of queued messages
+        """
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        """
+        Connect to the SMTP server and start listening on the socket
+        """
+        submit = self.submit
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def setup(self) -> None:
+                super().setup()
+                server._add_client(self.request)
+
+            def finish(self) -> None:
+                server._remove_client(self.request)
+                super().finish()
+
+            def handle(self) -> None:
+                while ((request := _read_frame(self.rfile)) is not None and
+                       (content := _read_frame(self.rfile)) is not None):
+                    try:
+                        request = json.loads(request)
+                        sender = request['sender']
+                        recipients = request['recipients']
+                        if (not isinstance(sender, str) or
+                                not isinstance(recipients, list) or
+                                not all(isinstance(recipient, str)
+                                        for recipient in recipients)):
+                            raise TypeError('Invalid message envelope')
+                        future = submit(RawMessage(sender=sender,
+                                                   recipients=recipients,
+                                                   content=content))
+                        if request['wait']:
+                            result = future.result()
+                            reply = {'accepted': result.accepted,
+                                     'refused': _encode_refused(
+                                         result.refused),
+                                     'error': _encode_error(result.error)}
+                        else:
+                            reply = None
+                    except Exception as error:
+                        # Reply to the bad request and wait for the next one
+                        reply = {'accepted': [],
+                                 'refused': {},
+                                 'error': _encode_error(RuntimeError(
+                                     f'{type(error).__name__}: {error}'))}
+                    self.wfile.write(_pack_json(reply))
+
+        self.started_time = time.monotonic()
+        self._stopped.clear()
+        self._stopping = False
+        self._disconnecting = False
+        # Establish the connections before accepting any message
+        self.pool.open()
+        self._threads = [threading.Thread(target=self._run,
+                                          daemon=True)
+                         for _ in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+        # Remove the socket left by a previous server
+        path = pathlib.Path(self.path)
+        if path.exists() and stat.S_ISSOCK(path.stat().st_mode):
+            path.unlink()
+        # Create the socket accessible only by the current user
+        umask = os.umask(0o177)
+        try:
+            self._server = socketserver.ThreadingUnixStreamServer(self.path,
+                                                                  Handler)
+        finally:
+            os.umask(umask)
+        self._threads.append(threading.Thread(
+            target=self._server.serve_forever,
+            daemon=True))
+        self._threads[-1].start()
+
+    def _add_client(self,
+                    client: socket.socket) -> None:
+        """
+        Track a connected client socket to close it while stopping
+
+        :param client: client socket
+        """
+        with self._lock:
+            self._clients.add(client)
+            if self._disconnecting:
+                # Accepted while the server was stopping
+                with contextlib.suppress(OSError):
+                    client.shutdown(socket.SHUT_RD)
+
+    def _remove_client(self,
+                       client: socket.socket) -> None:
+        """
+        Stop tracking a disconnected client socket
+
+        :param client: client socket
+        """
+        with self._lock:
+            self._clients.discard(client)
+
+    def stop(self) -> None:
+        """
+        Stop accepting new messages and wait for the queued messages
+
+        The clients still connected receive the replies for the messages
+        already submitted, then they are disconnected.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+        with self._lock:
+            # Refuse the messages submitted from now on
+            self._stopping = True
+        for _ in range(self.workers):
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        with self._lock:
+            # Wake up the handlers waiting for the next request
+            self._disconnecting = True
+            for client in self._clients:
+                with contextlib.suppress(OSError):
+                    client.shutdown(socket.SHUT_RD)
+        if self._server is not None:
+            # Wait for the handlers to complete
+            self._server.server_close()
+            self._server = None
+            pathlib.Path(self.path).unlink(missing_ok=True)
+        self._stopped.set()
+
+    def wait(self,
+             timeout: Optional[float] = None) -> bool:
+        """
+        Wait for the server to be stopped
+
+        :param timeout: seconds to wait or None to wait forever
+        :return: True if the server was stopped
+        """
+        return self._stopped.wait(timeout)
+
+    def submit(self,
+               message: Union[Message, FrozenMessage, RawMessage]
+               ) -> concurrent.futures.Future:
+        """
+        Queue a message to be sent
+
+        :param message: Message, FrozenMessage or RawMessage object to send
+        :return: Future object for the SendResult object
+        """
+        if not isinstance(message, (Message, FrozenMessage, RawMessage)):
+            raise TypeError(f'Cannot send {type(message).__name__} objects')
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._stopping:
+                raise RuntimeError('The submission server is stopping')
+            self._queue.put((message, future))
+        return future
+
+    def _run(self) -> None:
+        """
+        Send the queued messages in batches until stopped
+        """
+        while (item := self._queue.get()) is not None:
+            items = [item]
+            while len(items) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    # Stop after sending the current batch
+                    self._queue.put(None)
+                    break
+                items.append(item)
+            self._send(items)
+
+    def _send(self,
+              items: list[tuple[Union[Message, FrozenMessage],
+                                concurrent.futures.Future]]) -> None:
+        """
+        Send a batch of messages using a single connection
+
+        The messages not sent because the server closed the connection are
+        sent again once using a new connection.
+
+        :param items: messages to send and their Future objects
+        """
+        try:
+            results = self.pool.send_many([message for message, _ in items])
+        except Exception as error:
+            # Complete every Future so no client waits forever
+            results = [SendResult(message=message,
+                                  error=error)
+                       for message, _ in items]
+        for (_, future), result in zip(items, results):
+            with self._stats_lock:
+                if result.success:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+            future.set_result(result)
+
+
+class SubmissionClient(object):
+    """
+    Submit messages to a SubmissionServer using its Unix domain socket
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._socket = None
+        self._file = None
+
+    def __enter__(self) -> 'SubmissionClient':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def connect(self) -> None:
+        """
+        Connect to the server socket
+        """
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(self.path)
+        self._file = self._socket.makefile('rb')
+
+    def close(self) -> None:
+        """
+        Close the connection to the server
+        """
+        if self._socket is not None:
+            self._file.close()
+            self._socket.close()
+            self._file = None
+            self._socket = None
+
+    def submit(self,
+               message: Union[Message, FrozenMessage, RawMessage],
+               wait: bool = False) -> Optional[SendResult]:
+        """
+        Submit a message to the server, connecting on the first use
+
+        The message is serialized by the client, including its attachments
+        files.
+
+        :param message: Message, FrozenMessage or RawMessage object to send
+        :param wait: wait until the message has been sent
+        :return: SendResult object if wait is set, else None as soon as the
+                 message has been queued, or a SendResult object with the
+                 error if the server refused the request
+        """
+        if not isinstance(message, (Message, FrozenMessage, RawMessage)):
+            raise TypeError(f'Cannot send {type(message).__name__} objects')
+        raw_message = RawMessage.from_message(message)
+        if self._socket is None:
+            self.connect()
+        self._socket.sendall(_pack_json({'sender': raw_message.sender,
+                                         'recipients': raw_message.recipients,
+                                         'wait': wait}) +
+                             _pack_frame(raw_message.content))
+        reply = _read_frame(self._file)
+        if reply is None:
+            self.close()
+            raise ConnectionError('The submission server closed the '
+                                  'connection')
+        reply = json.loads(reply)
+        if reply is None:
+            return None
+        return SendResult(message=message,
+                          accepted=reply['accepted'],
+                          refused=_decode_refused(reply['refused']),
+                          error=_decode_error(reply['error']))
@@ -18,17 +18,169 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 ##
 
-from typing import Any
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import threading
+from typing import Any, Optional
 
 import yaml
 
+try:
+    # Use the faster LibYAML parser when available
+    from yaml import CLoader as Loader
+except ImportError:
+    from yaml import Loader
+
 
 class YamlProfile(object):
-    def __init__(self, filename: str):
+    # Directory for the parsed profiles cache shared between the processes,
+    # set using the MUMAILER_PROFILE_CACHE environment variable or
+    # set_cache_directory
+    cache_directory: Optional[str] = os.environ.get('MUMAILER_PROFILE_CACHE')
+    # Parsed profiles indexed by path, with the file key used to validate them
+    _cache: dict[str, tuple[tuple[int, ...], dict]] = {}
+    _cache_lock = threading.Lock()
+
+    def __init__(self,
+                 filename: Optional[str] = None,
+                 config: Optional[dict] = None):
+        """
+        Profile with the options loaded from a YAML file
+
+        :param filename: profile file to load
+        :param config: already parsed profile content to use instead of
+                       loading a file
+        """
         self.section_name = ''
-        with open(filename, 'r') as file:
-            self.config = yaml.load(stream=file,
-                                    Loader=yaml.Loader)
+        self.config = (config
+                       if config is not None
+                       else self.load(filename=filename))
+
+    @staticmethod
+    def set_cache_directory(directory: Optional[str]) -> None:
+        """
+        Set the directory for the parsed profiles cache on disk, for every
+        profile type
+
+        :param directory: cache directory path or None to disable it
+        """
+        YamlProfile.cache_directory = directory
+
+    @classmethod
+    def load(cls, filename: str) -> dict:
+        """
+        Load a YAML profile file, reusing the parsed content if the file was
+        not modified since the last time it was loaded
+
+        The returned dictionary is shared between the profiles for the same
+        file and it must not be modified.
+
+        :param filename: profile file to load
+        :return: parsed profile content
+        """
+        path = os.path.realpath(filename)
+        status = os.stat(path)
+        file_key = (status.st_mtime_ns, status.st_size, status.st_ino)
+        with cls._cache_lock:
+            cached_key, config = cls._cache.get(path, (None, None))
+        if cached_key != file_key:
+            config = cls._load_cached(path=path,
+                                      file_key=file_key)
+            if config is None:
+                with open(path, 'r') as file:
+                    config = yaml.load(stream=file,
+                                       Loader=Loader)
+                cls._save_cached(path=path,
+                                 file_key=file_key,
+                                 config=config)
+            with cls._cache_lock:
+                cls._cache[path] = (file_key, config)
+        return config
+
+    @classmethod
+    def _get_cache_path(cls, path: str) -> Optional[str]:
+        """
+        Get the path in the cache directory for a profile file
+
+        :param path: profile file real path
+        :return: cache file path or None if the disk cache is disabled
+        """
+        if not cls.cache_directory:
+            return None
+        return os.path.join(cls.cache_directory,
+                            hashlib.sha256(path.encode('utf-8')).hexdigest() +
+                            '.json')
+
+    @classmethod
+    def _load_cached(cls,
+                     path: str,
+                     file_key: tuple[int, ...]) -> Optional[dict]:
+        """
+        Load a parsed profile from the disk cache
+
+        The cache files are plain JSON data, used only if they're owned by
+        the current user and not writable by the others, so nobody else can
+        change the loaded settings.
+
+        :param path: profile file real path
+        :param file_key: current file key to validate the cached content
+        :return: parsed profile content or None if it's not cached
+        """
+        if not (cache_path := cls._get_cache_path(path)):
+            return None
+        try:
+            with open(cache_path, 'r') as file:
+                status = os.fstat(file.fileno())
+                if (status.st_mode & (stat.S_IWGRP | stat.S_IWOTH) or
+                        (hasattr(os, 'getuid') and
+                         status.st_uid != os.getuid())):
+                    return None
+                cached_key, config = json.load(file)
+        except (OSError, ValueError, TypeError):
+            return None
+        return config if tuple(cached_key) == file_key else None
+
+    @classmethod
+    def _save_cached(cls,
+                     path: str,
+                     file_key: tuple[int, ...],
+                     config: dict) -> None:
+        """
+        Save a parsed profile to the disk cache, ignoring any error
+
+        The profiles with values which JSON can't represent as they are,
+        like dates or numeric keys, are not cached.
+
+        :param path: profile file real path
+        :param file_key: file key to validate the cached content
+        :param config: parsed profile content
+        """
+        if not (cache_path := cls._get_cache_path(path)):
+            return
+        try:
+            data = json.dumps((file_key, config))
+        except (TypeError, ValueError):
+            return
+        if json.loads(data)[1] != config:
+            return
+        try:
+            os.makedirs(cls.cache_directory, mode=0o700, exist_ok=True)
+            handle, temporary = tempfile.mkstemp(dir=cls.cache_directory,
+                                                 prefix='.tmp-')
+        except OSError:
+            return
+        try:
+            with os.fdopen(handle, 'w') as file:
+                file.write(data)
+            os.replace(temporary, cache_path)
+        except OSError:
+            pass
+        finally:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
 
     def get_option(self, option: str, default: Any = None) -> Any:
         """
@@ -0,0 +1,81 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import unittest
+
+from mumailer import AsyncConnection, Message, Recipient
+from mumailer.benchmarks.smtp_sink import SmtpSink
+
+INJECTION = ('ok@example.com>\r\nRSET\r\nMAIL FROM:<ceo@corp.com>\r\n'
+             'RCPT TO:<injected@evil.com')
+
+
+def create_message(to: str = 'to@example.com',
+                   *bcc: str) -> Message:
+    return Message(sender=Recipient('Sender', 'sender@example.com'),
+                   subject='Test',
+                   body='Test message',
+                   to=[Recipient(None, to)],
+                   bcc=[Recipient(None, address) for address in bcc])
+
+
+class TestAsyncConnection(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.sink = SmtpSink()
+        self.sink.start()
+
+    def tearDown(self):
+        self.sink.stop()
+
+    async def asyncSetUp(self):
+        self.connection = AsyncConnection(server=self.sink.host,
+                                          port=self.sink.port)
+        self.connection.set_encryption(encryption=None)
+        await self.connection.connect()
+
+    async def asyncTearDown(self):
+        await self.connection.disconnect()
+
+    async def test_send(self):
+        refused = await self.connection.send(
+            create_message('to@example.com', 'refused@example.com'))
+        self.assertEqual(list(refused), ['refused@example.com'])
+        self.assertEqual(self.sink.messages, 1)
+        self.assertEqual(self.sink.recipients, 1)
+
+    async def test_send_injection(self):
+        with self.assertRaises(ValueError):
+            await self.connection.send(create_message('to@example.com',
+                                                      INJECTION))
+        with self.assertRaises(ValueError):
+            await self.connection.send(create_message(INJECTION))
+        # The session is still in step after the refused messages
+        self.assertEqual(await self.connection.send(create_message()), {})
+        self.assertEqual(self.sink.messages, 1)
+        self.assertEqual(self.sink.recipients, 1)
+
+    async def test_command_injection(self):
+        with self.assertRaises(ValueError):
+            await self.connection._command('NOOP\r\nRSET')
+        await self.connection.noop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import unittest
+
+from mumailer import Connection, Message, Recipient
+from mumailer.benchmarks.smtp_sink import SmtpSink
+
+INJECTION = ('ok@example.com>\r\nRSET\r\nMAIL FROM:<ceo@corp.com>\r\n'
+             'RCPT TO:<injected@evil.com')
+
+
+def create_message(to: str = 'to@example.com',
+                   *bcc: str) -> Message:
+    return Message(sender=Recipient('Sender', 'sender@example.com'),
+                   subject='Test',
+                   body='Test message',
+                   to=[Recipient(None, to)],
+                   bcc=[Recipient(None, address) for address in bcc])
+
+
+class TestConnection(unittest.TestCase):
+    def setUp(self):
+        self.sink = SmtpSink()
+        self.sink.start()
+        self.connection = Connection(server=self.sink.host,
+                                     port=self.sink.port)
+        self.connection.set_encryption(encryption=None)
+        self.connection.connect()
+
+    def tearDown(self):
+        self.connection.disconnect()
+        self.sink.stop()
+
+    def test_send_many(self):
+        results = self.connection.send_many([
+            create_message('to@example.com', 'a@example.com'),
+            create_message('refused@example.com'),
+            create_message()])
+        self.assertEqual([result.success for result in results],
+                         [True, False, True])
+        self.assertEqual(results[0].accepted,
+                         ['to@example.com', 'a@example.com'])
+        self.assertEqual(results[1].refused['refused@example.com'][0], 550)
+        self.assertEqual(self.sink.messages, 2)
+
+    def test_send_many_injection(self):
+        results = self.connection.send_many([
+            create_message('to@example.com', INJECTION),
+            create_message('a@example.com')])
+        self.assertIsInstance(results[0].error, ValueError)
+        self.assertEqual(results[0].accepted, [])
+        self.assertTrue(results[1].success)
+        # Only the second message reached the server
+        self.assertEqual(self.sink.messages, 1)
+        self.assertEqual(self.sink.recipients, 1)
+
+    def test_send_injection(self):
+        with self.assertRaises(ValueError):
+            self.connection.send(create_message('to@example.com',
+                                                INJECTION))
+        self.assertEqual(self.connection.send(create_message()), {})
+        self.assertEqual(self.sink.recipients, 1)
+
+    def test_send_chunked_injection(self):
+        self.connection.set_max_recipients(2)
+        result = self.connection.send_chunked(
+            message=create_message(),
+            recipients=iter(['a@example.com', INJECTION, 'b@example.com']))
+        self.assertTrue(result.success)
+        self.assertEqual(result.accepted, ['a@example.com', 'b@example.com'])
+        self.assertEqual(result.refused[INJECTION][0], 501)
+        self.assertEqual(self.sink.recipients, 2)
+
+
+class TestConnectionLimits(unittest.TestCase):
+    def setUp(self):
+        # The limit is not advertised, so the recipients are not split
+        # before sending them
+        self.sink = SmtpSink(max_recipients=2,
+                             advertise_limits=False)
+        self.sink.start()
+        self.connection = Connection(server=self.sink.host,
+                                     port=self.sink.port)
+        self.connection.set_encryption(encryption=None)
+        self.connection.connect()
+
+    def tearDown(self):
+        self.connection.disconnect()
+        self.sink.stop()
+
+    def test_send_too_many_recipients(self):
+        addresses = [f'user{index}@example.com' for index in range(5)]
+        refused = self.connection.send(create_message(*addresses))
+        self.assertEqual(refused, {})
+        self.assertEqual(self.sink.messages, 3)
+        self.assertEqual(self.sink.recipients, 5)
+
+    def test_send_many_too_many_recipients(self):
+        addresses = [f'user{index}@example.com' for index in range(5)]
+        results = self.connection.send_many([create_message(*addresses),
+                                             create_message()])
+        self.assertTrue(all(result.success for result in results))
+        self.assertEqual(results[0].accepted, addresses)
+        self.assertEqual(results[0].refused, {})
+        self.assertEqual(self.sink.recipients, 6)
+
+    def test_send_chunked(self):
+        self.connection.set_max_recipients(None)
+        addresses = [f'user{index}@example.com' for index in range(5)]
+        result = self.connection.send_chunked(message=create_message(),
+                                              recipients=addresses)
+        self.assertEqual(result.accepted, addresses)
+        self.assertEqual(self.sink.messages, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import unittest
+
+from mumailer import ConnectionPool, Message, Recipient
+from mumailer.benchmarks.smtp_sink import SmtpSink
+
+
+def create_message(to: str = 'to@example.com') -> Message:
+    return Message(sender=Recipient('Sender', 'sender@example.com'),
+                   subject='Test',
+                   body='Test message',
+                   to=[Recipient(None, to)])
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.sink = SmtpSink()
+        self.sink.start()
+        self.pool = ConnectionPool(server=self.sink.host,
+                                   port=self.sink.port,
+                                   size=1)
+
+    def tearDown(self):
+        self.pool.close()
+        self.sink.stop()
+
+    def test_reuse(self):
+        with self.pool.connection() as connection:
+            pass
+        with self.pool.connection() as reused:
+            self.assertIs(reused, connection)
+            # The pool size is reached while the connection is in use
+            with self.assertRaises(TimeoutError):
+                self.pool.acquire(timeout=0.01)
+
+    def test_max_messages(self):
+        self.pool.max_messages = 2
+        connection = self.pool.acquire()
+        self.pool.release(connection=connection,
+                          messages=1)
+        self.assertIs(self.pool.acquire(), connection)
+        self.pool.release(connection=connection,
+                          messages=1)
+        # The connection has sent too many messages to be reused
+        with self.pool.connection() as replaced:
+            self.assertIsNot(replaced, connection)
+
+    def test_broken_connection(self):
+        self.pool.check_interval = 0
+        with self.pool.connection() as connection:
+            connection.connection.close()
+        # The idle connection is checked and replaced
+        self.assertEqual(self.pool.send(create_message()), {})
+        self.assertEqual(self.sink.messages, 1)
+
+    def test_send_many(self):
+        results = self.pool.send_many([create_message(),
+                                       create_message('refused@example.com'),
+                                       create_message()])
+        self.assertEqual([result.success for result in results],
+                         [True, False, True])
+        self.assertEqual(self.sink.messages, 2)
+
+    def test_closed(self):
+        self.pool.close()
+        with self.assertRaises(RuntimeError):
+            self.pool.acquire()
+        results = self.pool.send_many([create_message()])
+        self.assertIsInstance(results[0].error, RuntimeError)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import unittest
+
+from mumailer import MergeTemplate, Recipient
+
+
+class TestMergeTemplate(unittest.TestCase):
+    def test_placeholders(self):
+        template = MergeTemplate('Dear {name}, you owe {amount:.2f}')
+        self.assertEqual(template.render({'name': 'Foo', 'amount': 3}),
+                         'Dear Foo, you owe 3.00')
+
+    def test_escaped_braces(self):
+        template = MergeTemplate('<style>p {{ color: red }}</style>{name}')
+        self.assertEqual(template.render({'name': 'Foo'}),
+                         '<style>p { color: red }</style>Foo')
+
+    def test_unescaped_braces(self):
+        for text in ('<style>p { color: red }</style>',
+                     'p {color: red}',
+                     'open {',
+                     'close }',
+                     'empty {}'):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    MergeTemplate(text)
+
+    def test_conversions(self):
+        record = {'name': 'Fabiò'}
+        self.assertEqual(MergeTemplate('{name!s}').render(record), 'Fabiò')
+        self.assertEqual(MergeTemplate('{name!r}').render(record),
+                         "'Fabiò'")
+        self.assertEqual(MergeTemplate('{name!a}').render(record),
+                         "'Fabi\\xf2'")
+
+    def test_unsupported_fields(self):
+        for text in ('{name!z}', '{name:{width}}'):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    MergeTemplate(text)
+
+    def test_lookups(self):
+        record = {'user': Recipient('Foo', 'foo@example.com'),
+                  'emails': ['a@example.com', 'b@example.com'],
+                  'address': {'city': 'Rome'},
+                  '0': 'zero'}
+        template = MergeTemplate('{user.name!r} {emails[1]:>15} '
+                                 '{address[city]} {0}')
+        self.assertEqual(template.render(record),
+                         "'Foo'   b@example.com Rome zero")
+
+    def test_invalid_lookups(self):
+        for text in ('{user._secret}', '{user.__class__}', '{.name}',
+                     '{user.}', '{emails[0]x}', '{}'):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    MergeTemplate(text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import os
+import pickle
+import socket
+import sqlite3
+import tempfile
+import unittest
+
+from mumailer import (ConnectionPool, Message, Outbox, OutboxWorker,
+                      RawMessage, Recipient, RetryPolicy)
+from mumailer.benchmarks.smtp_sink import SmtpSink
+
+
+def create_message(to: str = 'to@example.com') -> Message:
+    return Message(sender=Recipient('Sender', 'sender@example.com'),
+                   subject='Test',
+                   body='Test message',
+                   to=[Recipient(None, to)])
+
+
+def get_closed_port() -> int:
+    with socket.socket() as listener:
+        listener.bind(('127.0.0.1', 0))
+        return listener.getsockname()[1]
+
+
+class TestOutbox(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.outbox = Outbox(filename=os.path.join(self.directory.name,
+                                                   'outbox.db'),
+                             policy=RetryPolicy(max_attempts=3,
+                                                initial_delay=60,
+                                                jitter=0))
+
+    def tearDown(self):
+        self.outbox.close()
+        self.directory.cleanup()
+
+    def test_send(self):
+        for to in ('to@example.com', 'refused@example.com'):
+            self.outbox.enqueue(create_message(to))
+        with SmtpSink() as sink, ConnectionPool(server=sink.host,
+                                                port=sink.port) as pool:
+            worker = OutboxWorker(outbox=self.outbox,
+                                  pool=pool)
+            worker.run(until_empty=True)
+        self.assertEqual((worker.sent, worker.failed, worker.retried),
+                         (1, 1, 0))
+        self.assertEqual(self.outbox.get_counts(),
+                         {Outbox.STATUS_SENT: 1, Outbox.STATUS_FAILED: 1})
+        self.assertEqual(sink.messages, 1)
+
+    def test_unreachable_server(self):
+        for _ in range(5):
+            self.outbox.enqueue(create_message())
+        with ConnectionPool(server='127.0.0.1',
+                            port=get_closed_port()) as pool:
+            worker = OutboxWorker(outbox=self.outbox,
+                                  pool=pool)
+            # The delayed messages are not claimed again immediately
+            worker.run(until_empty=True)
+        self.assertEqual((worker.sent, worker.failed, worker.retried),
+                         (0, 0, 5))
+        self.assertEqual(self.outbox.get_counts(),
+                         {Outbox.STATUS_QUEUED: 5})
+        self.assertEqual(self.outbox.claim(), [])
+
+    def test_release(self):
+        identifier = self.outbox.enqueue(create_message())
+        for attempt in range(1, 4):
+            # Make the delayed message ready for the next attempt
+            self.outbox._database.execute('UPDATE messages '
+                                          'SET next_time = NULL')
+            self.assertEqual([row[0] for row in self.outbox.claim()],
+                             [identifier])
+            failed = self.outbox.release(identifiers=[identifier],
+                                         error='temporary error')
+            self.assertEqual(failed, 1 if attempt == 3 else 0)
+        self.assertEqual(self.outbox.get_counts(),
+                         {Outbox.STATUS_FAILED: 1})
+
+    def test_stored_message(self):
+        message = create_message()
+        message.bcc = [Recipient(None, 'bcc@example.com')]
+        identifier = self.outbox.enqueue(message)
+        ((claimed_identifier, claimed), ) = self.outbox.claim()
+        self.assertEqual(claimed_identifier, identifier)
+        self.assertIsInstance(claimed, RawMessage)
+        self.assertEqual(claimed.sender, 'sender@example.com')
+        self.assertEqual(claimed.recipients,
+                         ['to@example.com', 'bcc@example.com'])
+        self.assertIn(b'Subject: Test\r\n', claimed.content)
+        self.assertNotIn(b'bcc@example.com', claimed.content)
+
+    def test_pickled_messages(self):
+        # Outbox created by an older version with the pickled messages
+        filename = os.path.join(self.directory.name, 'old.db')
+        database = sqlite3.connect(filename)
+        database.execute('CREATE TABLE messages ('
+                         'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                         'status TEXT NOT NULL, '
+                         'data BLOB NOT NULL, '
+                         'attempts INTEGER NOT NULL DEFAULT 0, '
+                         'queued_time REAL NOT NULL, '
+                         'lease_time REAL, '
+                         'sent_time REAL, '
+                         'error TEXT)')
+        database.execute('INSERT INTO messages (status, data, queued_time) '
+                         'VALUES (?, ?, 0)',
+                         (Outbox.STATUS_QUEUED,
+                          pickle.dumps(create_message())))
+        database.commit()
+        database.close()
+        outbox = Outbox(filename=filename)
+        try:
+            self.assertEqual(outbox.claim(), [])
+            self.assertEqual(outbox.get_counts(),
+                             {Outbox.STATUS_FAILED: 1})
+        finally:
+            outbox.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import multiprocessing
+import threading
+import unittest
+
+from mumailer import (ConnectionSettings, Message, ProcessSender,
+                      RateLimitExceeded, RateLimiter, Recipient,
+                      SharedRateLimiter)
+from mumailer.benchmarks.smtp_sink import SmtpSink
+
+
+def create_message(to: str = 'to@example.com') -> Message:
+    return Message(sender=Recipient('Sender', 'sender@example.com'),
+                   subject='Test',
+                   body='Test message',
+                   to=[Recipient(None, to)])
+
+
+def reserve(rate_limiter: RateLimiter,
+            count: int) -> None:
+    rate_limiter.reserve(count=count)
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_max_delay(self):
+        rate_limiter = RateLimiter(rate=0.001,
+                                   burst=2,
+                                   max_delay=0)
+        rate_limiter.acquire(count=2)
+        with self.assertRaises(RateLimitExceeded):
+            rate_limiter.acquire()
+        self.assertIsNone(rate_limiter.reserve(max_delay=60))
+        self.assertGreater(rate_limiter.reserve(), 900)
+
+    def test_daily_quota(self):
+        rate_limiter = RateLimiter(daily_quota=3)
+        self.assertEqual(rate_limiter.reserve(count=3), 0)
+        self.assertAlmostEqual(rate_limiter.reserve(),
+                               RateLimiter.DAY / 3,
+                               delta=1)
+
+    def test_shared(self):
+        rate_limiter = SharedRateLimiter(rate=0.001,
+                                         burst=3,
+                                         max_delay=0)
+        process = multiprocessing.Process(target=reserve,
+                                          args=(rate_limiter, 2))
+        process.start()
+        process.join()
+        self.assertEqual(process.exitcode, 0)
+        # The tokens reserved by the other process are not available
+        rate_limiter.acquire()
+        with self.assertRaises(RateLimitExceeded):
+            rate_limiter.acquire()
+
+
+class TestProcessSender(unittest.TestCase):
+    def test_shared_limits(self):
+        statuses = []
+        with SmtpSink() as sink:
+            # Every message goes to the same process, which can use the
+            # whole daily quota
+            sender = ProcessSender(settings=ConnectionSettings(
+                                       server=sink.host,
+                                       port=sink.port,
+                                       daily_quota=4),
+                                   processes=2)
+            thread = threading.Thread(
+                target=lambda: statuses.extend(sender.send(
+                    create_message() for _ in range(4))),
+                daemon=True)
+            thread.start()
+            thread.join(timeout=30)
+            self.assertFalse(thread.is_alive(),
+                             'The messages were delayed by the limits')
+        self.assertEqual(sorted(status.index for status in statuses),
+                         [0, 1, 2, 3])
+        self.assertTrue(all(status.success for status in statuses))
+        self.assertEqual(sink.messages, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
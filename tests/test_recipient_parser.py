@@ -0,0 +1,75 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import gc
+import unittest
+
+from mumailer import RecipientParser
+
+
+class TestRecipientParser(unittest.TestCase):
+    def test_plain_addresses(self):
+        parser = RecipientParser()
+        recipients = parser.parse(['foo@example.com',
+                                   'bar@EXAMPLE.com',
+                                   'foo@example.COM'])
+        self.assertEqual([recipient.address for recipient in recipients],
+                         ['foo@example.com', 'bar@example.com'])
+        self.assertEqual(parser.invalid, [])
+        self.assertEqual(parser.duplicates, 1)
+
+    def test_at_signs_for_each_line(self):
+        # The at signs must not be counted for the whole batch
+        parser = RecipientParser()
+        self.assertEqual(parser.parse(['a@b@c.org', 'dave']), [])
+        self.assertEqual(parser.invalid, ['a@b@c.org', 'dave'])
+        parser = RecipientParser()
+        self.assertEqual(parser.parse(['Dave dave', 'A <a@b@c.org>']), [])
+        self.assertEqual(parser.invalid, ['Dave dave', 'A <a@b@c.org>'])
+
+    def test_invalid_with_valid(self):
+        parser = RecipientParser()
+        recipients = parser.parse(['foo@example.com',
+                                   'a@b@c.org',
+                                   'dave',
+                                   'Bar <bar@example.com>'])
+        self.assertEqual([(recipient.name, recipient.address)
+                          for recipient in recipients],
+                         [(None, 'foo@example.com'),
+                          ('Bar', 'bar@example.com')])
+        self.assertEqual(parser.invalid, ['a@b@c.org', 'dave'])
+
+    def test_garbage_collector(self):
+        # The collector is process-wide, other threads rely on it
+        states = []
+
+        class Items(list):
+            def __iter__(self):
+                states.append(gc.isenabled())
+                return super().__iter__()
+
+        RecipientParser().parse(Items(['foo@example.com',
+                                       'Bar <bar@example.com>']))
+        self.assertTrue(states)
+        self.assertTrue(all(states))
+
+
+if __name__ == '__main__':
+    unittest.main()
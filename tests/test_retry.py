@@ -0,0 +1,106 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import socket
+import unittest
+
+from mumailer import (ConnectionPool, Message, Recipient, RetryPolicy,
+                      RetrySender)
+from mumailer.benchmarks.smtp_sink import SmtpSink
+
+
+def create_message(*addresses: str) -> Message:
+    return Message(sender=Recipient('Sender', 'sender@example.com'),
+                   subject='Test',
+                   body='Test message',
+                   to=[Recipient(None, address) for address in addresses])
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_get_delay(self):
+        policy = RetryPolicy(initial_delay=1,
+                             max_delay=5,
+                             jitter=0)
+        self.assertEqual([policy.get_delay(attempt=attempt)
+                          for attempt in range(1, 5)],
+                         [1, 2, 4, 5])
+
+    def test_jitter(self):
+        policy = RetryPolicy(initial_delay=10,
+                             jitter=0.5)
+        for _ in range(20):
+            self.assertTrue(5 <= policy.get_delay(attempt=1) <= 10)
+
+
+class TestRetrySender(unittest.TestCase):
+    def setUp(self):
+        self.sink = SmtpSink()
+        self.sink.start()
+        self.policy = RetryPolicy(max_attempts=3,
+                                  initial_delay=0.01,
+                                  jitter=0)
+
+    def tearDown(self):
+        self.sink.stop()
+
+    def test_deferred_recipient(self):
+        with ConnectionPool(server=self.sink.host,
+                            port=self.sink.port) as pool:
+            with RetrySender(pool=pool,
+                             policy=self.policy) as sender:
+                (result, ) = sender.send([
+                    create_message('to@example.com', 'deferred@example.com',
+                                   'refused@example.com')])
+        self.assertTrue(result.success)
+        self.assertEqual(result.accepted,
+                         ['to@example.com', 'deferred@example.com'])
+        self.assertEqual(list(result.refused), ['refused@example.com'])
+        self.assertEqual((sender.sent, sender.failed, sender.retried),
+                         (1, 0, 1))
+        # Only the deferred recipient was sent again
+        self.assertEqual((self.sink.messages, self.sink.recipients), (2, 2))
+
+    def test_refused_recipient(self):
+        with ConnectionPool(server=self.sink.host,
+                            port=self.sink.port) as pool:
+            with RetrySender(pool=pool,
+                             policy=self.policy) as sender:
+                (result, ) = sender.send([
+                    create_message('refused@example.com')])
+        self.assertFalse(result.success)
+        self.assertEqual((sender.sent, sender.failed, sender.retried),
+                         (0, 1, 0))
+
+    def test_unreachable_server(self):
+        with socket.socket() as listener:
+            listener.bind(('127.0.0.1', 0))
+            port = listener.getsockname()[1]
+        with ConnectionPool(server='127.0.0.1',
+                            port=port) as pool:
+            with RetrySender(pool=pool,
+                             policy=self.policy) as sender:
+                (result, ) = sender.send([create_message('to@example.com')])
+        self.assertIsInstance(result.error, ConnectionRefusedError)
+        self.assertEqual((sender.sent, sender.failed, sender.retried),
+                         (0, 1, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import unittest
+
+from mumailer import (ConnectionPool, Message, RateLimiter, Recipient,
+                      Router)
+from mumailer.benchmarks.smtp_sink import SmtpSink
+
+
+def create_message(*addresses: str) -> Message:
+    return Message(sender=Recipient('Sender', 'sender@example.com'),
+                   subject='Test',
+                   body='Test message',
+                   to=[Recipient(None, address) for address in addresses])
+
+
+class TestRouter(unittest.TestCase):
+    def setUp(self):
+        self.sink_a = SmtpSink()
+        self.sink_a.start()
+        self.sink_b = SmtpSink()
+        self.sink_b.start()
+        # The second route can send a single message without waiting
+        self.limiter = RateLimiter(rate=0.001,
+                                   max_delay=0)
+        self.router = Router(default='a')
+        self.router.add_route(name='a',
+                              domains=['a.example.com'],
+                              pool=ConnectionPool(server=self.sink_a.host,
+                                                  port=self.sink_a.port))
+        self.router.add_route(name='b',
+                              domains=['*.b.example.com'],
+                              pool=ConnectionPool(server=self.sink_b.host,
+                                                  port=self.sink_b.port,
+                                                  rate_limiter=self.limiter))
+
+    def tearDown(self):
+        self.router.close()
+        self.sink_a.stop()
+        self.sink_b.stop()
+
+    def test_get_route(self):
+        self.assertEqual(self.router.get_route('foo@A.example.com'), 'a')
+        self.assertEqual(self.router.get_route('foo@mx.b.example.com'), 'b')
+        self.assertEqual(self.router.get_route('foo@b.example.com'), 'a')
+
+    def test_send(self):
+        results = self.router.send(create_message('foo@a.example.com',
+                                                  'bar@mx.b.example.com',
+                                                  'baz@other.org'))
+        self.assertEqual(results['a'].accepted,
+                         ['foo@a.example.com', 'baz@other.org'])
+        self.assertEqual(results['b'].accepted, ['bar@mx.b.example.com'])
+        self.assertEqual((self.sink_a.recipients, self.sink_b.recipients),
+                         (2, 1))
+
+    def test_rate_limit_exceeded(self):
+        message = create_message('foo@a.example.com', 'bar@mx.b.example.com')
+        self.assertTrue(all(result.success
+                            for result in self.router.send(message).values()))
+        # The second route is over its limit, the first route results are
+        # returned anyway
+        results = self.router.send(message)
+        self.assertTrue(results['a'].success)
+        self.assertFalse(results['b'].success)
+        self.assertTrue(results['b'].transient)
+        self.assertEqual((self.sink_a.messages, self.sink_b.messages),
+                         (2, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+##
+#     Project: MuMailer
+# Description: Simple mailer agent using SMTP
+#      Author: Fabio Castelli (Muflone) <muflone@muflone.com>
+#   Copyright: 2021-2023 Fabio Castelli
+#     License: GPL-3+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+##
+
+import os
+import smtplib
+import socket
+import tempfile
+import threading
+import unittest
+
+from mumailer import (ConnectionPool, Message, Recipient, SubmissionClient,
+                      SubmissionServer)
+from mumailer.submission import _pack_frame, _read_frame
+from mumailer.benchmarks.smtp_sink import SmtpSink
+
+
+def create_message(to: str = 'to@example.com') -> Message:
+    return Message(sender=Recipient('Sender', 'sender@example.com'),
+                   subject='Test',
+                   body='Test message',
+                   to=[Recipient(None, to)])
+
+
+class TestSubmissionServer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.sink = SmtpSink()
+        self.sink.start()
+        self.pool = ConnectionPool(server=self.sink.host,
+                                   port=self.sink.port,
+                                   size=1)
+        self.server = SubmissionServer(pool=self.pool,
+                                       path=os.path.join(self.directory.name,
+                                                         'mumailer.sock'))
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+        self.pool.close()
+        self.sink.stop()
+        self.directory.cleanup()
+
+    def stop_server(self) -> None:
+        thread = threading.Thread(target=self.server.stop,
+                                  daemon=True)
+        thread.start()
+        thread.join(timeout=10)
+        self.assertFalse(thread.is_alive(), 'The server did not stop')
+
+    def test_submit(self):
+        with SubmissionClient(path=self.server.path) as client:
+            result = client.submit(create_message(),
+                                   wait=True)
+            self.assertTrue(result.success)
+            result = client.submit(create_message('refused@example.com'),
+                                   wait=True)
+            self.assertFalse(result.success)
+            self.assertEqual(list(result.refused), ['refused@example.com'])
+            self.assertEqual(result.refused['refused@example.com'][0], 550)
+            # The errors are sent as the same exception classes
+            self.assertIsInstance(result.error,
+                                  smtplib.SMTPRecipientsRefused)
+            self.assertEqual(result.error.recipients, result.refused)
+            self.assertFalse(result.transient)
+            with self.assertRaises(TypeError):
+                client.submit('not a message')
+            self.assertIsNone(client.submit(create_message()))
+        self.stop_server()
+        self.assertEqual(self.sink.messages, 2)
+        self.assertEqual((self.server.sent, self.server.failed), (2, 1))
+
+    def test_bad_request(self):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(self.server.path)
+            # Pickled objects are not loaded
+            client.sendall(_pack_frame(b'\x80\x04N.') + _pack_frame(b''))
+            with client.makefile('rb') as file:
+                reply = _read_frame(file)
+        self.assertIn(b'"RuntimeError"', reply)
+        self.assertEqual(self.sink.messages, 0)
+
+    def test_stop_with_connected_client(self):
+        with SubmissionClient(path=self.server.path) as client:
+            self.assertIsNone(client.submit(create_message()))
+            # The client keeps its connection open while stopping
+            self.stop_server()
+            self.assertEqual(self.sink.messages, 1)
+            with self.assertRaises(OSError):
+                client.submit(create_message())
+
+
+if __name__ == '__main__':
+    unittest.main()